@@ -1,51 +1,126 @@
 import os
+import threading
 from typing import Dict, List
 # Recomendado: Usar ChatVertexAI para mejor soporte JSON, si no ChatGoogleGenerativeAI
 from langchain_google_vertexai import ChatVertexAI, VertexAIEmbeddings
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import BaseMessage, AIMessage, HumanMessage
+from langchain_core.messages import BaseMessage, AIMessage, AIMessageChunk, HumanMessage, messages_from_dict
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.runnables import RunnableMap, RunnablePassthrough, RunnableLambda
+from langchain_core.runnables import RunnableConfig, RunnableMap, RunnablePassthrough, RunnableLambda
 from langchain_core.documents import Document
 from langchain_core.output_parsers import StrOutputParser
-from postgres_db import get_by_session_id, checkpoint
-from weaviate_db import get_weaviate_retriever
+from postgres_db import get_by_session_id, get_async_by_session_id
+from history_window import get_windowed_history, get_async_windowed_history
+from vector_backends import get_retriever as get_backend_retriever
 from prompts import prompt_niilo
-from configs import get_secret
+from configs import get_secret, on_secret_change
 from helpers import time_now
+from semantic_cache import SemanticCache
+from retrieval_cache import bump_collection_version
 
-# --- Configuración LLM ---
-# Asegúrate de tener las variables de entorno o credenciales configuradas
-secret_name = os.environ.get("AGENT_SECRET_NAME")
-agent_configs: dict = get_secret(secret_name)
+# Los clientes (secretos, LLMs, embeddings, retriever, cadenas) se construyen en
+# el primer uso o desde el lifespan de FastAPI: importar este módulo no hace I/O.
 PROJECT_ID = os.environ.get("GOOGLE_PROJECT_ID")
 LOCATION = os.environ.get("GOOGLE_LOCATION", "us-central1")
-MODEL_NAME = agent_configs.get("MODEL_NAME", "gemini-2.0-flash")
-os.environ['GOOGLE_API_KEY'] = agent_configs.get('GOOGLE_API_KEY')
-
-# LLM para conversación (Niilo) - Más creativo
-llm_chat = ChatGoogleGenerativeAI(
-    model=MODEL_NAME, # Revisa el modelo más adecuado
-    temperature=0.9, # Permite respuestas más naturales
-    max_output_tokens=None,
-    # streaming=True # Habilita si necesitas streaming de tokens
-)
-
-# LLM para tareas estructuradas (Routing, Análisis Fórmulas, Extracción Params) - Preciso
-llm_structured = ChatGoogleGenerativeAI(
-    model=MODEL_NAME,
-    temperature=0.0, # Determinista para JSON/Clasificación
-    max_output_tokens=2048, # Ajusta si el JSON es grande
-)
+
+_clients: Dict[str, object] = {}
+_client_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+# Clientes construidos con AGENT_SECRET_NAME (modelo y GOOGLE_API_KEY): se leen
+# una vez y se reconstruyen cuando configs detecta que el secreto rotó
+_AGENT_SECRET_CLIENTS = ("agent_configs", "llm_chat", "llm_structured", "rag_chain_niilo", "chain_with_history", "achain_with_history")
+
+
+def _on_agent_secret_change(agent_configs: dict) -> None:
+    for name in _AGENT_SECRET_CLIENTS:
+        _clients.pop(name, None)
+
+
+on_secret_change(os.environ.get("AGENT_SECRET_NAME"), _on_agent_secret_change)
+
+
+def _get_or_create(name: str, factory):
+    """Devuelve el cliente `name`, creándolo una sola vez (un lock por cliente)."""
+    client = _clients.get(name)
+    if client is None:
+        with _locks_guard:
+            lock = _client_locks.setdefault(name, threading.Lock())
+        with lock:
+            client = _clients.get(name)
+            if client is None:
+                client = factory()
+                _clients[name] = client
+    return client
+
+
+# --- Configuración LLM ---
+def _load_agent_configs() -> dict:
+    # Asegúrate de tener las variables de entorno o credenciales configuradas
+    agent_configs: dict = get_secret(os.environ.get("AGENT_SECRET_NAME"))
+    os.environ['GOOGLE_API_KEY'] = agent_configs.get('GOOGLE_API_KEY')
+    return agent_configs
+
+def get_agent_configs() -> dict:
+    return _get_or_create("agent_configs", _load_agent_configs)
+
+def get_model_name() -> str:
+    return get_agent_configs().get("MODEL_NAME", "gemini-2.0-flash")
+
+def get_llm_chat() -> ChatGoogleGenerativeAI:
+    # LLM para conversación (Niilo) - Más creativo
+    return _get_or_create("llm_chat", lambda: ChatGoogleGenerativeAI(
+        model=get_model_name(), # Revisa el modelo más adecuado
+        temperature=0.9, # Permite respuestas más naturales
+        max_output_tokens=None,
+        streaming=True # Tokens disponibles para el endpoint de streaming (SSE)
+    ))
+
+def get_llm_structured() -> ChatGoogleGenerativeAI:
+    # LLM para tareas estructuradas (Routing, Análisis Fórmulas, Extracción Params) - Preciso
+    return _get_or_create("llm_structured", lambda: ChatGoogleGenerativeAI(
+        model=get_model_name(),
+        temperature=0.0, # Determinista para JSON/Clasificación
+        max_output_tokens=2048, # Ajusta si el JSON es grande
+    ))
 
 # --- Embeddings y Retriever ---
-embeddings = VertexAIEmbeddings(
-    model_name="text-embedding-004",
-    project=PROJECT_ID,
-    location=LOCATION
-)
-# Asume que esta función retorna un retriever compatible con Langchain
-retriever = get_weaviate_retriever(embeddings)
+def get_embeddings() -> VertexAIEmbeddings:
+    return _get_or_create("embeddings", lambda: VertexAIEmbeddings(
+        model_name="text-embedding-004",
+        project=PROJECT_ID,
+        location=LOCATION
+    ))
+
+def get_retriever():
+    # Asume que esta función retorna un retriever compatible con Langchain
+    # Backend según RAG_BACKEND (ver vector_backends)
+    return _get_or_create("retriever", lambda: get_backend_retriever(get_embeddings()))
+
+def get_answer_cache() -> SemanticCache:
+    # Cache semántico de respuestas de Niilo (se activa con SEMANTIC_CACHE_ENABLED).
+    # Comparte el cache de embeddings de consultas con el retriever.
+    def build():
+        retriever = get_retriever()
+        return SemanticCache(retriever.embeddings.embed_query, retriever.embeddings.aembed_query)
+    return _get_or_create("answer_cache", build)
+
+
+def invalidate_rag_caches():
+    """Invalida los caches que dependen de la colección "Rag" (tras una re-ingesta)."""
+    bump_collection_version()
+    if "answer_cache" in _clients:
+        _clients["answer_cache"].invalidate()
+
+
+def init_clients():
+    """Construye los clientes del agente (lo llama el lifespan; requiere Weaviate conectado)."""
+    get_llm_chat()
+    get_llm_structured()
+    get_answer_cache()
+    get_chain_with_history()
+    get_achain_with_history()
 
 # --- Cadena RAG para Niilo (Núcleo Conversacional) ---
 
@@ -62,15 +137,29 @@ def format_docs(docs: List[Document]) -> str:
 
     return info
 
-def get_info_to_docs(info):
+def get_retrieval_options(config: RunnableConfig = None) -> dict:
+    """Opciones de búsqueda del turno (`configurable.retrieval`, ver chatbot._build_turn_input)."""
+    options = ((config or {}).get("configurable") or {}).get("retrieval") or {}
+    return {key: value for key, value in options.items() if value is not None}
+
+def get_info_to_docs(info, config: RunnableConfig = None):
+    # Si el grafo ya recuperó el contexto (recuperación especulativa), se reutiliza
+    if info.get('context') is not None:
+        return info['context']
+    msg: HumanMessage = info['question']
+    return format_docs(get_retriever().invoke(msg.content, **get_retrieval_options(config)))
+
+async def aget_info_to_docs(info, config: RunnableConfig = None):
+    if info.get('context') is not None:
+        return info['context']
     msg: HumanMessage = info['question']
-    return format_docs(retriever.invoke(msg.content))
+    return format_docs(await get_retriever().ainvoke(msg.content, **get_retrieval_options(config)))
 
 def add_kwargs_to_ai_message(message: AIMessage):
     ai_kwargs = {
         "created_at": time_now(),
         # Podrías añadir más info relevante del AI aquí:
-        "model_used": MODEL_NAME, # Si está accesible
+        "model_used": get_model_name(), # Si está accesible
         # "token_usage": response_metadata.get("usage_metadata"), # Si obtienes metadata
     }
 
@@ -79,25 +168,36 @@ def add_kwargs_to_ai_message(message: AIMessage):
     return message
 
 # Construcción de la cadena RAG
-rag_chain_niilo = (
-    RunnablePassthrough.assign( # Mantiene la pregunta original
-        context=(lambda x: get_info_to_docs(x)) # Invoca retriever y formatea
-    )
-    | prompt_niilo # Aplica el prompt de Niilo (espera 'question' y 'context')
-    | llm_chat # Usa el LLM conversacional
-    | RunnableLambda(add_kwargs_to_ai_message)
-    #| StrOutputParser() # Obtiene la respuesta como string
-)
+def get_rag_chain():
+    return _get_or_create("rag_chain_niilo", lambda: (
+        RunnablePassthrough.assign( # Mantiene la pregunta original
+            context=RunnableLambda(get_info_to_docs, afunc=aget_info_to_docs) # Invoca retriever y formatea
+        )
+        | prompt_niilo # Aplica el prompt de Niilo (espera 'question' y 'context')
+        | get_llm_chat() # Usa el LLM conversacional
+        | RunnableLambda(add_kwargs_to_ai_message)
+        #| StrOutputParser() # Obtiene la respuesta como string
+    ))
 
 # Añadir historial a la cadena RAG
 # Espera un diccionario con la clave "question" conteniendo el mensaje del usuario (string)
-chain_with_history = RunnableWithMessageHistory(
-    rag_chain_niilo,
-    get_by_session_id, # Función para obtener historial
-    input_messages_key="question", # Clave donde va el mensaje del usuario (string)
-    history_messages_key="chat_history", # Clave que el prompt espera para el historial
-    # output_messages_key="answer" # Opcional: clave para la respuesta AI en el historial
-)
+def get_chain_with_history() -> RunnableWithMessageHistory:
+    return _get_or_create("chain_with_history", lambda: RunnableWithMessageHistory(
+        get_rag_chain(),
+        get_windowed_history, # Historial: resumen + últimos turnos (ver history_window)
+        input_messages_key="question", # Clave donde va el mensaje del usuario (string)
+        history_messages_key="chat_history", # Clave que el prompt espera para el historial
+        # output_messages_key="answer" # Opcional: clave para la respuesta AI en el historial
+    ))
+
+# Misma cadena para el modo async: historial sobre el pool async (aget_messages/aadd_messages)
+def get_achain_with_history() -> RunnableWithMessageHistory:
+    return _get_or_create("achain_with_history", lambda: RunnableWithMessageHistory(
+        get_rag_chain(),
+        get_async_windowed_history,
+        input_messages_key="question",
+        history_messages_key="chat_history",
+    ))
 
 # Función para obtener mensajes (útil para depuración o si se necesita fuera de RunnableWithMessageHistory)
 def get_chat_messages(session_id: str) -> List[BaseMessage]:
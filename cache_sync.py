@@ -0,0 +1,94 @@
+import os
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Cada cuántos segundos cada worker revisa la versión compartida de los caches del RAG (0 = nunca)
+RAG_CACHE_SYNC_INTERVAL = float(os.environ.get("RAG_CACHE_SYNC_INTERVAL", 30))
+
+
+class CacheVersionWatcher():
+    """
+    Propaga la invalidación de los caches del RAG a todos los workers.
+
+    Los caches (respuestas, documentos recuperados) viven en la memoria de cada
+    proceso. La versión compartida está en la tabla `rag_cache_version`:
+    `publish` la incrementa e invalida el proceso actual, y cada worker la
+    revisa cada `interval` segundos e invalida sus caches si cambió. Los demás
+    workers pueden servir contenido anterior hasta su siguiente revisión.
+    """
+
+    def __init__(self, interval: float = RAG_CACHE_SYNC_INTERVAL):
+        self.interval = interval
+        self.seen: Optional[int] = None
+        self.invalidations = 0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _invalidate(self) -> None:
+        import agent
+        agent.invalidate_rag_caches()
+        self.invalidations += 1
+
+    def check_once(self) -> bool:
+        """Invalida los caches locales si la versión compartida cambió. Devuelve si invalidó."""
+        import connection
+        version = connection.get_rag_cache_version()
+        with self._lock:
+            changed = self.seen is not None and version != self.seen
+            self.seen = version
+        if changed:
+            logger.info(f"Versión compartida de los caches del RAG: {version}; invalidando")
+            self._invalidate()
+        return changed
+
+    def publish(self) -> int:
+        """Incrementa la versión compartida e invalida los caches de este proceso."""
+        import connection
+        version = connection.bump_rag_cache_version()
+        with self._lock:
+            self.seen = version
+        self._invalidate()
+        return version
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.check_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.warning(f"No se pudo leer la versión de los caches del RAG: {e}")
+
+    def start(self) -> None:
+        """Arranca la revisión periódica (idempotente; no hace nada si el intervalo es 0)."""
+        if self.interval <= 0 or self._thread is not None:
+            return
+        try:
+            self.check_once()  # Versión inicial
+        except Exception as e:
+            logger.warning(f"No se pudo leer la versión de los caches del RAG: {e}")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rag-cache-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "shared_version": self.seen,
+            "interval": self.interval,
+            "invalidations": self.invalidations,
+            "last_error": self.last_error,
+        }
+
+
+watcher = CacheVersionWatcher()
@@ -1,13 +1,23 @@
 from langgraph.graph import StateGraph, END, START
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from typing import List, Optional
-import agent, connection, formulas, prompts
-from chatbot_schemas import State, RouterOutput, FormulaInfo, ExtractedParams, List_Formula
-from helpers import time_now, get_past_time
+import agent, connection, formulas, prompts, quota, fast_router, history_window, write_behind
+from message_store import HISTORY_IS_AUTHORITATIVE
+from postgres_db import get_checkpoint, get_acheckpoint
+from semantic_cache import SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_MAX_HISTORY
+from chatbot_schemas import State, RouterOutput, FormulaInfo, ExtractedParams, List_Formula, RouterWithFormulas
+from helpers import time_now
 from uuid import uuid4
 from formulas import formulas_list
 import json
+import asyncio
 import logging
+import os
+import threading
 import uuid
+import base64
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -18,6 +28,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Recupera el contexto RAG al inicio del turno, en paralelo con el router y el análisis de fórmulas
+SPECULATIVE_RETRIEVAL = os.environ.get("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+# Routing y análisis de fórmulas en una sola llamada al LLM (A/B contra el grafo de dos pasos)
+COMBINED_ROUTER = os.environ.get("COMBINED_ROUTER", "false").lower() == "true"
+
 
 def get_last_human_message(messages: List[agent.BaseMessage]) -> Optional[agent.HumanMessage]:
     """Extrae el contenido del último mensaje humano."""
@@ -33,8 +48,12 @@ def route_request(state: State) -> dict:
     if not last_human_message:
         logger.warning("No se encontró mensaje humano para el routing. Defecto: chatbot.")
         return {"decision": "chatbot"}
+    # Casos obvios se deciden localmente, sin llamar al LLM
+    fast_decision = fast_router.fast_route(last_human_message.content)
+    if fast_decision:
+        return {"decision": fast_decision}
     # Usa LLM estructurado para tomar la decisión
-    router_runnable = prompts.prompt_router | agent.llm_structured.with_structured_output(RouterOutput)
+    router_runnable = prompts.prompt_router | agent.get_llm_structured().with_structured_output(RouterOutput)
     try:
         routing_decision: RouterOutput = router_runnable.invoke({"question": last_human_message.content})
         logger.info(f"Decisión del Router: {routing_decision.decision}")
@@ -43,51 +62,221 @@ def route_request(state: State) -> dict:
         logger.error(f"Error durante el routing: {e}", exc_info=True)
         return {"decision": "chatbot"} # Fallback seguro
 
+async def aroute_request(state: State) -> dict:
+    """Versión async del nodo Router (usa `ainvoke`)."""
+    logger.info("--- Ejecutando Nodo: route_request (async) ---")
+    last_human_message = get_last_human_message(state['messages'])
+    if not last_human_message:
+        logger.warning("No se encontró mensaje humano para el routing. Defecto: chatbot.")
+        return {"decision": "chatbot"}
+    # Casos obvios se deciden localmente, sin llamar al LLM
+    fast_decision = fast_router.fast_route(last_human_message.content)
+    if fast_decision:
+        return {"decision": fast_decision}
+    router_runnable = prompts.prompt_router | agent.get_llm_structured().with_structured_output(RouterOutput)
+    try:
+        routing_decision: RouterOutput = await router_runnable.ainvoke({"question": last_human_message.content})
+        logger.info(f"Decisión del Router: {routing_decision.decision}")
+        return {"decision": routing_decision.decision}
+    except Exception as e:
+        logger.error(f"Error durante el routing: {e}", exc_info=True)
+        return {"decision": "chatbot"} # Fallback seguro
+
+# Recuperaciones especulativas en curso, por id del mensaje humano del turno.
+# Los turnos que fallan antes del nodo chatbot no retiran la suya: se descartan
+# las más viejas al superar `_MAX_PREFETCHES`.
+_prefetch_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="rag-prefetch")
+_prefetches = {}
+_prefetches_lock = threading.Lock()
+_MAX_PREFETCHES = 256
+
+def _put_prefetch(message_id: str, pending) -> None:
+    with _prefetches_lock:
+        _prefetches[message_id] = pending
+        while len(_prefetches) > _MAX_PREFETCHES:
+            _prefetches.pop(next(iter(_prefetches))).cancel()
+
+def _take_prefetch(message: agent.HumanMessage):
+    """Retira la recuperación del turno (un Future, una Task o None)."""
+    if not message.id:
+        return None
+    with _prefetches_lock:
+        return _prefetches.pop(message.id, None)
+
+def _retrieval_config(config: RunnableConfig) -> dict:
+    """Solo `configurable`: los callbacks del nodo se cierran antes de que termine la recuperación."""
+    return {"configurable": dict((config or {}).get("configurable") or {})}
+
+def _prefetch_context(message: agent.HumanMessage, config: dict) -> Optional[str]:
+    try:
+        return agent.get_info_to_docs({"question": message}, config)
+    except Exception as e:
+        # El nodo chatbot recupera por su cuenta si no hay contexto
+        logger.error(f"Error en la recuperación especulativa: {e}", exc_info=True)
+        return None
+
+async def _aprefetch_context(message: agent.HumanMessage, config: dict) -> Optional[str]:
+    try:
+        return await agent.aget_info_to_docs({"question": message}, config)
+    except Exception as e:
+        logger.error(f"Error en la recuperación especulativa: {e}", exc_info=True)
+        return None
+
+def retrieve_node(state: State, config: RunnableConfig) -> dict:
+    """
+    Nodo Recuperación: lanza la recuperación RAG en segundo plano y termina enseguida.
+
+    Corre en el super-step del router pero no lo retiene: `analyze_formulas`
+    arranca apenas decide el router y el nodo chatbot espera el contexto
+    (ver `_prefetched_context`).
+    """
+    logger.info("--- Ejecutando Nodo: retrieve_node ---")
+    last_human_message = get_last_human_message(state['messages'])
+    if last_human_message and last_human_message.id:
+        _put_prefetch(last_human_message.id, _prefetch_executor.submit(
+            _prefetch_context, last_human_message, _retrieval_config(config)))
+    return {}
+
+async def aretrieve_node(state: State, config: RunnableConfig) -> dict:
+    """Versión async del nodo de recuperación: la recuperación es una Task del mismo loop."""
+    logger.info("--- Ejecutando Nodo: retrieve_node (async) ---")
+    last_human_message = get_last_human_message(state['messages'])
+    if last_human_message and last_human_message.id:
+        _put_prefetch(last_human_message.id, asyncio.create_task(
+            _aprefetch_context(last_human_message, _retrieval_config(config))))
+    return {}
+
+def _prefetched_context(pending) -> Optional[str]:
+    """
+    Espera el contexto recuperado en segundo plano (None si no hubo o falló).
+
+    Si la recuperación ni siquiera empezó (pool ocupado), se cancela y la
+    cadena recupera por su cuenta en vez de esperar turno.
+    """
+    if not isinstance(pending, Future) or pending.cancel():
+        return None
+    return pending.result()
+
+async def _aprefetched_context(pending) -> Optional[str]:
+    if pending is None:
+        return None
+    if isinstance(pending, Future):
+        if pending.cancel():
+            return None
+        return await asyncio.wrap_future(pending)
+    return await pending
+
+def _formula_analysis_input(last_human_message: agent.HumanMessage) -> dict:
+    """Prepara el diccionario de entrada con AMBAS variables requeridas por el prompt."""
+    input_data_for_prompt = {
+        "question": last_human_message.content,
+        "formulas_json": str(formulas_list) # Convierte la lista real a string JSON aquí
+    }
+    logger.debug(f"Input para prompt_formula_analysis: {input_data_for_prompt.keys()}")
+    return input_data_for_prompt
+
+def _parse_formula_analysis(analysis_result) -> List[FormulaInfo]:
+    """Procesa la salida del análisis de fórmulas (debería ser List_Formula)."""
+    analyzed_formulas_list: List[FormulaInfo] = []
+    if isinstance(analysis_result, List_Formula):
+        # Validación adicional opcional (ej: asegurar que los items son FormulaInfo)
+        analyzed_formulas_list = [f for f in analysis_result.formulas if isinstance(f, FormulaInfo)]
+        logger.info(f"Fórmulas Analizadas (tipo {type(analysis_result)}): {[f.__dict__ for f in analyzed_formulas_list]}")
+    else:
+        # Manejar casos donde with_structured_output falle o devuelva otro tipo
+        logger.warning(f"Salida inesperada de analysis_runnable: {type(analysis_result)}. Se esperaba FormulaInfo.")
+        # Podrías intentar parsear si es un AIMessage con JSON string, como fallback
+        if hasattr(analysis_result, 'content') and isinstance(analysis_result.content, str):
+            try:
+                parsed_list = json.loads(analysis_result.content)
+                validated_formulas = [FormulaInfo(**item) for item in parsed_list]
+                analyzed_formulas_list = validated_formulas
+                logger.info(f"Fórmulas Analizadas (parseado de string): {[f.dict() for f in analyzed_formulas_list]}")
+            except Exception as parse_err:
+                logger.error(f"Error parseando fallback JSON: {parse_err}", exc_info=True)
+        # Si no se puede procesar, la lista quedará vacía
+    return analyzed_formulas_list
+
 def analyze_formulas_node(state: State) -> dict:
     """Nodo Análisis Fórmulas: Identifica fórmulas y la intención (calc/info)."""
     logger.info("--- Ejecutando Nodo: analyze_formulas_node ---")
     last_human_message = get_last_human_message(state['messages'])
-    analyzed_formulas_list: FormulaInfo = [] # Especifica el tipo esperado
+    analyzed_formulas_list: List[FormulaInfo] = [] # Especifica el tipo esperado
     if not last_human_message:
         logger.warning("No se encontró mensaje humano para analizar fórmulas.")
     else:
-        # Prepara el diccionario de entrada con AMBAS variables requeridas por el prompt
-        input_data_for_prompt = {
-            "question": last_human_message.content,
-            "formulas_json": str(formulas_list) # Convierte la lista real a string JSON aquí
-        }
-        logger.debug(f"Input para prompt_formula_analysis: {input_data_for_prompt.keys()}")
-
-        analysis_runnable = prompts.prompt_formula_analysis | agent.llm_structured.with_structured_output(List_Formula)
+        analysis_runnable = prompts.prompt_formula_analysis | agent.get_llm_structured().with_structured_output(List_Formula)
         try:
             # Invoca el runnable con el diccionario de entrada completo
-            analysis_result = analysis_runnable.invoke(input_data_for_prompt)
-            # Procesa el resultado (debería ser List[FormulaInfo])
-            if isinstance(analysis_result, List_Formula):
-                # Validación adicional opcional (ej: asegurar que los items son FormulaInfo)
-                analyzed_formulas_list = [f for f in analysis_result.formulas if isinstance(f, FormulaInfo)]
-                logger.info(f"Fórmulas Analizadas (tipo {type(analysis_result)}): {[f.__dict__ for f in analyzed_formulas_list]}")
-            else:
-                # Manejar casos donde with_structured_output falle o devuelva otro tipo
-                logger.warning(f"Salida inesperada de analysis_runnable: {type(analysis_result)}. Se esperaba FormulaInfo.")
-                # Podrías intentar parsear si es un AIMessage con JSON string, como fallback
-                if hasattr(analysis_result, 'content') and isinstance(analysis_result.content, str):
-                    try:
-                        parsed_list = json.loads(analysis_result.content)
-                        validated_formulas = [FormulaInfo(**item) for item in parsed_list]
-                        analyzed_formulas_list = validated_formulas
-                        logger.info(f"Fórmulas Analizadas (parseado de string): {[f.dict() for f in analyzed_formulas_list]}")
-                    except Exception as parse_err:
-                        logger.error(f"Error parseando fallback JSON: {parse_err}", exc_info=True)
-                # Si no se puede procesar, la lista quedará vacía
+            analysis_result = analysis_runnable.invoke(_formula_analysis_input(last_human_message))
+            analyzed_formulas_list = _parse_formula_analysis(analysis_result)
         except Exception as e:
             logger.error(f"Error durante la invocación/procesamiento del análisis de fórmulas: {e}", exc_info=True)
-            import traceback
-            traceback.print_exc()
             analyzed_formulas_list = [] # Resetea en caso de error
     # Devuelve la lista (posiblemente vacía) al estado
     return {"analyzed_formulas": analyzed_formulas_list}
 
+async def aanalyze_formulas_node(state: State) -> dict:
+    """Versión async del nodo de análisis de fórmulas (usa `ainvoke`)."""
+    logger.info("--- Ejecutando Nodo: analyze_formulas_node (async) ---")
+    last_human_message = get_last_human_message(state['messages'])
+    analyzed_formulas_list: List[FormulaInfo] = []
+    if not last_human_message:
+        logger.warning("No se encontró mensaje humano para analizar fórmulas.")
+    else:
+        analysis_runnable = prompts.prompt_formula_analysis | agent.get_llm_structured().with_structured_output(List_Formula)
+        try:
+            analysis_result = await analysis_runnable.ainvoke(_formula_analysis_input(last_human_message))
+            analyzed_formulas_list = _parse_formula_analysis(analysis_result)
+        except Exception as e:
+            logger.error(f"Error durante la invocación/procesamiento del análisis de fórmulas: {e}", exc_info=True)
+            analyzed_formulas_list = []
+    return {"analyzed_formulas": analyzed_formulas_list}
+
+def _route_and_analyze_result(result) -> dict:
+    """Convierte la salida combinada en las claves `decision` y `analyzed_formulas` del estado."""
+    if not isinstance(result, RouterWithFormulas):
+        logger.warning(f"Salida inesperada del router combinado: {type(result)}. Defecto: chatbot.")
+        return {"decision": "chatbot", "analyzed_formulas": []}
+    analyzed_formulas_list = [f for f in result.formulas if isinstance(f, FormulaInfo)]
+    if result.decision != "formula":
+        analyzed_formulas_list = []
+    logger.info(f"Router combinado: {result.decision}, fórmulas: {[f.key for f in analyzed_formulas_list]}")
+    return {"decision": result.decision, "analyzed_formulas": analyzed_formulas_list}
+
+def route_and_analyze_node(state: State) -> dict:
+    """Nodo Router combinado: decide el paso y analiza las fórmulas en una sola llamada."""
+    logger.info("--- Ejecutando Nodo: route_and_analyze_node ---")
+    last_human_message = get_last_human_message(state['messages'])
+    if not last_human_message:
+        logger.warning("No se encontró mensaje humano para el routing. Defecto: chatbot.")
+        return {"decision": "chatbot", "analyzed_formulas": []}
+    # El router local solo evita la llamada cuando es claramente 'chatbot'
+    if fast_router.fast_route(last_human_message.content) == "chatbot":
+        return {"decision": "chatbot", "analyzed_formulas": []}
+    runnable = prompts.prompt_route_and_analyze | agent.get_llm_structured().with_structured_output(RouterWithFormulas)
+    try:
+        return _route_and_analyze_result(runnable.invoke(_formula_analysis_input(last_human_message)))
+    except Exception as e:
+        logger.error(f"Error durante el routing combinado: {e}", exc_info=True)
+        return {"decision": "chatbot", "analyzed_formulas": []} # Fallback seguro
+
+async def aroute_and_analyze_node(state: State) -> dict:
+    """Versión async del nodo Router combinado."""
+    logger.info("--- Ejecutando Nodo: route_and_analyze_node (async) ---")
+    last_human_message = get_last_human_message(state['messages'])
+    if not last_human_message:
+        logger.warning("No se encontró mensaje humano para el routing. Defecto: chatbot.")
+        return {"decision": "chatbot", "analyzed_formulas": []}
+    if fast_router.fast_route(last_human_message.content) == "chatbot":
+        return {"decision": "chatbot", "analyzed_formulas": []}
+    runnable = prompts.prompt_route_and_analyze | agent.get_llm_structured().with_structured_output(RouterWithFormulas)
+    try:
+        return _route_and_analyze_result(await runnable.ainvoke(_formula_analysis_input(last_human_message)))
+    except Exception as e:
+        logger.error(f"Error durante el routing combinado: {e}", exc_info=True)
+        return {"decision": "chatbot", "analyzed_formulas": []}
+
 def calculation_node(state: State) -> dict:
     """Nodo Cálculo: Intenta calcular o pide parámetros."""
     logger.info("--- Ejecutando Nodo: calculation_node ---")
@@ -98,7 +287,7 @@ def calculation_node(state: State) -> dict:
     ai_kwargs = {
         "created_at": time_now(),
         # Podrías añadir más info relevante del AI aquí:
-        "model_used": agent.MODEL_NAME, # Si está accesible
+        "model_used": agent.get_model_name(), # Si está accesible
         # "token_usage": response_metadata.get("usage_metadata"), # Si obtienes metadata
     }
 
@@ -173,102 +362,268 @@ def calculation_node(state: State) -> dict:
     return {"messages": messages_to_add}
 
 
-def chatbot_node(state: State) -> dict:
-    """Nodo Chatbot: Ejecuta la cadena RAG principal de Niilo."""
-    logger.info("--- Ejecutando Nodo: chatbot_node ---")
+def _chatbot_node_input(state: State, config: Optional[RunnableConfig] = None):
+    """
+    Valida el estado para el nodo chatbot.
+
+    El config de la cadena es el del grafo con `session_id` agregado a su
+    `configurable`, así las opciones de recuperación del turno
+    (`configurable.retrieval`) llegan al retriever.
+
+    Returns:
+        tuple: (resultado_temprano, config, último_mensaje_humano). Si
+        resultado_temprano no es None, el nodo debe devolverlo sin llamar al LLM.
+    """
     session_id = state['messages'][0].additional_kwargs.get('session_id') if state['messages'] else None
     if not session_id:
         logger.error("Error crítico: Falta session_id en el estado.")
         return {"messages": [agent.AIMessage(
             content=f"Lo siento, hubo un error interno {session_id}.", 
             id= f"chatbot_{uuid.uuid4()}",
-            additional_kwargs=ai_kwargs)
-            ]}
-    config = {"configurable": {"session_id": session_id}}
+            additional_kwargs={"created_at": time_now(), "model_used": agent.get_model_name()})
+            ]}, None, None
+    config = config or {}
+    config = {**config, "configurable": {**(config.get("configurable") or {}), "session_id": session_id}}
     last_human_message = get_last_human_message(state['messages'])
 
     if not last_human_message:
         # Si el último mensaje fue del sistema (p.ej., pidiendo parámetros), Niilo no debería decir nada nuevo aún.
         logger.info("No hay nuevo mensaje humano. Niilo espera respuesta.")
         # Devolver estado sin añadir mensaje de Niilo
-        return {}
+        return {}, None, None
+    return None, config, last_human_message
+
+def _chain_input(last_human_message: agent.HumanMessage, context: Optional[str] = None) -> dict:
+    """Entrada de la cadena RAG; incluye el contexto si ya se recuperó en este turno."""
+    chain_input = {"question": last_human_message}
+    if context is not None:
+        chain_input["context"] = context
+    return chain_input
+
+def _chatbot_node_output(state: State, ai_message: agent.AIMessage) -> dict:
+    """Post-procesa la respuesta de la cadena RAG de Niilo."""
+    # --- Añadir explicaciones si fórmulas 'is_calculated=false' ---
+    analyzed_formulas = state.get("analyzed_formulas", [])
+    
+    formulas_to_explain = [f for f in analyzed_formulas if not f.is_calculated]
+    explanation_suffix = ""
+    if formulas_to_explain:
+        explanation_suffix = "\n\nSobre las fórmulas que mencionaste y no calculamos:\n"
+        # Aquí Niilo debería generar la explicación como parte de su lógica interna
+        # El prompt ya le indica que lo haga. No es necesario añadir texto aquí,
+        # PERO podrías pasarle explícitamente qué explicar si el prompt no es suficiente.
+        # Por simplicidad, confiamos en el prompt de Niilo.
+        # for f_info in formulas_to_explain:
+        #    explanation_suffix += f"- **{f_info.name} ({f_info.key})**: [Explicación breve aquí]\n"
+        pass # Confiar en el prompt de Niilo para manejar esto internamente basado en su contexto.
+    
+
+    final_content = ai_message.content
+    
+    logger.info(f"Respuesta de Niilo (RAG): {final_content}")
+    ai_message.__setattr__('content', final_content)
+    return {"messages": [ai_message]}
+
+def _chatbot_node_error(e: Exception) -> dict:
+    """Mensaje de respaldo cuando falla la cadena RAG de Niilo."""
+    logger.error(f"Error en la cadena RAG de Niilo: {e}", exc_info=True)
+    ai_id = f"chatbot_{uuid.uuid4()}"
+    ai_kwargs = {
+        "created_at": time_now(),
+        # Podrías añadir más info relevante del AI aquí:
+        "model_used": agent.get_model_name(), # Si está accesible
+        # "token_usage": response_metadata.get("usage_metadata"), # Si obtienes metadata
+    }
+    
+    return {"messages": [agent.AIMessage(
+        content="Uff, tuve un problema procesando eso. ¿Intentamos de nuevo?", 
+        id = ai_id,
+        additional_kwargs=ai_kwargs
+        )]}
+
+def _use_answer_cache(state: State, stored_messages: int = 0, config: Optional[RunnableConfig] = None) -> bool:
+    """
+    El cache semántico solo aplica a preguntas sin historial (o corto), sin
+    fórmulas y sin opciones de recuperación propias: el cache se indexa solo
+    por la pregunta, así que una respuesta con otros `filters`/`k` sería de
+    otros documentos.
+
+    `stored_messages` son los mensajes previos que no están en el estado (con
+    MESSAGE_STORE=history el estado solo tiene el turno actual).
+    """
+    return (
+        SEMANTIC_CACHE_ENABLED
+        and stored_messages + len(state['messages']) <= SEMANTIC_CACHE_MAX_HISTORY
+        and not state.get("analyzed_formulas")
+        and not agent.get_retrieval_options(config)
+    )
+
+def _stored_message_count(state: State, session_id: str, config: Optional[RunnableConfig] = None) -> int:
+    """Mensajes de turnos anteriores en chat_history; solo se consulta si hace falta."""
+    if not HISTORY_IS_AUTHORITATIVE or not _use_answer_cache(state, config=config):
+        return 0
+    return connection.count_session_messages(session_id, SEMANTIC_CACHE_MAX_HISTORY)
+
+def _turn_messages(state: State, last_human_message: agent.HumanMessage, ai_message: agent.AIMessage) -> List[agent.BaseMessage]:
+    """Pregunta, mensajes de fórmulas del turno y respuesta, en orden."""
+    return [last_human_message, *(m for m in state['messages'] if m is not last_human_message), ai_message]
+
+def _cached_ai_message(answer: str) -> agent.AIMessage:
+    ai_message = agent.AIMessage(content=answer, id=f"chatbot_{uuid.uuid4()}")
+    ai_message = agent.add_kwargs_to_ai_message(ai_message)
+    ai_message.additional_kwargs["cached"] = True
+    return ai_message
+
+def _lookup_answer_cache(question: str) -> tuple:
+    try:
+        return agent.get_answer_cache().lookup(question)
+    except Exception as e:
+        logger.warning(f"Semantic cache no disponible: {e}")
+        return None, None
+
+async def _alookup_answer_cache(question: str) -> tuple:
+    try:
+        return await agent.get_answer_cache().alookup(question)
+    except Exception as e:
+        logger.warning(f"Semantic cache no disponible: {e}")
+        return None, None
+
+def chatbot_node(state: State, config: RunnableConfig) -> dict:
+    """Nodo Chatbot: Ejecuta la cadena RAG principal de Niilo."""
+    logger.info("--- Ejecutando Nodo: chatbot_node ---")
+    early_result, config, last_human_message = _chatbot_node_input(state, config)
+    if early_result is not None:
+        return early_result
+    session_id = config["configurable"]["session_id"]
+    prefetch = _take_prefetch(last_human_message)
+    use_cache = _use_answer_cache(state, _stored_message_count(state, session_id, config), config)
+    vector = None
+    if use_cache:
+        answer, vector = _lookup_answer_cache(last_human_message.content)
+        if answer is not None:
+            if prefetch is not None:
+                prefetch.cancel()
+            ai_message = _cached_ai_message(answer)
+            # Se persiste igual que lo haría chain_with_history
+            history_window.save_turn(session_id, [last_human_message, ai_message])
+            return _chatbot_node_output(state, ai_message)
     # Ejecuta la cadena RAG con historial
     try:
         # Pasamos el contenido del último mensaje humano como 'question'
-        ai_message: agent.AIMessage = agent.chain_with_history.invoke({"question": last_human_message}, config=config)
-        # --- Añadir explicaciones si fórmulas 'is_calculated=false' ---
-        analyzed_formulas = state.get("analyzed_formulas", [])
-        
-        formulas_to_explain = [f for f in analyzed_formulas if not f.is_calculated]
-        explanation_suffix = ""
-        if formulas_to_explain:
-            explanation_suffix = "\n\nSobre las fórmulas que mencionaste y no calculamos:\n"
-            # Aquí Niilo debería generar la explicación como parte de su lógica interna
-            # El prompt ya le indica que lo haga. No es necesario añadir texto aquí,
-            # PERO podrías pasarle explícitamente qué explicar si el prompt no es suficiente.
-            # Por simplicidad, confiamos en el prompt de Niilo.
-            # for f_info in formulas_to_explain:
-            #    explanation_suffix += f"- **{f_info.name} ({f_info.key})**: [Explicación breve aquí]\n"
-            pass # Confiar en el prompt de Niilo para manejar esto internamente basado en su contexto.
-        
-
-        final_content = ai_message.content
-        
-        logger.info(f"Respuesta de Niilo (RAG): {final_content}")
-        ai_message.__setattr__('content', final_content)
-        return {"messages": [ai_message]}
+        chain_input = _chain_input(last_human_message, _prefetched_context(prefetch))
+        ai_message: agent.AIMessage = agent.get_chain_with_history().invoke(chain_input, config=config)
+        if use_cache and vector is not None:
+            agent.get_answer_cache().store(last_human_message.content, vector, ai_message.content)
+        result = _chatbot_node_output(state, ai_message)
     except Exception as e:
-        logger.error(f"Error en la cadena RAG de Niilo: {e}", exc_info=True)
-        try:
-            ai_id = ai_message.id
-            ai_kwargs = ai_message.additional_kwargs
-        except:
-            ai_id = f"chatbot_{uuid.uuid4()}"
-            ai_kwargs = {
-                "created_at": time_now(),
-                # Podrías añadir más info relevante del AI aquí:
-                "model_used": agent.MODEL_NAME, # Si está accesible
-                # "token_usage": response_metadata.get("usage_metadata"), # Si obtienes metadata
-            }
-        
-        return {"messages": [agent.AIMessage(
-            content="Uff, tuve un problema procesando eso. ¿Intentamos de nuevo?", 
-            id = ai_id,
-            additional_kwargs=ai_kwargs
-            )]}
+        result = _chatbot_node_error(e)
+    if HISTORY_IS_AUTHORITATIVE:
+        # La cadena solo leyó el historial: el turno completo se guarda aquí
+        history_window.save_turn(session_id, _turn_messages(state, last_human_message, result["messages"][-1]))
+    return result
+
+async def achatbot_node(state: State, config: RunnableConfig) -> dict:
+    """Versión async del nodo Chatbot (historial y retriever async)."""
+    logger.info("--- Ejecutando Nodo: chatbot_node (async) ---")
+    early_result, config, last_human_message = _chatbot_node_input(state, config)
+    if early_result is not None:
+        return early_result
+    session_id = config["configurable"]["session_id"]
+    prefetch = _take_prefetch(last_human_message)
+    use_cache = _use_answer_cache(state, await asyncio.to_thread(_stored_message_count, state, session_id, config), config)
+    vector = None
+    if use_cache:
+        answer, vector = await _alookup_answer_cache(last_human_message.content)
+        if answer is not None:
+            if prefetch is not None:
+                prefetch.cancel()
+            ai_message = _cached_ai_message(answer)
+            await history_window.asave_turn(session_id, [last_human_message, ai_message])
+            return _chatbot_node_output(state, ai_message)
+    try:
+        chain_input = _chain_input(last_human_message, await _aprefetched_context(prefetch))
+        ai_message: agent.AIMessage = await agent.get_achain_with_history().ainvoke(chain_input, config=config)
+        if use_cache and vector is not None:
+            agent.get_answer_cache().store(last_human_message.content, vector, ai_message.content)
+        result = _chatbot_node_output(state, ai_message)
+    except Exception as e:
+        result = _chatbot_node_error(e)
+    if HISTORY_IS_AUTHORITATIVE:
+        await history_window.asave_turn(session_id, _turn_messages(state, last_human_message, result["messages"][-1]))
+    return result
 
 # --- Construcción del Grafo ---
 builder = StateGraph(State)
 
 # Añadir Nodos
-builder.add_node("router", route_request)
-builder.add_node("analyze_formulas", analyze_formulas_node)
+# Cada nodo con I/O tiene versión sync y async: `graph` usa la primera, `agraph` la segunda
+if COMBINED_ROUTER:
+    # Una sola llamada estructurada: el router ya deja `analyzed_formulas` en el estado
+    builder.add_node("router", RunnableLambda(route_and_analyze_node, afunc=aroute_and_analyze_node))
+else:
+    builder.add_node("router", RunnableLambda(route_request, afunc=aroute_request))
+    builder.add_node("analyze_formulas", RunnableLambda(analyze_formulas_node, afunc=aanalyze_formulas_node))
 builder.add_node("calculate", calculation_node)
-builder.add_node("chatbot", chatbot_node)
+builder.add_node("chatbot", RunnableLambda(chatbot_node, afunc=achatbot_node))
 
 # Definir Flujo
 builder.add_edge(START, "router")
+if SPECULATIVE_RETRIEVAL:
+    # El nodo solo lanza la recuperación en segundo plano y termina, así no
+    # retrasa al router ni a `analyze_formulas`; el chatbot espera el resultado.
+    builder.add_node("retrieve", RunnableLambda(retrieve_node, afunc=aretrieve_node))
+    builder.add_edge(START, "retrieve")
+    builder.add_edge("retrieve", END)
 builder.add_conditional_edges(
     "router",
     lambda state: state["decision"], # Función de condición basada en la salida del router
     {
-        "formula": "analyze_formulas", # Si es 'formula', analiza
+        "formula": "calculate" if COMBINED_ROUTER else "analyze_formulas", # Si es 'formula', analiza
         "chatbot": "chatbot",        # Si es 'chatbot', va directo a Niilo
     }
 )
-builder.add_edge("analyze_formulas", "calculate") # Después de analizar, siempre intenta calcular/pedir params
+if not COMBINED_ROUTER:
+    builder.add_edge("analyze_formulas", "calculate") # Después de analizar, siempre intenta calcular/pedir params
 builder.add_edge("calculate", "chatbot") # Después de calcular/pedir, deja que Niilo responda
 builder.add_edge("chatbot", END) # La respuesta de Niilo es el final del turno
 
 # Compilar el Grafo con Checkpointer
-graph = builder.compile(checkpointer=agent.checkpoint)
+# Se compila en el primer uso: el checkpointer necesita el pool de Postgres.
+# Con MESSAGE_STORE=history no hay checkpointer: chat_history es la única fuente.
+_graph = None
+_agraph = None
+_graph_lock = threading.Lock()
+
+def get_graph():
+    global _graph
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                _graph = builder.compile(checkpointer=None if HISTORY_IS_AUTHORITATIVE else get_checkpoint())
+    return _graph
+
+def get_agraph():
+    """Grafo para el modo async (astream/ainvoke) con checkpointer sobre AsyncConnectionPool."""
+    global _agraph
+    if _agraph is None:
+        with _graph_lock:
+            if _agraph is None:
+                _agraph = builder.compile(checkpointer=None if HISTORY_IS_AUTHORITATIVE else get_acheckpoint())
+    return _agraph
 
 
 # --- Funciones de Invocación y Streaming (Adaptadas) ---
 
-def stream_graph_updates(user_input: str, session_id: str):
-    """Maneja input, procesa en grafo, y produce eventos de streaming."""
+def _build_turn_input(user_input: str, session_id: str, retrieval: Optional[dict] = None):
+    """
+    Construye la configuración del hilo y el mensaje humano inicial del turno.
+
+    `retrieval` (k, search_type, alpha, filters, score_threshold) viaja en
+    `configurable` hasta el retriever (ver agent.get_retrieval_options).
+    """
     config = {"configurable": {"thread_id": session_id, "session_id": session_id,}}
+    if retrieval:
+        config["configurable"]["retrieval"] = retrieval
 
     additional_configs = {
         "session_id": session_id,
@@ -281,62 +636,198 @@ def stream_graph_updates(user_input: str, session_id: str):
         additional_kwargs= additional_configs# Importante para el estado inicial
     )
 
+    return config, initial_message
+
+
+def _end_turn(session_id: str) -> None:
+    """Escribe el checkpoint del turno si quedó en memoria y aplica la retención (ver checkpoint_store)."""
+    if HISTORY_IS_AUTHORITATIVE:
+        return
+    try:
+        get_checkpoint().end_turn(session_id)
+    except Exception as e:
+        logger.error(f"Error cerrando el turno de {session_id}: {e}", exc_info=True)
+
+async def _aend_turn(session_id: str) -> None:
+    if HISTORY_IS_AUTHORITATIVE:
+        return
+    try:
+        await get_acheckpoint().aend_turn(session_id)
+    except Exception as e:
+        logger.error(f"Error cerrando el turno de {session_id}: {e}", exc_info=True)
+
+
+def _format_node_output(node_name: str, node_output):
+    """Convierte la salida de un nodo en el evento que se entrega al cliente (o None)."""
+    act_time = time_now()
+
+    logger.debug(f"Output from node '{node_name}': {node_output}")
+    # Busca mensajes añadidos por el nodo actual
+    if isinstance(node_output, dict) and "messages" in node_output:
+        new_messages = node_output["messages"]
+        if isinstance(new_messages, list) and new_messages:
+            # Solo produce el contenido del último mensaje AI añadido por este nodo
+            last_msg = new_messages[-1]
+            if isinstance(last_msg, agent.AIMessage):
+                return {
+                    "assistant_response": last_msg.content,
+                    "id": last_msg.id,
+                    "created_at": last_msg.additional_kwargs.get('created_at', act_time),
+                    }
+            elif isinstance(last_msg, dict) and last_msg.get("type") == "ai": # Compatibilidad
+                return {
+                    "assistant_response": last_msg.get("content", ""),
+                    "id": last_msg.get("id"),
+                    "created_at": last_msg.get("additional_kwargs").get('created_at', act_time),
+                    }
+        return None
+    elif not node_output:
+        return {
+            "event_value": "pass",
+            "created_at": act_time,
+               }
+    elif "decision" in node_output: #check if decision key exists
+        return {
+            "decision": node_output["decision"],
+            "created_at": act_time,
+            } #yield the decision value
+    else:
+         return {
+             "event_value": str(node_output),
+             "created_at": act_time,
+             } #yield the entire event value for debugging.
+
+
+def stream_graph_updates(user_input: str, session_id: str, retrieval: Optional[dict] = None):
+    """Maneja input, procesa en grafo, y produce eventos de streaming."""
+    config, initial_message = _build_turn_input(user_input, session_id, retrieval)
+
     logger.info(f"--- Input del ususario: {user_input} ---")
 
     # Usar stream_mode="updates" para obtener salidas de nodos a medida que ocurren
-    events = graph.stream({"messages": [initial_message]}, config=config, stream_mode="updates")
-    for event in events:
-        for node_name, node_output in event.items():
-            act_time = time_now()
-        
-            logger.debug(f"Output from node '{node_name}': {node_output}")
-            # Busca mensajes añadidos por el nodo actual
-            if isinstance(node_output, dict) and "messages" in node_output:
-                new_messages = node_output["messages"]
-                if isinstance(new_messages, list) and new_messages:
-                    # Solo produce el contenido del último mensaje AI añadido por este nodo
-                    last_msg = new_messages[-1]
-                    if isinstance(last_msg, agent.AIMessage):
-                        yield {
-                            "assistant_response": last_msg.content,
-                            "id": last_msg.id,
-                            "created_at": last_msg.additional_kwargs.get('created_at', act_time),
-                            }
-                    elif isinstance(last_msg, dict) and last_msg.get("type") == "ai": # Compatibilidad
-                        yield {
-                            "assistant_response": last_msg.get("content", ""),
-                            "id": last_msg.get("id"),
-                            "created_at": last_msg.get("additional_kwargs").get('created_at', act_time),
-                            }
-            elif not node_output:
-                yield {
-                    "event_value": "pass",
-                    "created_at": act_time,
-                       }
-            elif "decision" in node_output: #check if decision key exists
-                yield {
-                    "decision": node_output["decision"],
-                    "created_at": act_time,
-                    } #yield the decision value
+    events = get_graph().stream({"messages": [initial_message]}, config=config, stream_mode="updates")
+    try:
+        for event in events:
+            for node_name, node_output in event.items():
+                chunk = _format_node_output(node_name, node_output)
+                if chunk is not None:
+                    yield chunk
+                # Podrías añadir yields para otros datos del estado si es necesario (ej: 'decision')
+    finally:
+        _end_turn(session_id)
+
+
+def stream_graph_events(user_input: str, session_id: str, retrieval: Optional[dict] = None):
+    """
+    Variante de `stream_graph_updates` que además entrega los tokens de Niilo.
+
+    Combina los modos "updates" y "messages" del grafo: produce tuplas
+    (evento, datos) donde evento es 'token' (fragmento del LLM del nodo chatbot),
+    'node' (salida formateada de un nodo), 'done' o 'error'. La persistencia no
+    cambia: el nodo chatbot sigue usando `chain_with_history` y el checkpointer
+    guarda el estado final del turno.
+    """
+    config, initial_message = _build_turn_input(user_input, session_id, retrieval)
+
+    logger.info(f"--- Input del ususario (stream): {user_input} ---")
+
+    try:
+        events = get_graph().stream(
+            {"messages": [initial_message]},
+            config=config,
+            stream_mode=["updates", "messages"],
+        )
+        for mode, payload in events:
+            if mode == "messages":
+                message_chunk, metadata = payload
+                # Solo los tokens de la respuesta de Niilo, no el JSON del router/análisis
+                if metadata.get("langgraph_node") != "chatbot":
+                    continue
+                if isinstance(message_chunk, agent.AIMessageChunk) and message_chunk.content:
+                    yield "token", {
+                        "content": message_chunk.content,
+                        "id": message_chunk.id,
+                    }
             else:
-                 yield {
-                     "event_value": str(node_output),
-                     "created_at": act_time,
-                     } #yield the entire event value for debugging.
-            # Podrías añadir yields para otros datos del estado si es necesario (ej: 'decision')
+                for node_name, node_output in payload.items():
+                    chunk = _format_node_output(node_name, node_output)
+                    if chunk is not None:
+                        yield "node", {"node": node_name, **chunk}
+    except Exception as e:
+        logger.error(f"Error durante el streaming del grafo: {e}", exc_info=True)
+        yield "error", {"detail": str(e)}
+        return
+    finally:
+        # Antes de 'done': el siguiente turno del cliente ya ve el checkpoint
+        _end_turn(session_id)
+    yield "done", {"session_id": session_id, "created_at": time_now()}
+
+
+async def astream_graph_updates(user_input: str, session_id: str, retrieval: Optional[dict] = None):
+    """Versión async de `stream_graph_updates` sobre `agraph.astream`."""
+    config, initial_message = _build_turn_input(user_input, session_id, retrieval)
+
+    logger.info(f"--- Input del ususario: {user_input} ---")
+
+    events = get_agraph().astream({"messages": [initial_message]}, config=config, stream_mode="updates")
+    try:
+        async for event in events:
+            for node_name, node_output in event.items():
+                chunk = _format_node_output(node_name, node_output)
+                if chunk is not None:
+                    yield chunk
+    finally:
+        await _aend_turn(session_id)
+
+
+async def astream_graph_events(user_input: str, session_id: str, retrieval: Optional[dict] = None):
+    """Versión async de `stream_graph_events` sobre `agraph.astream`."""
+    config, initial_message = _build_turn_input(user_input, session_id, retrieval)
+
+    logger.info(f"--- Input del ususario (stream): {user_input} ---")
+
+    try:
+        events = get_agraph().astream(
+            {"messages": [initial_message]},
+            config=config,
+            stream_mode=["updates", "messages"],
+        )
+        async for mode, payload in events:
+            if mode == "messages":
+                message_chunk, metadata = payload
+                if metadata.get("langgraph_node") != "chatbot":
+                    continue
+                if isinstance(message_chunk, agent.AIMessageChunk) and message_chunk.content:
+                    yield "token", {
+                        "content": message_chunk.content,
+                        "id": message_chunk.id,
+                    }
+            else:
+                for node_name, node_output in payload.items():
+                    chunk = _format_node_output(node_name, node_output)
+                    if chunk is not None:
+                        yield "node", {"node": node_name, **chunk}
+    except Exception as e:
+        logger.error(f"Error durante el streaming del grafo: {e}", exc_info=True)
+        yield "error", {"detail": str(e)}
+        return
+    finally:
+        # Antes de 'done': el siguiente turno del cliente ya ve el checkpoint
+        await _aend_turn(session_id)
+    yield "done", {"session_id": session_id, "created_at": time_now()}
 
 
-def get_response(user_input: str, session_id: str) -> List[dict]:
+def get_response(user_input: str, session_id: str, retrieval: Optional[dict] = None) -> List[dict]:
     """Obtiene la(s) respuesta(s) del asistente para una entrada de usuario."""
     responses = []
-    stream = stream_graph_updates(user_input, session_id)
+    stream = stream_graph_updates(user_input, session_id, retrieval)
     for chunk in stream:
         if "assistant_response" in chunk:
             responses.append(chunk) # Acumula todas las respuestas generadas en el turno
     # Si no hubo respuestas en el stream (raro), intenta obtener el estado final
-    if not responses:
+    if not responses and not HISTORY_IS_AUTHORITATIVE:
          try:
-            final_state = graph.get_state({"configurable": {"thread_id": session_id}})
+            final_state = get_graph().get_state({"configurable": {"thread_id": session_id}})
             if final_state and 'messages' in final_state:
                  last_message = final_state['messages'][-1]
                  if isinstance(last_message, agent.AIMessage):
@@ -347,10 +838,32 @@ def get_response(user_input: str, session_id: str) -> List[dict]:
     return responses if responses else [{"assistant_response": "(No se generó respuesta)"}]
 
 
+async def aget_response(user_input: str, session_id: str, retrieval: Optional[dict] = None) -> List[dict]:
+    """Versión async de `get_response`: no bloquea el event loop durante el turno."""
+    responses = []
+    async for chunk in astream_graph_updates(user_input, session_id, retrieval):
+        if "assistant_response" in chunk:
+            responses.append(chunk)
+    if not responses and not HISTORY_IS_AUTHORITATIVE:
+         try:
+            final_state = await get_agraph().aget_state({"configurable": {"thread_id": session_id}})
+            if final_state and 'messages' in final_state.values:
+                 last_message = final_state.values['messages'][-1]
+                 if isinstance(last_message, agent.AIMessage):
+                      responses.append({"assistant_response": last_message.content})
+         except Exception as e:
+             logger.error(f"Error obteniendo estado final: {e}")
+
+    return responses if responses else [{"assistant_response": "(No se generó respuesta)"}]
+
+
 def get_steps(session_id: str):
     """Retrieves the chat history from the graph."""
+    if HISTORY_IS_AUTHORITATIVE:
+        # Sin checkpoints: se proyecta chat_history con la forma del estado del grafo
+        return {"values": {"messages": agent.get_chat_messages(session_id)}, "next": []}
     config = {"configurable": {"thread_id": session_id}}
-    return graph.get_state(config)
+    return get_graph().get_state(config)
 
 def get_history(session_id: str):
     messages = agent.get_chat_messages(session_id)
@@ -377,30 +890,114 @@ def get_history(session_id: str):
 
     return resp
 
-def get_session_ids(user_id: str):
-    sessions = connection.get_sessions_by_user(user_id)
+def _encode_message_cursor(row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"msg|{row_id}".encode()).decode()
+
+def _decode_message_cursor(cursor: str) -> int:
+    try:
+        prefix, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        if prefix != "msg":
+            raise ValueError
+        return int(row_id)
+    except Exception:
+        raise ValueError("Cursor inválido.")
+
+def get_history_page(session_id: str, limit: int = 20, before: Optional[str] = None, after: Optional[str] = None) -> dict:
+    """
+    Página del historial de una conversación en orden cronológico.
+
+    Sin cursores devuelve los últimos `limit` mensajes. `before` pide los
+    anteriores al cursor y `after` los posteriores.
+
+    Returns:
+        dict: `messages`, `before_cursor` y `after_cursor` (cursores del
+        primer y último mensaje de la página) y `has_more` (si quedan
+        mensajes en la dirección pedida).
+    """
+    if before and after:
+        raise ValueError("Usa solo uno de 'before' o 'after'.")
+    rows = connection.get_chat_history_page(
+        session_id,
+        limit,
+        before=_decode_message_cursor(before) if before else None,
+        after=_decode_message_cursor(after) if after else None,
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not after:
+        rows = rows[::-1]
+    messages = agent.messages_from_dict([row.message for row in rows])
     resp = []
-    for session in sessions:
-        user_message = agent.get_chat_messages(str(session.session_id))
+    for row, message in zip(rows, messages):
         resp.append({
-            'session_id': session.session_id,
-            'created_at': session.created_at,
-            'last_update': session.updated_at,
-            'user_id': session.user_id,
-            'first_message': user_message[0].content if user_message else ""
+            "message_id": message.id,
+            "session_id": session_id,
+            "user_id": row.user_id,
+            "content": message.content,
+            "type": message.type,
+            "created_at": message.additional_kwargs.get('created_at') or row.created_at,
+            "like": row.like if row.like is not None else False,
+            "feedback": row.feedback or [],
+            "observations": row.observations or '',
         })
-    return resp
+    return {
+        "messages": resp,
+        "before_cursor": _encode_message_cursor(rows[0].id) if rows else None,
+        "after_cursor": _encode_message_cursor(rows[-1].id) if rows else None,
+        "has_more": has_more,
+    }
+
+def _encode_session_cursor(updated_at, row_id: int) -> str:
+    raw = f"{updated_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_session_cursor(cursor: str) -> tuple:
+    try:
+        updated_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(updated_at), int(row_id)
+    except Exception:
+        raise ValueError("Cursor inválido.")
+
+def get_sessions_page(user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None) -> dict:
+    """
+    Lista las conversaciones del usuario con su primer mensaje en una sola consulta.
+
+    Returns:
+        dict: `chats` y `next_cursor` (None si no hay más páginas).
+    """
+    rows = connection.get_sessions_with_first_message(
+        user_id,
+        limit=limit,
+        cursor=_decode_session_cursor(cursor) if cursor else None,
+    )
+    chats = [{
+        'session_id': row.session_id,
+        'created_at': row.created_at,
+        'last_update': row.updated_at,
+        'user_id': row.user_id,
+        'first_message': row.first_message,
+    } for row in rows]
+    next_cursor = None
+    if limit is not None and len(rows) == limit:
+        next_cursor = _encode_session_cursor(rows[-1].updated_at, rows[-1].id)
+    return {"chats": chats, "next_cursor": next_cursor}
+
+def get_session_ids(user_id: str):
+    return get_sessions_page(user_id)["chats"]
 
 def get_new_session_id(**kwargs):
     data = dict(**kwargs)
     return connection.create_session(data)
 
 def update_timestamp(session_id: str):
-    info = {
-        'updated_at': time_now()
-    }
-
-    connection.update_user_session(session_id, info)
+    """Marca la actividad de la sesión; se escribe en segundo plano (ver write_behind)."""
+    try:
+        session_id = str(uuid.UUID(str(session_id)))
+    except ValueError:
+        # Un id inválido haría fallar el lote entero de la cola
+        logger.warning(f"update_timestamp: session_id inválido {session_id!r}, se omite")
+        return
+    write_behind.queue.put("session_touch", session_id, datetime.now(timezone.utc))
 
 def delete_conversation(session_id: str):
     info = {
@@ -415,20 +1012,11 @@ def update_message(info):
 
     return connection.create_message_revision(info)
 
+def update_messages(items: List[dict]):
+    """Guarda varias reacciones en una sola sentencia (ver connection.upsert_message_revisions)."""
+    created_at = time_now()
+    return connection.upsert_message_revisions([{**item, 'created_at': created_at} for item in items])
 
-def get_validation(user_id: str, interval: str, num_msg: int):
-    first_date = get_past_time(interval_str=interval)
-    sessions = connection.get_sessions_by_user(user_id)
-    session_ids = [s.session_id for s in sessions]
-    counts = connection.count_chat_history_rows(session_ids, first_date)
-    msg_left = num_msg - sum(counts)
-    data = {
-        'user_id': user_id,
-        'interval': interval,
-        'num_msg': num_msg,
-        'total_msg': sum(counts),
-        'msg_left': msg_left,
-        'valid': msg_left > 0
-    }
 
-    return data
\ No newline at end of file
+def get_validation(user_id: str, interval: str, num_msg: int):
+    return quota.tracker.status(user_id, interval, num_msg)
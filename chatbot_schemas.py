@@ -24,6 +24,11 @@ class ExtractedParams(BaseModel):
 class List_Formula(BaseModel):
     formulas: List[FormulaInfo]
 
+# Schema para el NODO combinado (routing + análisis de fórmulas en una sola llamada)
+class RouterWithFormulas(BaseModel):
+    decision: Literal["formula", "chatbot"] = Field(description="El siguiente paso a tomar: analizar fórmulas o ir al chatbot.")
+    formulas: List[FormulaInfo] = Field(default_factory=list, description="Fórmulas relevantes para la pregunta (vacía si la decisión es 'chatbot').")
+
 # Estado Principal del Grafo LangGraph
 class State(TypedDict):
     # Historial de mensajes (fundamental)
@@ -0,0 +1,289 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from langgraph.checkpoint.postgres import PostgresSaver
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+
+logger = logging.getLogger(__name__)
+
+# Checkpoints que se conservan por hilo al terminar cada turno (0 = todos)
+CHECKPOINT_KEEP_LAST = int(os.environ.get("CHECKPOINT_KEEP_LAST", 0))
+# Si es True solo se guarda el checkpoint final del turno, no uno por super-step
+CHECKPOINT_TURN_ONLY = os.environ.get("CHECKPOINT_TURN_ONLY", "false").lower() == "true"
+# Compactación en segundo plano de hilos inactivos (0, por defecto, la desactiva)
+CHECKPOINT_COMPACT_INTERVAL = int(os.environ.get("CHECKPOINT_COMPACT_INTERVAL", 0))
+CHECKPOINT_COMPACT_IDLE_DAYS = float(os.environ.get("CHECKPOINT_COMPACT_IDLE_DAYS", 7))
+# Si es True la compactación borra para siempre los checkpoints de conversaciones
+# borradas (is_active = false); sin esto el borrado lógico sigue siendo reversible
+CHECKPOINT_PURGE_DELETED = os.environ.get("CHECKPOINT_PURGE_DELETED", "false").lower() == "true"
+
+# Borra los checkpoints más viejos que los `keep` últimos y sus escrituras pendientes.
+# Los checkpoint_id son uuid6: el orden lexicográfico es el cronológico.
+PRUNE_CHECKPOINTS_SQL = """
+    WITH pruned AS (
+        DELETE FROM checkpoints
+        WHERE thread_id = %(thread_id)s
+        AND checkpoint_ns = %(checkpoint_ns)s
+        AND checkpoint_id NOT IN (
+            SELECT checkpoint_id FROM checkpoints
+            WHERE thread_id = %(thread_id)s AND checkpoint_ns = %(checkpoint_ns)s
+            ORDER BY checkpoint_id DESC
+            LIMIT %(keep)s
+        )
+        RETURNING checkpoint_id
+    )
+    DELETE FROM checkpoint_writes
+    WHERE thread_id = %(thread_id)s
+    AND checkpoint_ns = %(checkpoint_ns)s
+    AND checkpoint_id IN (SELECT checkpoint_id FROM pruned)
+"""
+
+# Blobs (valores de canales) que ya no referencia ningún checkpoint del hilo
+PRUNE_BLOBS_SQL = """
+    DELETE FROM checkpoint_blobs b
+    WHERE b.thread_id = %(thread_id)s
+    AND b.checkpoint_ns = %(checkpoint_ns)s
+    AND NOT EXISTS (
+        SELECT 1 FROM checkpoints c
+        WHERE c.thread_id = b.thread_id
+        AND c.checkpoint_ns = b.checkpoint_ns
+        AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version
+    )
+"""
+
+IDLE_THREADS_SQL = """
+    SELECT thread_id, checkpoint_ns
+    FROM checkpoints
+    GROUP BY thread_id, checkpoint_ns
+    HAVING COUNT(*) > 1
+    AND MAX((checkpoint ->> 'ts')::timestamptz) < %(cutoff)s
+    LIMIT %(limit)s
+"""
+
+# Conversaciones borradas por el usuario (ver chatbot.delete_conversation)
+DELETED_THREADS_SQL = """
+    SELECT DISTINCT c.thread_id
+    FROM checkpoints c
+    JOIN user_sessions us ON us.session_id::text = c.thread_id
+    WHERE NOT us.is_active
+    LIMIT %(limit)s
+"""
+
+
+def _prune_params(thread_id: str, checkpoint_ns: str, keep: int) -> dict:
+    return {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "keep": keep}
+
+
+class _TurnBuffer():
+    """
+    Checkpoints del turno en curso que aún no se escribieron, por hilo.
+
+    Solo se guarda el último checkpoint, con la unión de las versiones de
+    canales nuevas de todo el turno: así se escriben los blobs de cada canal
+    que cambió en algún paso, no solo en el último. El padre es el último
+    checkpoint ya persistido.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple[str, str], tuple] = {}
+        self._lock = threading.Lock()
+
+    def add(self, config: dict, checkpoint: dict, metadata: dict, new_versions: dict) -> dict:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        key = (thread_id, checkpoint_ns)
+        with self._lock:
+            pending = self._pending.get(key)
+            parent_config, versions = (pending[0], pending[3]) if pending else (config, {})
+            self._pending[key] = (parent_config, checkpoint, metadata, {**versions, **new_versions})
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def pop(self, thread_id: str) -> List[tuple]:
+        with self._lock:
+            keys = [key for key in self._pending if key[0] == thread_id]
+            return [self._pending.pop(key) for key in keys]
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+
+class TurnPostgresSaver(PostgresSaver):
+    """
+    `PostgresSaver` con retención y, opcionalmente, un checkpoint por turno.
+
+    Con `turn_only` los `put` del grafo quedan en memoria y `end_turn` escribe
+    solo el último; las escrituras pendientes por tarea (`put_writes`) se
+    omiten, así que un turno interrumpido no se puede reanudar desde la mitad.
+    Con `keep_last` > 0, `end_turn` borra los checkpoints más viejos del hilo.
+    """
+
+    def __init__(self, conn, turn_only: bool = CHECKPOINT_TURN_ONLY, keep_last: int = CHECKPOINT_KEEP_LAST):
+        super().__init__(conn)
+        self.turn_only = turn_only
+        self.keep_last = keep_last
+        self._buffer = _TurnBuffer()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        if self.turn_only:
+            return self._buffer.add(config, checkpoint, metadata, new_versions)
+        return super().put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id, *args, **kwargs) -> None:
+        if self.turn_only:
+            return
+        super().put_writes(config, writes, task_id, *args, **kwargs)
+
+    def prune(self, thread_id: str, keep: int, checkpoint_ns: str = "") -> None:
+        """Conserva los `keep` checkpoints más recientes del hilo."""
+        params = _prune_params(thread_id, checkpoint_ns, keep)
+        with self._cursor(pipeline=True) as cur:
+            cur.execute(PRUNE_CHECKPOINTS_SQL, params)
+            cur.execute(PRUNE_BLOBS_SQL, params)
+
+    def end_turn(self, thread_id: str) -> None:
+        """Escribe el checkpoint final del turno (si quedó en memoria) y aplica la retención."""
+        pending = self._buffer.pop(thread_id)
+        for config, checkpoint, metadata, versions in pending:
+            super().put(config, checkpoint, metadata, versions)
+        if self.keep_last:
+            for checkpoint_ns in {config["configurable"].get("checkpoint_ns", "") for config, *_ in pending} or {""}:
+                self.prune(thread_id, self.keep_last, checkpoint_ns)
+
+
+class TurnAsyncPostgresSaver(AsyncPostgresSaver):
+    """Versión async de `TurnPostgresSaver`."""
+
+    def __init__(self, conn, turn_only: bool = CHECKPOINT_TURN_ONLY, keep_last: int = CHECKPOINT_KEEP_LAST):
+        super().__init__(conn)
+        self.turn_only = turn_only
+        self.keep_last = keep_last
+        self._buffer = _TurnBuffer()
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        if self.turn_only:
+            return self._buffer.add(config, checkpoint, metadata, new_versions)
+        return await super().aput(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, *args, **kwargs) -> None:
+        if self.turn_only:
+            return
+        await super().aput_writes(config, writes, task_id, *args, **kwargs)
+
+    async def aprune(self, thread_id: str, keep: int, checkpoint_ns: str = "") -> None:
+        params = _prune_params(thread_id, checkpoint_ns, keep)
+        async with self._cursor(pipeline=True) as cur:
+            await cur.execute(PRUNE_CHECKPOINTS_SQL, params)
+            await cur.execute(PRUNE_BLOBS_SQL, params)
+
+    async def aend_turn(self, thread_id: str) -> None:
+        pending = self._buffer.pop(thread_id)
+        for config, checkpoint, metadata, versions in pending:
+            await super().aput(config, checkpoint, metadata, versions)
+        if self.keep_last:
+            for checkpoint_ns in {config["configurable"].get("checkpoint_ns", "") for config, *_ in pending} or {""}:
+                await self.aprune(thread_id, self.keep_last, checkpoint_ns)
+
+
+class CheckpointCompactor():
+    """
+    Compactación periódica de los checkpoints.
+
+    Los hilos sin actividad en `idle_days` se reducen a su último checkpoint
+    (lo único que necesita `graph.get_state`). Con `purge_deleted` también se
+    eliminan los de conversaciones borradas, lo que ya no se puede deshacer
+    reactivando la sesión. Trabaja por lotes de `batch_size` hilos para no
+    mantener transacciones largas.
+    """
+
+    def __init__(
+        self,
+        interval: int = CHECKPOINT_COMPACT_INTERVAL,
+        idle_days: float = CHECKPOINT_COMPACT_IDLE_DAYS,
+        purge_deleted: bool = CHECKPOINT_PURGE_DELETED,
+        batch_size: int = 500,
+    ):
+        self.interval = interval
+        self.idle_days = idle_days
+        self.purge_deleted = purge_deleted
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_run: Optional[float] = None
+        self.last_result: Optional[dict] = None
+        self.last_error: Optional[str] = None
+
+    def run_once(self) -> dict:
+        """Una pasada completa. Devuelve cuántos hilos se compactaron y borraron."""
+        from postgres_db import get_checkpoint
+
+        saver = get_checkpoint()
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.idle_days)
+        result = {"compacted_threads": 0, "deleted_threads": 0}
+        while self.purge_deleted and not self._stop.is_set():
+            with saver._cursor() as cur:
+                cur.execute(DELETED_THREADS_SQL, {"limit": self.batch_size})
+                deleted = [row["thread_id"] for row in cur.fetchall()]
+            for thread_id in deleted:
+                saver.delete_thread(thread_id)
+            result["deleted_threads"] += len(deleted)
+            if len(deleted) < self.batch_size:
+                break
+        while not self._stop.is_set():
+            with saver._cursor() as cur:
+                cur.execute(IDLE_THREADS_SQL, {"cutoff": cutoff, "limit": self.batch_size})
+                idle = [(row["thread_id"], row["checkpoint_ns"]) for row in cur.fetchall()]
+            for thread_id, checkpoint_ns in idle:
+                saver.prune(thread_id, 1, checkpoint_ns)
+            result["compacted_threads"] += len(idle)
+            if len(idle) < self.batch_size:
+                break
+        self.last_run = time.time()
+        self.last_result = result
+        self.last_error = None
+        logger.info(f"Compactación de checkpoints: {result}")
+        return result
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                self.last_error = repr(e)
+                logger.error(f"Error compactando checkpoints: {e}")
+
+    def start(self) -> None:
+        """Arranca la compactación periódica (idempotente; no hace nada si el intervalo es 0)."""
+        if self.interval <= 0:
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="checkpoint-compaction", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {
+            "interval": self.interval,
+            "idle_days": self.idle_days,
+            "purge_deleted": self.purge_deleted,
+            "last_run": self.last_run,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
+
+
+compactor = CheckpointCompactor()
+
+
+if __name__ == "__main__":
+    import json
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(compactor.run_once(), indent=2))
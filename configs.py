@@ -1,6 +1,10 @@
 import json
 import os
-from google.cloud import secretmanager
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Set
 from google.oauth2 import service_account
 
 try:
@@ -15,22 +19,242 @@ try:
 except:
     pass
 
-def get_secret(secret_name):
-    client = secretmanager.SecretManagerServiceClient()
-    project_id = os.environ.get("GOOGLE_PROJECT_ID")  # Ensure you have your GCP project ID as an env variable
-    if not project_id:
-        raise ValueError("GOOGLE_PROJECT_ID environment variable not set.")
+logger = logging.getLogger(__name__)
+
+# Tiempo (s) que un secreto se mantiene en memoria antes de volver a leerlo
+SECRET_CACHE_TTL = int(os.environ.get("SECRET_CACHE_TTL", 3600))
+# Espera (s) antes de reintentar una relectura fallida (mientras, se usa el valor anterior)
+SECRET_RETRY_DELAY = int(os.environ.get("SECRET_RETRY_DELAY", 60))
+# 'gcp' (Secret Manager) o 'local' (archivo JSON / variables de entorno)
+SECRETS_PROVIDER = os.environ.get("SECRETS_PROVIDER", "gcp").lower()
+
+
+class SecretManagerProvider():
+    """Lee secretos JSON de Google Secret Manager con un único cliente compartido."""
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
 
-    secret_version_name = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
+    def _get_client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from google.cloud import secretmanager
+                    self._client = secretmanager.SecretManagerServiceClient()
+        return self._client
 
-    try:
-        response = client.access_secret_version(request={"name": secret_version_name})
+    def load(self, secret_name: str) -> dict:
+        project_id = os.environ.get("GOOGLE_PROJECT_ID")  # Ensure you have your GCP project ID as an env variable
+        if not project_id:
+            raise ValueError("GOOGLE_PROJECT_ID environment variable not set.")
+
+        secret_version_name = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
+        response = self._get_client().access_secret_version(request={"name": secret_version_name})
         secret_content = response.payload.data.decode("utf-8")
         # Assuming your secret content is a JSON key file
-        credentials_info = json.loads(secret_content)
-    except Exception as e:
-        print(f"Error accessing secret '{secret_name}': {e}")
-        # Handle the error appropriately, perhaps by raising it
-        raise
+        return json.loads(secret_content)
+
+
+class LocalSecretProvider():
+    """
+    Lee secretos sin Secret Manager (desarrollo y pruebas).
+
+    Busca primero la variable de entorno `SECRET_<NOMBRE>` (JSON) y luego la
+    clave `<nombre>` del archivo JSON indicado en `SECRETS_FILE`.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.environ.get("SECRETS_FILE", "secrets.json")
+
+    def load(self, secret_name: str) -> dict:
+        env_name = "SECRET_" + "".join(c if c.isalnum() else "_" for c in secret_name).upper()
+        if env_name in os.environ:
+            return json.loads(os.environ[env_name])
+        with open(self.path, "r") as f:
+            secrets = json.load(f)
+        if secret_name not in secrets:
+            raise KeyError(f"Secret '{secret_name}' not found in {self.path} nor in {env_name}.")
+        return secrets[secret_name]
+
+
+class SecretStore():
+    """
+    Cache en memoria con TTL delante de un proveedor de secretos.
+
+    Solo la primera lectura de un secreto bloquea. Después `get` siempre
+    devuelve el valor en memoria: al vencer el TTL el secreto se relee en un
+    hilo aparte (o en el refresco periódico de `start`), nunca en la petición.
+    Si la relectura falla se sigue usando el valor anterior y se reintenta
+    tras `retry_delay` segundos. Si el secreto cambió (rotación) se llaman los
+    callbacks registrados con `on_change` para que reconstruyan sus clientes.
+    """
+
+    def __init__(self, provider, ttl: int = SECRET_CACHE_TTL, retry_delay: int = SECRET_RETRY_DELAY):
+        self.provider = provider
+        self.ttl = ttl
+        self.retry_delay = retry_delay
+        # nombre -> (valor, vence_en)
+        self._cache: Dict[str, tuple] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self._listeners: Dict[str, List[Callable[[dict], None]]] = {}
+        self._refreshing: Set[str] = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.refresh_errors = 0
+
+    def on_change(self, secret_name: Optional[str], callback: Callable[[dict], None]) -> None:
+        """Registra `callback(nuevo_valor)` para cuando `secret_name` cambie al releerlo."""
+        if secret_name:
+            with self._guard:
+                self._listeners.setdefault(secret_name, []).append(callback)
+
+    def _lock_for(self, secret_name: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(secret_name, threading.Lock())
+
+    def get(self, secret_name: str) -> dict:
+        cached = self._cache.get(secret_name)
+        if cached is not None:
+            if time.time() >= cached[1]:
+                self._refresh_in_background(secret_name)
+            return cached[0]
+        # Primera lectura: un solo RPC por secreto aunque varios hilos lo pidan a la vez
+        with self._lock_for(secret_name):
+            cached = self._cache.get(secret_name)
+            if cached is not None:
+                return cached[0]
+            try:
+                value = self.provider.load(secret_name)
+            except Exception as e:
+                logger.error(f"Error accessing secret '{secret_name}': {e}")
+                raise
+            self._cache[secret_name] = (value, time.time() + self.ttl)
+            return value
+
+    def refresh(self, secret_name: str) -> dict:
+        """
+        Relee el secreto ahora. Si falla y hay un valor anterior, lo conserva
+        (y reintenta tras `retry_delay`); sin valor anterior propaga el error.
+        """
+        with self._lock_for(secret_name):
+            cached = self._cache.get(secret_name)
+            try:
+                value = self.provider.load(secret_name)
+            except Exception as e:
+                if cached is None:
+                    logger.error(f"Error accessing secret '{secret_name}': {e}")
+                    raise
+                self.refresh_errors += 1
+                logger.warning(f"Error refreshing secret '{secret_name}', keeping the cached value: {e}")
+                self._cache[secret_name] = (cached[0], time.time() + self.retry_delay)
+                return cached[0]
+            self._cache[secret_name] = (value, time.time() + self.ttl)
+        # Fuera del lock: los callbacks pueden volver a leer el secreto
+        if cached is not None and cached[0] != value:
+            self._notify(secret_name, value)
+        return value
+
+    def _refresh_in_background(self, secret_name: str) -> None:
+        with self._guard:
+            if secret_name in self._refreshing:
+                return
+            self._refreshing.add(secret_name)
+
+        def run():
+            try:
+                self.refresh(secret_name)
+            except Exception:
+                pass  # Ya registrado en refresh
+            finally:
+                with self._guard:
+                    self._refreshing.discard(secret_name)
+
+        threading.Thread(target=run, name=f"secret-refresh-{secret_name}", daemon=True).start()
+
+    def _notify(self, secret_name: str, value: dict) -> None:
+        for callback in list(self._listeners.get(secret_name, ())):
+            try:
+                callback(value)
+            except Exception as e:
+                logger.error(f"Error handling rotation of secret '{secret_name}': {e}")
+
+    def refresh_expired(self) -> None:
+        """Relee los secretos vencidos (lo llama el refresco periódico)."""
+        now = time.time()
+        for secret_name, (_, expires_at) in list(self._cache.items()):
+            if now >= expires_at:
+                self.refresh(secret_name)
+
+    def _run(self) -> None:
+        while not self._stop.wait(max(1, min(self.ttl, self.retry_delay))):
+            try:
+                self.refresh_expired()
+            except Exception as e:
+                logger.error(f"Error refreshing secrets: {e}")
+
+    def start(self) -> None:
+        """
+        Arranca el refresco periódico (idempotente). Así los clientes que leen
+        el secreto una sola vez se enteran de la rotación por `on_change`.
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="secret-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def invalidate(self, secret_name: Optional[str] = None) -> None:
+        """
+        Marca un secreto (o todos) como vencido para que se relea en segundo
+        plano. Se conserva el valor anterior para seguir sirviéndolo y para
+        detectar si rotó.
+        """
+        names = list(self._cache) if secret_name is None else [secret_name]
+        for name in names:
+            cached = self._cache.get(name)
+            if cached is not None:
+                self._cache[name] = (cached[0], 0.0)
+
+    def prefetch(self, secret_names: Iterable[str]) -> Dict[str, dict]:
+        """Carga varios secretos en paralelo."""
+        names = [name for name in dict.fromkeys(secret_names) if name]
+        if not names:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(names)) as executor:
+            return dict(zip(names, executor.map(self.get, names)))
+
+
+def _default_provider():
+    if SECRETS_PROVIDER == "local":
+        return LocalSecretProvider()
+    return SecretManagerProvider()
+
+
+secret_store = SecretStore(_default_provider())
+
+
+def get_secret(secret_name):
+    return secret_store.get(secret_name)
+
+
+def on_secret_change(secret_name: Optional[str], callback: Callable[[dict], None]) -> None:
+    """Ver `SecretStore.on_change`."""
+    secret_store.on_change(secret_name, callback)
+
+
+def prefetch_secrets(secret_names: Iterable[str] = None) -> Dict[str, dict]:
+    """
+    Carga en paralelo los secretos que usa el servicio.
 
-    return credentials_info
+    Por defecto: AGENT_SECRET_NAME, DB_SECRET_NAME y WCD_CRED_SECRET_NAME.
+    """
+    if secret_names is None:
+        secret_names = [os.environ.get(name) for name in ("AGENT_SECRET_NAME", "DB_SECRET_NAME", "WCD_CRED_SECRET_NAME")]
+    return secret_store.prefetch(secret_names)
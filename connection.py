@@ -1,8 +1,10 @@
-from postgres_db import get_db_engine
+from postgres_db import get_db_engine, get_table_name
 import models
 from sqlalchemy.orm import Session
-from typing import List, Dict
+from typing import List, Dict, Optional
+from datetime import datetime
 from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
 
 
 def get_sessions_by_user(user_id: str) -> List[models.UserSession]:
@@ -18,6 +20,49 @@ def get_sessions_by_user(user_id: str) -> List[models.UserSession]:
         )
         return query.all()
 
+def get_sessions_with_first_message(user_id: str, limit: Optional[int] = None, cursor: Optional[tuple] = None) -> list:
+    """
+    Lists a user's active sessions with their first chat message in a single query.
+
+    Sessions are ordered by (updated_at, id) descending. Pagination is keyset
+    based: pass the (updated_at, id) of the last row of the previous page as
+    `cursor` to get the next one.
+
+    Returns:
+        list: Rows with id, session_id, user_id, created_at, updated_at and first_message.
+    """
+    params = {"user_id": user_id}
+    cursor_filter = ""
+    if cursor is not None:
+        cursor_filter = "AND (us.updated_at, us.id) < (:cursor_updated_at, :cursor_id)"
+        params["cursor_updated_at"], params["cursor_id"] = cursor
+    limit_clause = ""
+    if limit is not None:
+        limit_clause = "LIMIT :limit"
+        params["limit"] = limit
+
+    sql = text(f"""
+        SELECT us.id, us.session_id, us.user_id, us.created_at, us.updated_at,
+               COALESCE(fm.message -> 'data' ->> 'content', '') AS first_message
+        FROM user_sessions us
+        LEFT JOIN LATERAL (
+            SELECT ch.message
+            FROM {get_table_name()} ch
+            WHERE ch.session_id = us.session_id
+            ORDER BY ch.id
+            LIMIT 1
+        ) fm ON TRUE
+        WHERE us.user_id = :user_id
+        AND us.is_active
+        {cursor_filter}
+        ORDER BY us.updated_at DESC, us.id DESC
+        {limit_clause}
+    """)
+
+    engine = get_db_engine()
+    with Session(engine) as session:
+        return session.execute(sql, params).all()
+
 def get_session_user(session_id: str) -> models.UserSession:
     engine = get_db_engine()
     with Session(engine) as session:
@@ -55,26 +100,68 @@ def update_user_session(session_id: str, info: dict) -> models.UserSession:
 
         return query.first()
 
-def create_message_revision(data: dict) -> models.MessageInfo:
+def touch_sessions(updates: Dict[str, datetime]) -> int:
+    """
+    Sets `updated_at` of many sessions in one statement.
+
+    A row is only moved forward, so an older batch arriving late cannot undo
+    a newer one.
+
+    Args:
+        updates (dict[str, datetime]): {session_id: updated_at}.
+
+    Returns:
+        int: Number of rows updated.
+    """
+    if not updates:
+        return 0
+    sql = text("""
+        UPDATE user_sessions us
+        SET updated_at = v.updated_at
+        FROM unnest(CAST(:session_ids AS uuid[]), CAST(:updated_ats AS timestamptz[])) AS v(session_id, updated_at)
+        WHERE us.session_id = v.session_id
+        AND us.updated_at < v.updated_at
+    """)
+
     engine = get_db_engine()
-    msg_id = data['message_id']
-    with Session(engine) as db:  # Use Session directly in a context manager
-        query = db.query(
-            models.MessageInfo
-        ).filter(
-            models.MessageInfo.message_id == msg_id
-        )
-        if query.first():
-            query.update(data)
-            db.commit()
-            return query.first()
-        else:
-            db_new = models.MessageInfo(**data)
-            db.add(db_new)
-            db.commit()
-            db.refresh(db_new)
+    with Session(engine) as session:
+        result = session.execute(sql, {
+            "session_ids": [str(session_id) for session_id in updates],
+            "updated_ats": list(updates.values()),
+        })
+        session.commit()
+        return result.rowcount
+
+def create_message_revision(data: dict) -> models.MessageInfo:
+    """Inserts or updates the revision of a message (see `upsert_message_revisions`)."""
+    return upsert_message_revisions([data])[0]
+
+def upsert_message_revisions(items: List[dict]) -> List[models.MessageInfo]:
+    """
+    Inserts or updates many message revisions in one atomic statement.
 
-            return db_new
+    Runs `INSERT ... ON CONFLICT (message_id) DO UPDATE ... RETURNING`, so
+    concurrent reactions to the same message cannot race into duplicates.
+    If a message appears more than once, the last item wins.
+
+    Returns:
+        list[models.MessageInfo]: The stored revisions.
+    """
+    items = list({item['message_id']: item for item in items}.values())
+    if not items:
+        return []
+    columns = sorted({key for item in items for key in item} - {'message_id'})
+    stmt = insert(models.MessageInfo)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.MessageInfo.message_id],
+        set_={column: stmt.excluded[column] for column in columns},
+    ).returning(models.MessageInfo)
+
+    engine = get_db_engine()
+    with Session(engine, expire_on_commit=False) as session:
+        revisions = session.scalars(stmt, items).all()
+        session.commit()
+        return revisions
 
 def get_message_revision(message_id: list) -> List[models.MessageInfo]:
     engine = get_db_engine()
@@ -87,35 +174,182 @@ def get_message_revision(message_id: list) -> List[models.MessageInfo]:
 
         return query.all()
     
-def count_chat_history_rows(session_ids: list[str], first_date) -> dict[str, int]:
+def count_user_messages_by_bucket(user_id: str, first_date, bucket_seconds: int) -> Dict[int, int]:
     """
-    Counts rows in 'chat_history' for each session_id using raw SQL.
-    
+    Counts a user's chat history rows since a date, grouped in time buckets.
+
     Args:
-        session_ids (list[str]): List of session IDs to filter by.
-        engine: SQLAlchemy engine (from create_engine).
-    
+        user_id (str): Owner of the sessions (active ones only).
+        first_date: Only rows created after this date are counted.
+        bucket_seconds (int): Bucket width; the bucket of a row is
+            floor(epoch(created_at) / bucket_seconds).
+
     Returns:
-        dict[str, int]: {session_id: row_count} (e.g., {"abc123": 5}).
+        dict[int, int]: {bucket: row_count}.
     """
-    if not session_ids:
-        return {}
+    sql = text(f"""
+        SELECT FLOOR(EXTRACT(EPOCH FROM ch.created_at) / :bucket_seconds)::bigint AS bucket,
+               COUNT(*) AS row_count
+        FROM {get_table_name()} ch
+        JOIN user_sessions us ON us.session_id = ch.session_id
+        WHERE us.user_id = :user_id
+        AND us.is_active
+        AND ch.created_at > :first_date
+        GROUP BY bucket
+    """)
 
-    # Convert session_ids to a tuple for SQL IN clause
-    ids_tuple = tuple(session_ids)
-    
-    # Handle single-element tuple edge case (SQL requires trailing comma)
-    if len(ids_tuple) == 1:
-        ids_tuple = f"('{ids_tuple[0]}')"
+    engine = get_db_engine()
+    with Session(engine) as session:
+        result = session.execute(sql, {
+            "user_id": user_id,
+            "first_date": first_date,
+            "bucket_seconds": bucket_seconds,
+        })
+        return {row.bucket: row.row_count for row in result}
+
+
+def get_chat_summary(session_id: str) -> Optional[models.ChatSummary]:
+    engine = get_db_engine()
+    with Session(engine) as session:
+        return session.get(models.ChatSummary, session_id)
+
+def save_chat_summary(session_id: str, summary: str, summarized_until: int) -> None:
+    """
+    Inserts or updates the rolling summary of a session.
+
+    The update only applies if it moves `summarized_until` forward, so a
+    late concurrent writer cannot overwrite a newer summary.
+    """
+    sql = text("""
+        INSERT INTO chat_summary (session_id, summary, summarized_until, updated_at)
+        VALUES (:session_id, :summary, :summarized_until, NOW())
+        ON CONFLICT (session_id) DO UPDATE
+        SET summary = EXCLUDED.summary,
+            summarized_until = EXCLUDED.summarized_until,
+            updated_at = NOW()
+        WHERE chat_summary.summarized_until < EXCLUDED.summarized_until
+    """)
+
+    engine = get_db_engine()
+    with Session(engine) as session:
+        session.execute(sql, {"session_id": session_id, "summary": summary, "summarized_until": summarized_until})
+        session.commit()
+
+def get_rag_cache_version(name: str = "rag") -> int:
+    """Shared version of the RAG caches (0 until the first invalidation)."""
+    sql = text("SELECT version FROM rag_cache_version WHERE name = :name")
+
+    engine = get_db_engine()
+    with Session(engine) as session:
+        return session.execute(sql, {"name": name}).scalar() or 0
+
+def bump_rag_cache_version(name: str = "rag") -> int:
+    """Increments the shared version of the RAG caches and returns the new value."""
+    sql = text("""
+        INSERT INTO rag_cache_version (name, version, updated_at)
+        VALUES (:name, 1, NOW())
+        ON CONFLICT (name) DO UPDATE
+        SET version = rag_cache_version.version + 1,
+            updated_at = NOW()
+        RETURNING version
+    """)
+
+    engine = get_db_engine()
+    with Session(engine) as session:
+        version = session.execute(sql, {"name": name}).scalar_one()
+        session.commit()
+        return version
+
+def count_session_messages(session_id: str, limit: int) -> int:
+    """
+    Counts a session's chat history rows, stopping at `limit + 1`.
+
+    Enough to tell whether a session has more than `limit` messages without
+    scanning long conversations.
+    """
+    sql = text(f"""
+        SELECT COUNT(*) FROM (
+            SELECT 1
+            FROM {get_table_name()}
+            WHERE session_id = :session_id
+            LIMIT :limit
+        ) AS recent
+    """)
+
+    engine = get_db_engine()
+    with Session(engine) as session:
+        return session.execute(sql, {"session_id": session_id, "limit": limit + 1}).scalar_one()
+
+def get_chat_history_after(session_id: str, after_id: int = 0) -> list:
+    """
+    Chat history rows of a session with id greater than `after_id`, oldest first.
+
+    Returns:
+        list: Rows with id and message (the serialized LangChain message).
+    """
+    sql = text(f"""
+        SELECT id, message
+        FROM {get_table_name()}
+        WHERE session_id = :session_id
+        AND id > :after_id
+        ORDER BY id
+    """)
+
+    engine = get_db_engine()
+    with Session(engine) as session:
+        return session.execute(sql, {"session_id": session_id, "after_id": after_id}).all()
+
+def get_chat_history_page(session_id: str, limit: int, before: Optional[int] = None, after: Optional[int] = None) -> list:
+    """
+    A page of a session's chat history with the owner and revisions, in one query.
+
+    Without cursors it returns the latest `limit` messages. `before` pages
+    back (rows with a smaller id) and `after` pages forward. Only the page's
+    rows are joined with `user_sessions` and `message_revision`.
+
+    Returns:
+        list: Up to `limit + 1` rows in paging order (newest first unless
+        `after` is given) with id, message, created_at, user_id, like,
+        feedback and observations. The extra row tells the caller there are
+        more messages in that direction.
+    """
+    params = {"session_id": session_id, "limit": limit + 1}
+    cursor_filter = ""
+    order = "DESC"
+    if after is not None:
+        cursor_filter = "AND id > :after"
+        params["after"] = after
+        order = "ASC"
+    elif before is not None:
+        cursor_filter = "AND id < :before"
+        params["before"] = before
 
     sql = text(f"""
-        SELECT COUNT(*) as row_count
-        FROM chat_history
-        WHERE session_id IN {ids_tuple}
-        AND created_at > '{first_date}'
+        SELECT ch.id, ch.message, ch.created_at, us.user_id, mr."like", mr.feedback, mr.observations
+        FROM (
+            SELECT id, message, created_at, session_id
+            FROM {get_table_name()}
+            WHERE session_id = :session_id
+            {cursor_filter}
+            ORDER BY id {order}
+            LIMIT :limit
+        ) ch
+        LEFT JOIN LATERAL (
+            SELECT user_id FROM user_sessions
+            WHERE session_id = ch.session_id
+            ORDER BY id
+            LIMIT 1
+        ) us ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT "like", feedback, observations FROM message_revision
+            WHERE message_id = ch.message -> 'data' ->> 'id'
+            ORDER BY id DESC
+            LIMIT 1
+        ) mr ON TRUE
+        ORDER BY ch.id {order}
     """)
 
     engine = get_db_engine()
     with Session(engine) as session:
-        result = session.execute(sql)
-        return [row.row_count for row in result]
\ No newline at end of file
+        rows = session.execute(sql, params).all()
+    return rows
@@ -1,57 +1,192 @@
 import os
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import text
+from langchain_core.documents import Document
 from langchain_google_alloydb_pg import AlloyDBEngine
 from langchain_google_vertexai import VertexAIEmbeddings
-from postgres_db import get_db
 from langchain_google_alloydb_pg import AlloyDBVectorStore
-import uuid
 
+import ingestion
+import vector_backends
+from vector_backends import VectorBackend
 
-embedding = VertexAIEmbeddings(
-    model_name="textembedding-gecko@latest", project=os.getenv("PROJECT_ID")
-)
+# Tabla de vectores en AlloyDB (la tabla del historial usa TABLE_NAME)
+VECTOR_TABLE_NAME = os.getenv("VECTOR_TABLE_NAME", "rag_documents")
+VECTOR_SIZE = 768  # Vector size for VertexAI model (text-embedding-004)
 
-engine = AlloyDBEngine.from_instance(
-    project_id=PROJECT_ID,
-    region=REGION,
-    cluster=CLUSTER,
-    instance=INSTANCE,
-    database=DATABASE,
-)
+# El engine se crea en el primer uso (no al importar)
+_engine = None
+_lock = threading.Lock()
+
+
+def get_embedding() -> VertexAIEmbeddings:
+    # El mismo modelo que las consultas del agente, para que los vectores sean comparables entre backends
+    import agent
+    return agent.get_embeddings()
+
+
+def get_engine() -> AlloyDBEngine:
+    global _engine
+    with _lock:
+        if _engine is None:
+            _engine = AlloyDBEngine.from_instance(
+                project_id=os.getenv("GOOGLE_PROJECT_ID"),
+                region=os.getenv("REGION"),
+                cluster=os.getenv("CLUSTER"),
+                instance=os.getenv("INSTANCE"),
+                database=os.getenv("DATABASE"),
+            )
+    return _engine
 
-engine.init_vectorstore_table(
-    table_name=TABLE_NAME,
-    vector_size=768,  # Vector size for VertexAI model(textembedding-gecko@latest)
-)
 
 # Function to initialize vector store
-def get_vector_store():
-    db_conn = next(get_db())  # Get a database connection
-    
+def get_vector_store() -> AlloyDBVectorStore:
+    return get_backend().store
+
+
+def _json_text(value) -> str:
+    """El valor como lo devuelve `->>` (texto de un string, JSON del resto)."""
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def build_filter(filters: Optional[Dict[str, Any]]) -> Tuple[str, dict]:
+    """
+    `{propiedad: valor}` a una condición SQL sobre la columna JSON de metadatos.
+
+    Nombres y valores vienen del cliente: van siempre como parámetros.
+
+    Returns:
+        tuple: (condición, parámetros); la condición es "" si no hay filtros.
+    """
+    if not filters:
+        return "", {}
+    conditions, params = [], {}
+    for i, (name, value) in enumerate(filters.items()):
+        column = f"langchain_metadata ->> CAST(:filter_key_{i} AS text)"
+        params[f"filter_key_{i}"] = str(name)
+        if isinstance(value, (list, tuple, set)):
+            conditions.append(f"{column} = ANY(CAST(:filter_value_{i} AS text[]))")
+            params[f"filter_value_{i}"] = [_json_text(v) for v in value]
+        else:
+            conditions.append(f"{column} = :filter_value_{i}")
+            params[f"filter_value_{i}"] = _json_text(value)
+    return " AND ".join(conditions), params
+
+
+# Distancia coseno, la estrategia por defecto de AlloyDBVectorStore (y la de su índice)
+SEARCH_SQL = """
+    SELECT content, langchain_metadata, embedding <=> CAST(:vector AS vector) AS distance
+    FROM "{table}"
+    {where}
+    ORDER BY embedding <=> CAST(:vector AS vector)
+    LIMIT :k
+"""
+
+
+class AlloyDBBackend(VectorBackend):
+    """
+    Backend sobre AlloyDB/pgvector (`AlloyDBVectorStore`), solo búsqueda por vector.
+
+    El engine y el store se crean una vez y se reutilizan. El `score` es la
+    similitud coseno (1 - distancia).
+    """
+
+    name = "alloydb"
+    search_types = ("vector",)
+
+    def __init__(self, table_name: str = VECTOR_TABLE_NAME):
+        self.table_name = table_name
+        self._store = None
+        self._lock = threading.Lock()
+
+    @property
+    def store(self) -> AlloyDBVectorStore:
+        if self._store is None:
+            engine = get_engine()
+            with self._lock:
+                if self._store is None:
+                    try:
+                        engine.init_vectorstore_table(table_name=self.table_name, vector_size=VECTOR_SIZE)
+                    except Exception:
+                        pass  # La tabla ya existe
+                    self._store = AlloyDBVectorStore.create_sync(
+                        engine=engine,
+                        table_name=self.table_name,
+                        embedding_service=get_embedding(),
+                    )
+        return self._store
+
+    def open(self) -> None:
+        self.store
+
+    async def _aquery(self, sql: str, params: dict) -> list:
+        async with get_engine()._pool.connect() as conn:
+            result = await conn.execute(text(sql), params)
+            return result.mappings().fetchall()
+
+    def search(self, query, vector, k, search_type="vector", alpha=0.5, filters=None) -> List[Document]:
+        # El filtro de AlloyDBVectorStore es SQL crudo; la consulta se arma aquí con parámetros
+        self.check_search_type(search_type)
+        self.store # Crea la tabla si no existe
+        condition, params = build_filter(filters)
+        sql = SEARCH_SQL.format(
+            table=self.table_name.replace('"', '""'),
+            where=f"WHERE {condition}" if condition else "",
+        )
+        params.update({"vector": str([float(value) for value in vector]), "k": k})
+        rows = get_engine()._run_as_sync(self._aquery(sql, params))
+        return [
+            Document(
+                page_content=row["content"],
+                metadata={**(row["langchain_metadata"] or {}), "score": 1 - row["distance"], "search_type": search_type},
+            )
+            for row in rows
+        ]
+
+    def add(self, ids, texts, vectors, metadatas) -> int:
+        # El id va también en los metadatos para devolverlo como `uuid`
+        self.store.add_embeddings(
+            texts=texts,
+            embeddings=vectors,
+            metadatas=[{**metadata, "uuid": id_} for id_, metadata in zip(ids, metadatas)],
+            ids=ids,
+        )
+        return len(ids)
+
+    def delete(self, ids) -> None:
+        self.store.delete(ids)
+
+    def close(self) -> None:
+        global _engine
+        with _lock:
+            engine, _engine = _engine, None
+            self._store = None
+        if engine is not None:
+            engine.close()
+
 
-    store = AlloyDBVectorStore.create(
-        engine=engine,
-        table_name=TABLE_NAME,
-        embedding_service=embedding,
-    )
-    return store
+def get_backend() -> AlloyDBBackend:
+    return vector_backends.get_backend("alloydb")
 
 # Function to add documents
-def add_documents(all_texts):
-    """Adds a list of documents to the AlloyDB vector store."""
-    metadatas = [{"len": len(t)} for t in all_texts]
-    ids = [str(uuid.uuid4()) for _ in all_texts]
-    store = get_vector_store()
+def add_documents(all_texts, checkpoint_path=None):
+    """
+    Adds a list of documents to the AlloyDB vector store.
 
-    store.add_texts(all_texts, metadatas=metadatas, ids=ids)
+    Uses the ingestion pipeline: embeddings in batches with retries, bulk
+    writes, deterministic ids and dedup by content hash. These texts carry no
+    `source`, so identical texts are stored once.
+    """
+    chunks = ingestion.texts_to_chunks(all_texts)
+    return ingestion.ingest(chunks, get_backend(), get_embedding(), checkpoint_path=checkpoint_path)
 
 def delete_document(id):
-    store = get_vector_store()
-    store.delete([id])
+    get_backend().delete([id])
 
 
 # Function to search documents
 def search_documents(query, top_k=5):
     """Searches for documents in AlloyDB based on the query."""
-    vector_store = get_vector_store()
-    results = vector_store.similarity_search(query, k=top_k)
-    return results
\ No newline at end of file
+    return get_backend().search(query, get_embedding().embed_query(query), top_k)
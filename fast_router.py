@@ -0,0 +1,96 @@
+import os
+import re
+import unicodedata
+import logging
+from typing import Literal, NamedTuple, Optional
+from formulas import formula_names, formulas_list
+
+logger = logging.getLogger(__name__)
+
+# Confianza mínima para decidir localmente; por debajo se consulta al LLM
+FAST_ROUTER_THRESHOLD = float(os.environ.get("FAST_ROUTER_THRESHOLD", 0.8))
+
+
+class RouteGuess(NamedTuple):
+    decision: Literal["formula", "chatbot"]
+    confidence: float
+    reason: str
+
+
+def _normalize(text: str) -> str:
+    """Minúsculas, sin tildes y con espacios simples."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w%$]+", " ", text.lower()).split())
+
+
+def _contains(normalized_text: str, phrase: str) -> bool:
+    return re.search(rf"\b{re.escape(phrase)}\b", normalized_text) is not None
+
+
+# Claves de las fórmulas (acrónimos como "CAC") y nombres largos ("burn rate")
+_KEYS = {_normalize(f['key']) for f in formulas_list} | {_normalize(n) for n in formula_names}
+_ACRONYMS = {k.upper() for k in _KEYS if " " not in k and len(k) <= 4}
+# Nombres completos y sus partes ("Gross Merchandise Value - Valor Bruto de Mercancía")
+_NAMES = {_normalize(part) for f in formulas_list for part in [f['name'], *f['name'].split(" - ")]}
+_NAMES |= {k for k in _KEYS if " " in k or len(k) > 4}
+_PARAMS = {_normalize(p) for f in formulas_list for p in f['params'] if len(p) > 6}
+
+_CALC_CUES = ("calcula", "calcular", "calculame", "calculo", "cuanto es", "cuanto seria",
+              "cuanto me da", "saca", "sacar", "computa", "resultado")
+_INFO_CUES = ("que es", "que significa", "explica", "explicame", "definicion", "como se calcula",
+              "como calculo", "formula", "para que sirve", "como mido", "como se mide")
+_QUANT_CUES = ("cuanto", "cual es mi", "cual seria mi")
+# Saludos y cortesías: lo único que se envía al chatbot sin consultar al LLM
+_SMALLTALK_WORDS = {"hola", "buenas", "buenos", "dias", "tardes", "noches", "gracias", "muchas", "mil",
+                    "chao", "adios", "hasta", "luego", "ok", "listo", "perfecto", "niilo", "como", "estas",
+                    "muy", "bien", "y", "tu"}
+_NUMBER = re.compile(r"\d")
+
+
+def classify(question: str) -> RouteGuess:
+    """
+    Clasifica la pregunta con reglas léxicas sobre las fórmulas conocidas.
+
+    Returns:
+        RouteGuess: decisión, confianza en [0, 1] y razón (para logs).
+    """
+    text = _normalize(question)
+    acronym_hit = any(re.search(rf"\b{re.escape(a)}\b", question) for a in _ACRONYMS)
+    name_hit = any(_contains(text, n) for n in _NAMES)
+    key_hit = any(_contains(text, k) for k in _KEYS)
+    param_hit = any(_contains(text, p) for p in _PARAMS)
+    calc_cue = any(_contains(text, c) for c in _CALC_CUES)
+    info_cue = any(_contains(text, c) for c in _INFO_CUES)
+    quant_cue = any(_contains(text, c) for c in _QUANT_CUES)
+    has_number = _NUMBER.search(text) is not None
+
+    if acronym_hit or name_hit:
+        confidence = 0.99 if (calc_cue or info_cue or has_number) else 0.95
+        return RouteGuess("formula", confidence, "fórmula mencionada")
+    if key_hit:
+        # Clave en minúsculas ("roi"): puede ser una palabra común
+        confidence = 0.9 if (calc_cue or info_cue or has_number) else 0.7
+        return RouteGuess("formula", confidence, "clave de fórmula")
+    if param_hit:
+        confidence = 0.85 if (calc_cue or has_number) else 0.6
+        return RouteGuess("formula", confidence, "parámetro de fórmula")
+    if (calc_cue or quant_cue) and has_number:
+        return RouteGuess("formula", 0.6, "intención de cálculo sin fórmula")
+    if calc_cue or info_cue:
+        return RouteGuess("chatbot", 0.6, "intención sin fórmula")
+    if text and not has_number and all(word in _SMALLTALK_WORDS for word in text.split()):
+        return RouteGuess("chatbot", 0.95, "saludo o cortesía")
+    # Sin señales no hay evidencia de que no sea una fórmula con otras palabras
+    # ("ticket promedio ... vendí 100"): decide el LLM
+    return RouteGuess("chatbot", 0.5, "sin señales de fórmula")
+
+
+def fast_route(question: str, threshold: float = FAST_ROUTER_THRESHOLD) -> Optional[str]:
+    """Devuelve la decisión si la confianza supera `threshold`; None para ir al LLM."""
+    guess = classify(question)
+    if guess.confidence >= threshold:
+        logger.info(f"Router local: {guess.decision} ({guess.confidence:.2f}, {guess.reason})")
+        return guess.decision
+    logger.info(f"Router local ambiguo ({guess.confidence:.2f}, {guess.reason}). Se usa el LLM.")
+    return None
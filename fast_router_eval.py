@@ -0,0 +1,81 @@
+import json
+import logging
+import argparse
+from typing import List, Tuple
+
+from fast_router import FAST_ROUTER_THRESHOLD, classify
+
+logger = logging.getLogger(__name__)
+
+
+def accuracy_report(samples: List[Tuple[str, str]], threshold: float = FAST_ROUTER_THRESHOLD) -> dict:
+    """
+    Evalúa el router local contra preguntas etiquetadas.
+
+    Las muestras deben ser consultas reales que no se usaron para ajustar
+    las reglas de `fast_router`; si no, la exactitud no dice nada.
+
+    Returns:
+        dict: cobertura (fracción decidida localmente), exactitud sobre lo
+        decidido y la lista de errores.
+    """
+    decided, correct, errors = 0, 0, []
+    for question, expected in samples:
+        guess = classify(question)
+        if guess.confidence < threshold:
+            continue
+        decided += 1
+        if guess.decision == expected:
+            correct += 1
+        else:
+            errors.append({"question": question, "expected": expected, **guess._asdict()})
+    return {
+        "threshold": threshold,
+        "samples": len(samples),
+        "coverage": decided / len(samples) if samples else 0.0,
+        "accuracy": correct / decided if decided else 0.0,
+        "errors": errors,
+    }
+
+
+def load_samples(path: str) -> List[Tuple[str, str]]:
+    """JSONL con objetos {"question": ..., "decision": "formula" | "chatbot"}."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [(record["question"], record["decision"]) for record in map(json.loads, f) if record]
+
+
+def history_samples(limit: int) -> List[Tuple[str, str]]:
+    """
+    Últimas `limit` preguntas de usuarios en chat_history, etiquetadas con el
+    router LLM (la decisión que el router local reemplaza).
+    """
+    import agent, prompts
+    from chatbot_schemas import RouterOutput
+    from postgres_db import db_connection, get_table_name
+
+    with db_connection() as conn:
+        questions = [row[0] for row in conn.execute(
+            f"""
+            SELECT message -> 'data' ->> 'content' FROM {get_table_name()}
+            WHERE message ->> 'type' = 'human'
+            ORDER BY id DESC LIMIT %s
+            """,
+            (limit,),
+        ).fetchall()]
+    router = prompts.prompt_router | agent.get_llm_structured().with_structured_output(RouterOutput)
+    decisions = router.batch([{"question": question} for question in questions])
+    return [(question, decision.decision) for question, decision in zip(questions, decisions)]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Cobertura y exactitud del router local sobre consultas reales.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--file", help="JSONL etiquetado a mano ({question, decision} por línea)")
+    source.add_argument("--from-history", type=int, metavar="N", help="Últimas N preguntas de chat_history, etiquetadas por el router LLM")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.6, 0.7, 0.8, 0.9])
+    args = parser.parse_args()
+
+    samples = load_samples(args.file) if args.file else history_samples(args.from_history)
+    for threshold in args.thresholds:
+        print(json.dumps(accuracy_report(samples, threshold), ensure_ascii=False, indent=2))
@@ -23,16 +23,16 @@ def time_now():
     return _time_now().isoformat()
 
 
-def get_past_time(interval_str):
+def get_interval(interval_str):
     """
-    Returns the current time in Bogota minus the specified time interval.
+    Parses a time interval string into a timedelta.
 
     Args:
-        interval_str (str): A string specifying the time interval to subtract, 
+        interval_str (str): A string specifying the time interval, 
                            e.g., "24 hour", "5 day", "1 week".
 
     Returns:
-        str: The past time in ISO format.
+        datetime.timedelta: The parsed interval.
     """
     # Parse the interval string
     match = re.match(r'^(\d+)\s+(hour|day|week|minute|second|month|year)s?$', interval_str.lower())
@@ -42,24 +42,17 @@ def get_past_time(interval_str):
     amount = int(match.group(1))
     unit = match.group(2)
     
-    # Get current time in Bogota as a datetime object
-    now = _time_now()
-    
-    # Calculate the past time based on the unit
     if unit == 'minute':
-        past_time = now - datetime.timedelta(minutes=amount)
+        return datetime.timedelta(minutes=amount)
     elif unit == 'hour':
-        past_time = now - datetime.timedelta(hours=amount)
+        return datetime.timedelta(hours=amount)
     elif unit == 'day':
-        past_time = now - datetime.timedelta(days=amount)
+        return datetime.timedelta(days=amount)
     elif unit == 'week':
-        past_time = now - datetime.timedelta(weeks=amount)
+        return datetime.timedelta(weeks=amount)
     elif unit == 'second':
-        past_time = now - datetime.timedelta(seconds=amount)
+        return datetime.timedelta(seconds=amount)
     elif unit == 'month':
-        past_time = now - datetime.timedelta(days=amount*30)  # Approximation
+        return datetime.timedelta(days=amount*30)  # Approximation
     elif unit == 'year':
-        past_time = now - datetime.timedelta(days=amount*365)  # Approximation
-    
-    return past_time
-
+        return datetime.timedelta(days=amount*365)  # Approximation
@@ -0,0 +1,188 @@
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, messages_from_dict
+
+import connection
+from message_store import HISTORY_IS_AUTHORITATIVE
+from postgres_db import PostgresChatHistory, AsyncPostgresChatHistory
+
+logger = logging.getLogger(__name__)
+
+# Turnos (pregunta + respuesta) que se envían completos al LLM
+HISTORY_MAX_TURNS = int(os.environ.get("HISTORY_MAX_TURNS", 6))
+# Presupuesto aproximado de tokens para esos mensajes (0 = sin límite)
+HISTORY_MAX_TOKENS = int(os.environ.get("HISTORY_MAX_TOKENS", 3000))
+# Los mensajes que salen de la ventana se resumen; si es False solo se descartan
+HISTORY_SUMMARY_ENABLED = os.environ.get("HISTORY_SUMMARY_ENABLED", "true").lower() == "true"
+
+SUMMARY_PREFIX = "Resumen de la conversación anterior con el usuario:\n"
+
+# Resúmenes en segundo plano: no agregan latencia al turno
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+_running = set()
+_running_lock = threading.Lock()
+
+
+def estimate_tokens(message: BaseMessage) -> int:
+    """Aproximación barata: ~4 caracteres por token."""
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return len(content) // 4 + 4
+
+
+def window_start(messages: List[BaseMessage], max_turns: int = HISTORY_MAX_TURNS, max_tokens: int = HISTORY_MAX_TOKENS) -> int:
+    """
+    Índice del primer mensaje que se conserva completo.
+
+    Recorre desde el final y se detiene al superar `max_turns` preguntas del
+    usuario o `max_tokens`. La ventana siempre empieza en un mensaje humano
+    para no dejar respuestas sin su pregunta.
+    """
+    turns, tokens, start = 0, 0, len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        tokens += estimate_tokens(messages[i])
+        if max_tokens and tokens > max_tokens:
+            break
+        if isinstance(messages[i], HumanMessage):
+            turns += 1
+            if turns > max_turns:
+                break
+            start = i
+    return start
+
+
+def _load(session_id: str) -> Tuple[str, List[int], List[BaseMessage]]:
+    """Resumen vigente y mensajes posteriores a él (ids de fila y mensajes)."""
+    summary_row = connection.get_chat_summary(session_id)
+    summary = summary_row.summary if summary_row else ""
+    summarized_until = summary_row.summarized_until if summary_row else 0
+    rows = connection.get_chat_history_after(session_id, summarized_until)
+    return summary, [row.id for row in rows], messages_from_dict([row.message for row in rows])
+
+
+def build_window(session_id: str) -> List[BaseMessage]:
+    """
+    Historial que ve el LLM: el resumen (si hay) y los últimos turnos.
+
+    Solo se leen de la base los mensajes posteriores al resumen, así que la
+    lectura no crece con la longitud de la conversación.
+    """
+    summary, _, messages = _load(session_id)
+    window = messages[window_start(messages):]
+    if summary:
+        return [SystemMessage(content=SUMMARY_PREFIX + summary)] + window
+    return window
+
+
+def _format_messages(messages: List[BaseMessage]) -> str:
+    roles = {"human": "Usuario", "ai": "Niilo"}
+    return "\n".join(f"{roles.get(m.type, m.type)}: {m.content}" for m in messages)
+
+
+def update_summary(session_id: str) -> bool:
+    """
+    Incorpora al resumen los mensajes que salieron de la ventana.
+
+    Es incremental: solo se envían al LLM el resumen anterior y los mensajes
+    nuevos que desbordaron. Devuelve True si el resumen cambió.
+    """
+    import agent
+    from prompts import prompt_summary
+
+    summary, ids, messages = _load(session_id)
+    overflow = window_start(messages)
+    if overflow == 0:
+        return False
+    chain = prompt_summary | agent.get_llm_structured()
+    new_summary = chain.invoke({"summary": summary or "(vacío)", "messages": _format_messages(messages[:overflow])})
+    connection.save_chat_summary(session_id, new_summary.content.strip(), ids[overflow - 1])
+    logger.info(f"Resumen de la sesión {session_id} actualizado ({overflow} mensajes incorporados).")
+    return True
+
+
+def _update_summary_safely(session_id: str) -> None:
+    try:
+        update_summary(session_id)
+    except Exception as e:
+        logger.error(f"Error actualizando el resumen de la sesión {session_id}: {e}", exc_info=True)
+    finally:
+        with _running_lock:
+            _running.discard(session_id)
+
+
+def schedule_summary(session_id: str) -> None:
+    """Actualiza el resumen en segundo plano (una sola tarea por sesión a la vez)."""
+    if not HISTORY_SUMMARY_ENABLED:
+        return
+    with _running_lock:
+        if session_id in _running:
+            return
+        _running.add(session_id)
+    _executor.submit(_update_summary_safely, session_id)
+
+
+class WindowedChatHistory(PostgresChatHistory):
+    """
+    Historial para `RunnableWithMessageHistory` con ventana y resumen.
+
+    `messages` devuelve el resumen y los últimos turnos; los mensajes se
+    siguen guardando completos (ver `get_history`).
+    """
+
+    def get_messages(self) -> List[BaseMessage]:
+        return build_window(self.session_id)
+
+    def add_messages(self, messages: List[BaseMessage]) -> None:
+        super().add_messages(messages)
+        schedule_summary(self.session_id)
+
+
+class AsyncWindowedChatHistory(AsyncPostgresChatHistory):
+    """Versión async de `WindowedChatHistory`."""
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        return await asyncio.to_thread(build_window, self.session_id)
+
+    async def aadd_messages(self, messages: List[BaseMessage]) -> None:
+        await super().aadd_messages(messages)
+        schedule_summary(self.session_id)
+
+
+class ReadOnlyWindowedChatHistory(WindowedChatHistory):
+    """
+    Con MESSAGE_STORE=history la cadena solo lee el historial: el nodo
+    chatbot guarda el turno completo (pregunta, fórmulas y respuesta) con
+    `save_turn`.
+    """
+
+    def add_messages(self, messages: List[BaseMessage]) -> None:
+        pass
+
+
+class AsyncReadOnlyWindowedChatHistory(AsyncWindowedChatHistory):
+    async def aadd_messages(self, messages: List[BaseMessage]) -> None:
+        pass
+
+
+def get_windowed_history(session_id: str) -> WindowedChatHistory:
+    if HISTORY_IS_AUTHORITATIVE:
+        return ReadOnlyWindowedChatHistory(session_id)
+    return WindowedChatHistory(session_id)
+
+
+def get_async_windowed_history(session_id: str) -> AsyncWindowedChatHistory:
+    if HISTORY_IS_AUTHORITATIVE:
+        return AsyncReadOnlyWindowedChatHistory(session_id)
+    return AsyncWindowedChatHistory(session_id)
+
+
+def save_turn(session_id: str, messages: List[BaseMessage]) -> None:
+    """Guarda los mensajes del turno en una sola escritura y agenda el resumen."""
+    WindowedChatHistory(session_id).add_messages(messages)
+
+
+async def asave_turn(session_id: str, messages: List[BaseMessage]) -> None:
+    await AsyncWindowedChatHistory(session_id).aadd_messages(messages)
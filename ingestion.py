@@ -0,0 +1,370 @@
+import os
+import json
+import time
+import uuid
+import logging
+import argparse
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+import xxhash
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+logger = logging.getLogger(__name__)
+
+INGEST_CHUNK_SIZE = int(os.environ.get("INGEST_CHUNK_SIZE", 1000))
+INGEST_CHUNK_OVERLAP = int(os.environ.get("INGEST_CHUNK_OVERLAP", 150))
+# Textos por llamada de embeddings (Vertex acepta hasta 250 por solicitud)
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 64))
+# Lotes embebidos/escritos en paralelo
+INGEST_CONCURRENCY = int(os.environ.get("INGEST_CONCURRENCY", 4))
+INGEST_MAX_RETRIES = int(os.environ.get("INGEST_MAX_RETRIES", 5))
+
+# Espacio de nombres para ids deterministas: el mismo fragmento de la misma fuente siempre tiene el mismo id
+CHUNK_NAMESPACE = uuid.UUID("6f1c2a8e-3b7d-4c1e-9a52-0d4e8b7f6a13")
+
+TEXT_EXTENSIONS = (".txt", ".md")
+
+
+class Chunk():
+    """
+    Fragmento con id determinista a partir de su fuente y su texto.
+
+    El mismo texto en dos archivos distintos son dos fragmentos (cada uno con
+    su `source`/`page`); dentro de una misma fuente, el texto repetido se
+    escribe una vez. Los textos sin `source` se deduplican entre sí.
+    """
+
+    def __init__(self, text: str, metadata: dict):
+        self.text = text
+        self.metadata = metadata
+        self.source = str(metadata.get("source", ""))
+        self.hash = xxhash.xxh3_64_hexdigest(text.encode("utf-8"))
+        self.id = str(uuid.uuid5(CHUNK_NAMESPACE, f"{self.source}\n{self.hash}"))
+
+
+def iter_files(paths: Iterable[str]) -> Iterator[str]:
+    """Recorre archivos y directorios (recursivo) en orden estable."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def read_file(path: str) -> Iterator[tuple]:
+    """
+    Lee un archivo como (texto, metadatos) por página o por archivo.
+
+    PDF requiere `pypdf`; `.jsonl` espera objetos con `content` y metadatos.
+    """
+    if path.lower().endswith(".pdf"):
+        from pypdf import PdfReader
+        for page_number, page in enumerate(PdfReader(path).pages, start=1):
+            yield page.extract_text() or "", {"source": path, "page": page_number}
+    elif path.lower().endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if line.strip():
+                    record = json.loads(line)
+                    text = record.pop("content", "")
+                    yield text, {"source": path, "line": line_number, **record}
+    elif path.lower().endswith(TEXT_EXTENSIONS):
+        with open(path, "r", encoding="utf-8") as f:
+            yield f.read(), {"source": path}
+    else:
+        logger.warning(f"Formato no soportado, se omite: {path}")
+
+
+def iter_chunks(
+    paths: Iterable[str],
+    chunk_size: int = INGEST_CHUNK_SIZE,
+    chunk_overlap: int = INGEST_CHUNK_OVERLAP,
+) -> Iterator[Chunk]:
+    """Fragmenta los archivos uno a uno, sin cargar todo el corpus en memoria."""
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    for path in iter_files(paths):
+        for text, metadata in read_file(path):
+            for i, piece in enumerate(splitter.split_text(text)):
+                yield Chunk(piece, {**metadata, "chunk": i})
+
+
+def texts_to_chunks(texts: Iterable[str], metadatas: Optional[Iterable[dict]] = None) -> Iterator[Chunk]:
+    """Fragmentos a partir de textos ya preparados (sin volver a dividirlos)."""
+    metadatas = metadatas if metadatas is not None else itertools.repeat({})
+    for text, metadata in zip(texts, metadatas):
+        yield Chunk(text, {"len": len(text), **metadata})
+
+
+class IngestCheckpoint():
+    """
+    Ids de los fragmentos ya escritos, una línea `<fuente>\t<id>` por fragmento.
+
+    Permite reanudar una ingesta interrumpida, omitir fragmentos sin cambios y
+    saber qué fragmentos de cada fuente hay en el backend para borrar los que
+    ya no están (ver `ingest(prune=True)` y `delete_source`).
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.done: Set[str] = set()
+        self.by_source: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    source, sep, chunk_id = line.rstrip("\n").rpartition("\t")
+                    if sep:
+                        self._record(source, chunk_id)
+
+    def _record(self, source: str, chunk_id: str) -> None:
+        self.done.add(chunk_id)
+        self.by_source.setdefault(source, set()).add(chunk_id)
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self.done
+
+    def add(self, chunks: List[Chunk]) -> None:
+        with self._lock:
+            for chunk in chunks:
+                self._record(chunk.source, chunk.id)
+            if self.path:
+                with open(self.path, "a") as f:
+                    f.write("".join(f"{chunk.source}\t{chunk.id}\n" for chunk in chunks))
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def forget(self, source: str, chunk_ids: Iterable[str]) -> None:
+        """Quita fragmentos borrados del backend y reescribe el archivo."""
+        with self._lock:
+            chunk_ids = set(chunk_ids)
+            self.done -= chunk_ids
+            remaining = self.by_source.get(source, set()) - chunk_ids
+            if remaining:
+                self.by_source[source] = remaining
+            else:
+                self.by_source.pop(source, None)
+            if self.path:
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w") as f:
+                    for name, ids in self.by_source.items():
+                        f.write("".join(f"{name}\t{chunk_id}\n" for chunk_id in sorted(ids)))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+
+
+def with_retry(fn: Callable, *args, attempts: int = INGEST_MAX_RETRIES, base_delay: float = 1.0):
+    """Llama `fn` con reintentos y espera exponencial (1s, 2s, 4s, ...)."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn(*args)
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            delay = base_delay * 2 ** (attempt - 1)
+            logger.warning(f"Intento {attempt}/{attempts} fallido ({e}); reintentando en {delay:.0f}s")
+            time.sleep(delay)
+
+
+class IngestStats():
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.seen = 0
+        self.skipped = 0
+        self.written = 0
+        self.deleted = 0
+        self.batches = 0
+        self._lock = threading.Lock()
+
+    def add_batch(self, written: int) -> int:
+        with self._lock:
+            self.written += written
+            self.batches += 1
+            return self.batches
+
+    def report(self) -> dict:
+        elapsed = time.perf_counter() - self.started_at
+        return {
+            "chunks_seen": self.seen,
+            "chunks_skipped": self.skipped,
+            "chunks_written": self.written,
+            "chunks_deleted": self.deleted,
+            "batches": self.batches,
+            "seconds": round(elapsed, 2),
+            "chunks_per_second": round(self.written / elapsed, 2) if elapsed else 0.0,
+        }
+
+
+def _batches(
+    chunks: Iterable[Chunk],
+    checkpoint: IngestCheckpoint,
+    stats: IngestStats,
+    batch_size: int,
+    current: Dict[str, Set[str]],
+) -> Iterator[List[Chunk]]:
+    """
+    Agrupa en lotes omitiendo fragmentos ya ingeridos o repetidos en esta corrida.
+
+    Registra en `current` los ids de cada fuente vistos en esta corrida.
+    """
+    batch = []
+    for chunk in chunks:
+        stats.seen += 1
+        seen = current.setdefault(chunk.source, set())
+        if chunk.id in checkpoint or chunk.id in seen:
+            seen.add(chunk.id)
+            stats.skipped += 1
+            continue
+        seen.add(chunk.id)
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest(
+    chunks: Iterable[Chunk],
+    backend,
+    embeddings,
+    checkpoint_path: Optional[str] = None,
+    batch_size: int = INGEST_BATCH_SIZE,
+    concurrency: int = INGEST_CONCURRENCY,
+    prune: bool = False,
+) -> dict:
+    """
+    Embebe y escribe los fragmentos por lotes, con concurrencia acotada.
+
+    Cada lote se embebe con `embeddings.embed_documents` y se escribe en
+    `backend` (un `vector_backends.VectorBackend`, con reintentos); al terminar se registra en el checkpoint. A lo
+    sumo `2 * concurrency` lotes están en memoria a la vez.
+
+    Con `prune`, al terminar sin errores se borran del backend los fragmentos
+    que el checkpoint tiene para las fuentes leídas en esta corrida pero que
+    ya no aparecen en ellas (p. ej. texto editado en un manual). Las fuentes
+    que ya no existen se borran con `delete_source`.
+
+    Returns:
+        dict: Fragmentos vistos, omitidos, escritos y borrados, y fragmentos por segundo.
+    """
+    checkpoint = IngestCheckpoint(checkpoint_path)
+    stats = IngestStats()
+    current: Dict[str, Set[str]] = {}
+    in_flight = threading.BoundedSemaphore(2 * concurrency)
+
+    def process(batch: List[Chunk]) -> None:
+        try:
+            vectors = with_retry(embeddings.embed_documents, [chunk.text for chunk in batch])
+            written = with_retry(
+                backend.add,
+                [chunk.id for chunk in batch], [chunk.text for chunk in batch], vectors, [chunk.metadata for chunk in batch],
+            )
+            checkpoint.add(batch)
+            if stats.add_batch(written) % 10 == 0:
+                logger.info(f"Ingesta: {stats.report()}")
+        finally:
+            in_flight.release()
+
+    futures = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for batch in _batches(chunks, checkpoint, stats, batch_size, current):
+            in_flight.acquire()
+            futures.append(executor.submit(process, batch))
+            # Propaga pronto el primer error en lugar de seguir encolando
+            for future in [f for f in futures if f.done()]:
+                future.result()
+                futures.remove(future)
+        for future in futures:
+            future.result()
+
+    if prune:
+        for source, seen in current.items():
+            stats.deleted += _delete_ids(source, checkpoint.by_source.get(source, set()) - seen, backend, checkpoint)
+
+    report = stats.report()
+    logger.info(f"Ingesta terminada: {report}")
+    return report
+
+
+def _delete_ids(source: str, chunk_ids: Set[str], backend, checkpoint: IngestCheckpoint) -> int:
+    if not chunk_ids:
+        return 0
+    chunk_ids = sorted(chunk_ids)
+    with_retry(backend.delete, chunk_ids)
+    checkpoint.forget(source, chunk_ids)
+    logger.info(f"Borrados {len(chunk_ids)} fragmentos obsoletos de {source or '(sin fuente)'}")
+    return len(chunk_ids)
+
+
+def delete_source(source: str, backend, checkpoint_path: str) -> int:
+    """
+    Borra del backend todos los fragmentos de `source` registrados en el checkpoint.
+
+    Returns:
+        int: Cantidad de fragmentos borrados.
+    """
+    checkpoint = IngestCheckpoint(checkpoint_path)
+    return _delete_ids(source, set(checkpoint.by_source.get(source, set())), backend, checkpoint)
+
+
+def main(argv: Optional[List[str]] = None) -> dict:
+    parser = argparse.ArgumentParser(description="Ingesta de documentos en la colección RAG.")
+    parser.add_argument("paths", nargs="*", help="Archivos o directorios (.txt, .md, .jsonl, .pdf)")
+    parser.add_argument("--target", choices=["weaviate", "alloydb"], default="weaviate")
+    parser.add_argument("--checkpoint", default=".ingest_checkpoint", help="Archivo para reanudar la ingesta")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=INGEST_CONCURRENCY)
+    parser.add_argument("--prune", action="store_true", help="Borra los fragmentos que ya no están en los archivos leídos")
+    parser.add_argument("--delete-source", nargs="+", default=[], metavar="SOURCE", help="Borra todos los fragmentos de estas fuentes (archivos eliminados)")
+    args = parser.parse_args(argv)
+    if not args.paths and not args.delete_source:
+        parser.error("indica archivos a ingerir o --delete-source")
+
+    import agent, vector_backends
+    # La réplica local se sincroniza desde Weaviate: no es un destino de ingesta
+    backend = vector_backends.get_backend(args.target)
+    try:
+        report = {}
+        if args.paths:
+            report = ingest(
+                iter_chunks(args.paths), backend, agent.get_embeddings(),
+                checkpoint_path=args.checkpoint, batch_size=args.batch_size, concurrency=args.concurrency,
+                prune=args.prune,
+            )
+        if args.delete_source:
+            report["sources_deleted"] = {source: delete_source(source, backend, args.checkpoint) for source in args.delete_source}
+        return report
+    finally:
+        vector_backends.close_backends()
+        if args.target == "weaviate":
+            import weaviate_db
+            weaviate_db.close_db()
+
+def publish_invalidation(report: dict) -> None:
+    """
+    Invalida los caches del RAG de todos los workers del servicio si la
+    ingesta cambió la colección (ver `cache_sync`).
+    """
+    changed = report.get("chunks_written") or report.get("chunks_deleted") or any(report.get("sources_deleted", {}).values())
+    if not changed:
+        return
+    try:
+        import cache_sync
+        version = cache_sync.watcher.publish()
+        logger.info(f"Caches del RAG invalidados en el servicio (versión {version})")
+    except Exception as e:
+        # El servicio sigue usando documentos cacheados hasta invalidarlos
+        logger.warning(f"No se pudo invalidar los caches del RAG ({e}); llama DELETE /cache/answers en el servicio.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    report = main()
+    print(json.dumps(report, indent=2))
+    publish_invalidation(report)
@@ -0,0 +1,474 @@
+import os
+import re
+import json
+import math
+import time
+import hashlib
+import logging
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+import numpy as np
+from langchain_core.documents import Document
+
+from retrieval_cache import bump_collection_version
+from vector_backends import VectorBackend
+
+logger = logging.getLogger(__name__)
+
+# Directorio de la réplica local de la colección "Rag"
+LOCAL_INDEX_DIR = os.environ.get("LOCAL_INDEX_DIR", ".rag_index")
+# Cada cuánto (s) se sincroniza la réplica con Weaviate
+LOCAL_INDEX_REFRESH_SECONDS = int(os.environ.get("LOCAL_INDEX_REFRESH_SECONDS", 600))
+# Snapshots que se conservan en disco además del vigente
+LOCAL_INDEX_KEEP_SNAPSHOTS = int(os.environ.get("LOCAL_INDEX_KEEP_SNAPSHOTS", 1))
+
+# Parámetros BM25 (los mismos valores por defecto que Weaviate)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def content_hash(content: str, metadata: dict) -> str:
+    digest = hashlib.sha1(content.encode())
+    digest.update(json.dumps(metadata, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def _matches(value, allowed: list) -> bool:
+    if isinstance(value, list):
+        return any(v in allowed for v in value)
+    return value in allowed
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+def _min_max(scores: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Normaliza a [0, 1] los puntajes de los candidatos (fusión relativa de Weaviate)."""
+    out = np.zeros_like(scores)
+    if not mask.any():
+        return out
+    low, high = scores[mask].min(), scores[mask].max()
+    out[mask] = 1.0 if high == low else (scores[mask] - low) / (high - low)
+    return out
+
+
+class LocalVectorIndex():
+    """
+    Réplica en memoria de una colección: matriz float32 normalizada + documentos.
+
+    La matriz se abre con `np.load(mmap_mode="r")`, así que varios workers
+    comparten las páginas del archivo. La búsqueda es exacta (producto punto y
+    `argpartition`), suficiente para decenas de miles de fragmentos. También
+    mantiene un índice invertido para BM25 y la búsqueda híbrida.
+    """
+
+    def __init__(self, vectors: np.ndarray, documents: List[dict], created_at: float, version: str):
+        self.vectors = vectors
+        self.documents = documents
+        self.created_at = created_at
+        self.version = version
+        self._build_bm25()
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def _build_bm25(self) -> None:
+        self._postings: Dict[str, List[tuple]] = defaultdict(list)
+        lengths = []
+        for i, doc in enumerate(self.documents):
+            tokens = tokenize(doc["content"])
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                self._postings[term].append((i, tf))
+        self._lengths = np.asarray(lengths, dtype=np.float32)
+        self._avg_length = float(self._lengths.mean()) if lengths else 0.0
+
+    def _filter_mask(self, filters: Optional[Dict[str, Any]]) -> np.ndarray:
+        """Mismas reglas que `weaviate_db.build_filters`: igualdad, o cualquiera de una lista."""
+        mask = np.ones(len(self.documents), dtype=bool)
+        for name, value in (filters or {}).items():
+            allowed = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            mask &= np.fromiter(
+                (_matches(doc["metadata"].get(name), allowed) for doc in self.documents),
+                dtype=bool, count=len(self.documents),
+            )
+        return mask
+
+    def vector_scores(self, vector: List[float]) -> np.ndarray:
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        return self.vectors @ (query / norm if norm else query)
+
+    def bm25_scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        n = len(self.documents)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            idx = np.fromiter((i for i, _ in postings), dtype=np.int64, count=len(postings))
+            tf = np.fromiter((tf for _, tf in postings), dtype=np.float32, count=len(postings))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[idx] / (self._avg_length or 1.0))
+            scores[idx] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def search(
+        self,
+        query: str,
+        vector: Optional[List[float]],
+        k: int,
+        search_type: str = "vector",
+        alpha: float = 0.5,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> List[Document]:
+        if not self.documents:
+            return []
+        mask = self._filter_mask(filters)
+        if search_type == "vector":
+            scores = self.vector_scores(vector)
+        elif search_type == "bm25":
+            scores = self.bm25_scores(query)
+            mask &= scores > 0
+        else:
+            dense = self.vector_scores(vector)
+            sparse = self.bm25_scores(query)
+            scores = alpha * _min_max(dense, mask) + (1 - alpha) * _min_max(sparse, mask & (sparse > 0))
+        candidates = np.flatnonzero(mask)
+        if candidates.size == 0:
+            return []
+        top = candidates[np.argpartition(-scores[candidates], min(k, candidates.size) - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [
+            Document(
+                page_content=self.documents[i]["content"],
+                metadata={**self.documents[i]["metadata"], "uuid": self.documents[i]["uuid"],
+                          "score": float(scores[i]), "search_type": search_type},
+            )
+            for i in top
+        ]
+
+    # --- Persistencia ---
+
+    def save(self, directory: str) -> None:
+        """Escribe el snapshot y publica el manifiesto de forma atómica."""
+        os.makedirs(directory, exist_ok=True)
+        vectors_file = f"vectors-{self.version}.npy"
+        documents_file = f"documents-{self.version}.json"
+        np.save(os.path.join(directory, vectors_file), np.ascontiguousarray(self.vectors, dtype=np.float32))
+        with open(os.path.join(directory, documents_file), "w") as f:
+            json.dump(self.documents, f, default=str)
+        manifest = {
+            "version": self.version,
+            "created_at": self.created_at,
+            "count": len(self.documents),
+            "dim": int(self.vectors.shape[1]) if self.vectors.ndim == 2 else 0,
+            "vectors": vectors_file,
+            "documents": documents_file,
+        }
+        manifest_path = os.path.join(directory, "manifest.json")
+        previous = _read_manifest(manifest_path)
+        tmp = os.path.join(directory, f"manifest.json.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, manifest_path)
+        keep = {vectors_file, documents_file}
+        if previous is not None:
+            keep |= {previous["manifest"]["vectors"], previous["manifest"]["documents"]}
+        _remove_old_snapshots(directory, keep, before=previous["published_at"] if previous else None)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["LocalVectorIndex"]:
+        """Carga el snapshot vigente (None si no hay)."""
+        manifest_path = os.path.join(directory, "manifest.json")
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        vectors = np.load(os.path.join(directory, manifest["vectors"]), mmap_mode="r")
+        with open(os.path.join(directory, manifest["documents"]), "r") as f:
+            documents = json.load(f)
+        return cls(vectors, documents, manifest["created_at"], manifest["version"])
+
+
+def _read_manifest(path: str) -> Optional[dict]:
+    """Manifiesto vigente y cuándo se publicó (None si no hay)."""
+    try:
+        published_at = os.path.getmtime(path)
+        with open(path, "r") as f:
+            return {"manifest": json.load(f), "published_at": published_at}
+    except (OSError, ValueError):
+        return None
+
+
+def _remove_old_snapshots(directory: str, keep: set, before: Optional[float]) -> None:
+    """
+    Borra snapshots viejos sin romper a otros workers que comparten el directorio.
+
+    Nunca borra los de `keep` (el nuevo y el del manifiesto anterior, que otro
+    worker puede estar abriendo) ni los escritos después de que se publicó el
+    manifiesto anterior (`before`), que pueden ser de otro worker que aún no
+    publica el suyo. Sin manifiesto anterior no borra nada.
+    """
+    if before is None:
+        return
+    snapshots = sorted(
+        (name for name in os.listdir(directory) if name.startswith(("vectors-", "documents-")) and name not in keep),
+        key=lambda name: os.path.getmtime(os.path.join(directory, name)),
+        reverse=True,
+    )
+    # Conserva los `LOCAL_INDEX_KEEP_SNAPSHOTS` anteriores (pares vectores/documentos)
+    for name in snapshots[2 * LOCAL_INDEX_KEEP_SNAPSHOTS:]:
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < before:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _object_vector(obj) -> List[float]:
+    vector = obj.vector
+    if isinstance(vector, dict):
+        vector = vector.get("default") or next(iter(vector.values()), None)
+    return vector
+
+
+def sync_from_weaviate(
+    client,
+    previous: Optional[LocalVectorIndex] = None,
+    collection_name: str = "Rag",
+    text_key: str = "content",
+) -> Optional[LocalVectorIndex]:
+    """
+    Sincroniza la réplica con la colección de Weaviate.
+
+    Recorre la colección sin vectores y solo descarga el vector de los objetos
+    nuevos o modificados (por hash de contenido y metadatos); los borrados se
+    descartan. Devuelve None si no hubo cambios.
+    """
+    from weaviate.classes.query import Filter
+
+    collection = client.collections.get(collection_name)
+    known = {doc["uuid"]: i for i, doc in enumerate(previous.documents)} if previous else {}
+    documents, changed = [], set()
+    for obj in collection.iterator():
+        properties = dict(obj.properties)
+        content = properties.pop(text_key, "") or ""
+        doc = {"uuid": str(obj.uuid), "content": content, "metadata": properties,
+               "hash": content_hash(content, properties)}
+        i = known.get(doc["uuid"])
+        if i is None or previous.documents[i]["hash"] != doc["hash"]:
+            changed.add(doc["uuid"])
+        documents.append(doc)
+
+    if previous is not None and not changed and len(documents) == len(previous.documents):
+        return None
+
+    vectors_by_uuid = {}
+    pending = list(changed)
+    for start in range(0, len(pending), 100):
+        batch = pending[start:start + 100]
+        result = collection.query.fetch_objects(
+            filters=Filter.by_id().contains_any(batch), include_vector=True, limit=len(batch),
+        )
+        for obj in result.objects:
+            vectors_by_uuid[str(obj.uuid)] = _object_vector(obj)
+
+    rows, kept = [], []
+    for doc in documents:
+        if vectors_by_uuid.get(doc["uuid"]) is not None:
+            rows.append(np.asarray(vectors_by_uuid[doc["uuid"]], dtype=np.float32))
+        elif doc["uuid"] not in changed:
+            rows.append(np.asarray(previous.vectors[known[doc["uuid"]]], dtype=np.float32))
+        else:
+            # Borrado durante la sincronización o sin vector: se omite
+            continue
+        kept.append(doc)
+    vectors = _normalize_rows(np.vstack(rows)) if rows else np.zeros((0, 0), dtype=np.float32)
+    logger.info(f"Réplica local: {len(kept)} documentos, {len(changed)} nuevos o modificados.")
+    return LocalVectorIndex(vectors, kept, time.time(), str(int(time.time() * 1000)))
+
+
+class LocalIndexManager():
+    """
+    Mantiene la réplica local: la carga de disco al arrancar y la sincroniza
+    con Weaviate en un hilo en segundo plano.
+
+    Si Weaviate falla o está lento, se sigue sirviendo el último snapshot.
+    """
+
+    def __init__(self, directory: str = LOCAL_INDEX_DIR, refresh_seconds: int = LOCAL_INDEX_REFRESH_SECONDS):
+        self.directory = directory
+        self.refresh_seconds = refresh_seconds
+        self.index: Optional[LocalVectorIndex] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_sync: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def load(self) -> Optional[LocalVectorIndex]:
+        try:
+            index = LocalVectorIndex.load(self.directory)
+        except Exception as e:
+            self.last_error = repr(e)
+            logger.error(f"No se pudo cargar la réplica local de {self.directory}: {e}")
+            return None
+        if index is not None:
+            self.index = index
+            logger.info(f"Réplica local cargada: {len(index)} documentos (versión {index.version}).")
+        return index
+
+    def refresh(self) -> bool:
+        """Sincroniza con Weaviate. Devuelve True si la réplica cambió."""
+        import weaviate_db
+
+        # Conecta (con renovación del token) solo cuando hace falta sincronizar
+        weaviate_db.connect_to_db()
+        with self._lock:
+            index = sync_from_weaviate(weaviate_db.get_client(), self.index)
+            self.last_sync = time.time()
+            self.last_error = None
+            if index is None:
+                return False
+            index.save(self.directory)
+            self.index = index
+        # Los documentos cacheados pueden haber cambiado
+        bump_collection_version()
+        return True
+
+    def _run(self) -> None:
+        wait = 0 if self.index is None else self.refresh_seconds
+        while not self._stop.wait(wait):
+            try:
+                self.refresh()
+            except Exception as e:
+                self.last_error = repr(e)
+                logger.error(f"Error sincronizando la réplica local: {e}")
+            wait = self.refresh_seconds
+
+    def start(self) -> None:
+        """Carga el snapshot de disco y arranca la sincronización periódica (idempotente)."""
+        if self.index is None:
+            self.load()
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="local-index-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self) -> dict:
+        index = self.index
+        return {
+            "documents": len(index) if index else 0,
+            "version": index.version if index else None,
+            "snapshot_age": time.time() - index.created_at if index else None,
+            "last_sync": self.last_sync,
+            "last_error": self.last_error,
+        }
+
+
+index_manager = LocalIndexManager()
+
+
+class LocalBackend(VectorBackend):
+    """
+    Backend sobre la réplica local, con los mismos modos y opciones que
+    `WeaviateBackend`. Mientras no haya réplica cargada delega en `fallback`.
+
+    `add` y `delete` modifican solo la réplica en memoria (la próxima
+    sincronización con Weaviate la reemplaza); sirven para el benchmark.
+    """
+
+    name = "local"
+    search_types = ("vector", "bm25", "hybrid")
+
+    def __init__(self, manager: Optional[LocalIndexManager] = None, directory: Optional[str] = None, fallback: Optional[str] = "weaviate"):
+        self.manager = manager or (LocalIndexManager(directory) if directory else index_manager)
+        self.fallback = fallback
+
+    def open(self) -> None:
+        self.manager.start()
+
+    def search(self, query, vector, k, search_type="vector", alpha=0.5, filters=None) -> List[Document]:
+        self.check_search_type(search_type)
+        index = self.manager.index
+        if index is None or len(index) == 0:
+            if self.fallback is None:
+                raise RuntimeError("La réplica local aún no está cargada.")
+            from vector_backends import get_backend
+            return get_backend(self.fallback).search(query, vector, k, search_type, alpha, filters)
+        return index.search(query, vector, k, search_type, alpha, filters)
+
+    def add(self, ids, texts, vectors, metadatas) -> int:
+        documents = [
+            {"uuid": id_, "content": text, "metadata": metadata, "hash": content_hash(text, metadata)}
+            for id_, text, metadata in zip(ids, texts, metadatas)
+        ]
+        with self.manager._lock:
+            current = self.manager.index
+            if current is not None and len(current):
+                documents = current.documents + documents
+                matrix = np.vstack([np.asarray(current.vectors), _normalize_rows(np.asarray(vectors, dtype=np.float32))])
+            else:
+                matrix = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+            self.manager.index = LocalVectorIndex(matrix, documents, time.time(), str(int(time.time() * 1000)))
+        return len(ids)
+
+    def delete(self, ids) -> None:
+        removed = set(ids)
+        with self.manager._lock:
+            current = self.manager.index
+            if current is None:
+                return
+            keep = [i for i, doc in enumerate(current.documents) if doc["uuid"] not in removed]
+            self.manager.index = LocalVectorIndex(
+                np.asarray(current.vectors)[keep], [current.documents[i] for i in keep], time.time(), current.version
+            )
+
+    def close(self) -> None:
+        self.manager.stop()
+
+    def stats(self) -> dict:
+        return {"backend": self.name, **self.manager.stats()}
+
+
+def benchmark(queries: int = 1000, k: int = 3) -> dict:
+    """Latencia de búsqueda (ms) sobre el snapshot en disco con vectores aleatorios."""
+    index = LocalVectorIndex.load(LOCAL_INDEX_DIR)
+    if index is None or len(index) == 0:
+        raise RuntimeError(f"No hay réplica en {LOCAL_INDEX_DIR}.")
+    rng = np.random.default_rng(0)
+    words = [doc["content"].split()[:5] for doc in index.documents[:50]]
+    results = {}
+    for search_type in ("vector", "bm25", "hybrid"):
+        timings = []
+        for i in range(queries):
+            vector = rng.standard_normal(index.vectors.shape[1]).tolist()
+            query = " ".join(words[i % len(words)])
+            start = time.perf_counter()
+            index.search(query, vector, k, search_type)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results[search_type] = {"p50_ms": timings[len(timings) // 2], "p99_ms": timings[int(len(timings) * 0.99)]}
+    return {"documents": len(index), **results}
+
+
+if __name__ == "__main__":
+    print(json.dumps(benchmark(), indent=2))
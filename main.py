@@ -1,14 +1,28 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from uuid import uuid4
+import cache_sync
 import chatbot
+import configs
 import schema
+import quota
+import startup
 import traceback
+import json
+from typing import List, Optional
 from contextlib import asynccontextmanager
-from weaviate_db import connect_to_db, close_db
+from weaviate_db import close_db, client_manager as weaviate_manager
+import vector_backends
+import write_behind
+from checkpoint_store import compactor as checkpoint_compactor
+from message_store import HISTORY_IS_AUTHORITATIVE
+from retrieval_cache import get_cache_stats
+from postgres_db import open_async_pool, close_async_pool, close_db_pool, dispose_db_engine, get_pool_stats
 import logging
 import os
+import asyncio
 
 # --- (El resto de la configuración inicial se mantiene igual) ---
 logger = logging.getLogger(__name__)
@@ -30,18 +44,44 @@ tags_metadata = [
 
 env_name = os.environ.get("ENV", "local")
 version = f"2.2.9-{env_name}"
+# Modo async: el grafo corre con astream/ainvoke sin bloquear el event loop
+async_graph = os.environ.get("ASYNC_GRAPH", "true").lower() == "true"
+
+async def _open_async_pool_timed():
+    async with startup.atimed("async_db_pool"):
+        await open_async_pool()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     try:
-        connect_to_db()
-        logger.info("Cliente de Weaviate conectado exitosamente.")
+        # Los clientes se crean aquí (no al importar), los independientes en paralelo
+        tasks = [run_in_threadpool(startup.init_dependencies)]
+        if async_graph:
+            tasks.append(_open_async_pool_timed())
+        await asyncio.gather(*tasks)
+        logger.info(f"Dependencias inicializadas: {startup.startup_timings}")
+        # Relee los secretos en segundo plano; las rotaciones reconstruyen los clientes
+        configs.secret_store.start()
+        write_behind.queue.start()
+        cache_sync.watcher.start()
+        if not HISTORY_IS_AUTHORITATIVE:
+            checkpoint_compactor.start()
         yield
     except Exception as e:
-        logger.error(f"Error crítico al conectar con Weaviate: {e}")
+        logger.error(f"Error crítico al inicializar dependencias: {e}")
     finally:
+        # Antes de cerrar el engine: escribe lo que quedó en la cola
+        await run_in_threadpool(write_behind.queue.stop)
+        configs.secret_store.stop()
+        cache_sync.watcher.stop()
+        checkpoint_compactor.stop()
+        vector_backends.close_backends()
         close_db()
         logger.info("Cliente de Weaviate desconectado.")
+        if async_graph:
+            await close_async_pool()
+        close_db_pool()
+        dispose_db_engine()
 
 app = FastAPI(
     title="Niilo Chat API",
@@ -62,27 +102,33 @@ app.add_middleware(
 # --- Endpoints de la API con Documentación Detallada ---
 
 @app.get("/api/conversations/{user_id}", tags=["Conversations"], response_model=schema.SessionList)
-async def get_conversations(user_id: str):
+async def get_conversations(user_id: str, limit: Optional[int] = Query(None, ge=1, le=100), cursor: Optional[str] = None):
     """
     Recupera la lista de todas las conversaciones iniciadas por un usuario.
 
     Este endpoint consulta la base de datos y devuelve un resumen de cada
-    chat asociado al `user_id` proporcionado.
+    chat asociado al `user_id` proporcionado, ordenado por última
+    actualización. Si se envía `limit`, la respuesta se pagina por cursor.
 
     Args:
         user_id (str): El identificador único del usuario.
+        limit (int, opcional): Número máximo de conversaciones por página.
+        cursor (str, opcional): `next_cursor` de la página anterior.
 
     Returns:
         schema.SessionList: Un objeto que contiene una lista de `chats`,
         donde cada chat incluye su `session_id`, `user_id`, fechas y
-        el primer mensaje de la conversación.
+        el primer mensaje de la conversación, y `next_cursor` para pedir
+        la siguiente página (None si no hay más).
 
     Raises:
+        HTTPException 400: Si el cursor no es válido.
         HTTPException 500: Si ocurre un error inesperado al consultar la base de datos.
     """
     try:
-        sessions = chatbot.get_session_ids(user_id)
-        return {"chats": sessions}
+        return await run_in_threadpool(chatbot.get_sessions_page, user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -101,7 +147,7 @@ async def new_conversation(user_id: str):
         schema.NewSession: Un objeto JSON con el `session_id` y el `user_id` de la nueva conversación.
     """
     session_id = str(uuid4())
-    user_session = chatbot.get_new_session_id(session_id=session_id, user_id=user_id)
+    user_session = await run_in_threadpool(chatbot.get_new_session_id, session_id=session_id, user_id=user_id)
     return JSONResponse({"session_id": str(user_session.session_id), "user_id": user_session.user_id})
 
 @app.delete("/api/conversations/{session_id}", tags=["Conversations"], status_code=200)
@@ -118,7 +164,7 @@ async def delete_conversation(session_id: str):
     Returns:
         str: Un mensaje de confirmación indicando que la conversación ha sido eliminada.
     """
-    conversation = chatbot.delete_conversation(session_id)
+    conversation = await run_in_threadpool(chatbot.delete_conversation, session_id)
     return f"La conversación {conversation.session_id} ha sido eliminada"
 
 @app.post("/api/messages/chat/", tags=["Messages"], response_model=schema.ChatResponse)
@@ -134,6 +180,9 @@ async def chat(request: schema.ChatRequest):
         request (schema.ChatRequest): Un cuerpo de solicitud JSON con:
             - `session_id` (str): El ID de la conversación actual.
             - `user_input` (str): El mensaje escrito por el usuario.
+            - `retrieval` (opcional): Opciones de búsqueda del RAG para este
+              turno: `k`, `search_type` (`vector`, `bm25` o `hybrid`),
+              `alpha`, `filters` ({propiedad: valor}) y `score_threshold`.
 
     Returns:
         schema.ChatResponse: Un objeto JSON con la respuesta del asistente,
@@ -141,14 +190,28 @@ async def chat(request: schema.ChatRequest):
         que el agente tomó para generar la respuesta (útil para depuración).
 
     Raises:
+        HTTPException 429: Si el usuario superó su cuota de mensajes.
         HTTPException 500: Si el agente no logra generar una respuesta o si
         ocurre un error interno.
     """
     try:
-        final_response = chatbot.get_response(request.user_input, request.session_id)
+        # Reserva el turno antes del grafo; se devuelve si el turno falla
+        reservation = await run_in_threadpool(quota.reserve_turn, request.session_id)
+    except quota.QuotaExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    try:
+        if async_graph:
+            final_response = await chatbot.aget_response(request.user_input, request.session_id, request.retrieval_options())
+        else:
+            final_response = await run_in_threadpool(chatbot.get_response, request.user_input, request.session_id, request.retrieval_options())
         if not final_response:
             raise HTTPException(status_code=500, detail="No se recibió respuesta del asistente.")
-        chatbot.update_timestamp(request.session_id)
+    except Exception as e:
+        print(traceback.format_exc())
+        await run_in_threadpool(quota.refund_turn, reservation)
+        raise HTTPException(status_code=500, detail=str(e))
+    try:
+        await run_in_threadpool(chatbot.update_timestamp, request.session_id)
         info = dict(**final_response[-1])
         info['nodes'] = final_response
         return info
@@ -157,6 +220,71 @@ async def chat(request: schema.ChatRequest):
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/messages/chat/stream/", tags=["Messages"])
+async def chat_stream(request: schema.ChatRequest):
+    """
+    Envía un mensaje y recibe la respuesta del agente como server-sent events.
+
+    Variante en streaming de `/api/messages/chat/`: entrega la decisión del
+    router, los mensajes de los nodos de fórmulas y los tokens de Niilo a
+    medida que se generan, en lugar de esperar a que termine el turno. El
+    mensaje final se persiste igual que en el endpoint no streaming.
+
+    Args:
+        request (schema.ChatRequest): Un cuerpo de solicitud JSON con:
+            - `session_id` (str): El ID de la conversación actual.
+            - `user_input` (str): El mensaje escrito por el usuario.
+            - `retrieval` (opcional): Opciones de búsqueda del RAG (ver `/api/messages/chat/`).
+
+    Returns:
+        StreamingResponse: Flujo `text/event-stream` con eventos `token`,
+        `node`, `done` o `error`; cada `data` es un objeto JSON.
+
+    Raises:
+        HTTPException 429: Si el usuario superó su cuota de mensajes.
+    """
+    try:
+        reservation = await run_in_threadpool(quota.reserve_turn, request.session_id)
+    except quota.QuotaExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    def event_stream():
+        done = False
+        try:
+            for event, data in chatbot.stream_graph_events(request.user_input, request.session_id, request.retrieval_options()):
+                if event == "done":
+                    done = True
+                    try:
+                        chatbot.update_timestamp(request.session_id)
+                    except Exception:
+                        print(traceback.format_exc())
+                yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        finally:
+            # Error o cliente desconectado antes de terminar: el turno no cuenta
+            if not done:
+                quota.refund_turn(reservation)
+
+    async def aevent_stream():
+        done = False
+        try:
+            async for event, data in chatbot.astream_graph_events(request.user_input, request.session_id, request.retrieval_options()):
+                if event == "done":
+                    done = True
+                    try:
+                        await run_in_threadpool(chatbot.update_timestamp, request.session_id)
+                    except Exception:
+                        print(traceback.format_exc())
+                yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+        finally:
+            if not done:
+                quota.refund_turn(reservation)
+
+    return StreamingResponse(
+        aevent_stream() if async_graph else event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/api/messages/chat/{session_id}", tags=["Messages"], response_model=list[schema.ConversationHistory])
 async def get_chat_history(session_id: str):
     """
@@ -177,11 +305,50 @@ async def get_chat_history(session_id: str):
         HTTPException 500: Si ocurre un error al recuperar el historial.
     """
     try:
-        history = chatbot.get_history(session_id)
+        history = await run_in_threadpool(chatbot.get_history, session_id)
         return history
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+@app.get("/api/messages/chat/{session_id}/page", tags=["Messages"], response_model=schema.HistoryPage)
+async def get_chat_history_page(
+    session_id: str,
+    limit: int = Query(20, ge=1, le=100),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+):
+    """
+    Obtiene una página del historial de una conversación.
+
+    Variante paginada de `/api/messages/chat/{session_id}`: sin cursores
+    devuelve los últimos `limit` mensajes, para mostrarlos de inmediato, y
+    con `before` se cargan los anteriores bajo demanda. Cada página es una
+    sola consulta y solo sus mensajes se cruzan con las revisiones.
+
+    Args:
+        session_id (str): El identificador único de la sesión.
+        limit (int): Número máximo de mensajes por página (por defecto 20).
+        before (str, opcional): `before_cursor` de una página; devuelve los
+            mensajes anteriores.
+        after (str, opcional): `after_cursor` de una página; devuelve los
+            mensajes posteriores.
+
+    Returns:
+        schema.HistoryPage: `messages` en orden cronológico, los cursores
+        `before_cursor` y `after_cursor`, y `has_more` (si quedan mensajes
+        en la dirección pedida).
+
+    Raises:
+        HTTPException 400: Si el cursor no es válido o se envían ambos.
+        HTTPException 500: Si ocurre un error al recuperar el historial.
+    """
+    try:
+        return await run_in_threadpool(chatbot.get_history_page, session_id, limit, before, after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.put("/api/messages/update/", tags=["Messages"], response_model=schema.Message)
 async def update_message(body: schema.MessageUpdate):
     """
@@ -206,11 +373,37 @@ async def update_message(body: schema.MessageUpdate):
     """
     try:
         info = body.__dict__
-        return chatbot.update_message(info)
+        return await run_in_threadpool(chatbot.update_message, info)
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
     
+@app.put("/api/messages/update/bulk/", tags=["Messages"], response_model=List[schema.Message])
+async def update_messages(body: schema.MessageUpdateBatch):
+    """
+    Registra el feedback de varios mensajes en una sola llamada.
+
+    Pensado para clientes que acumulan reacciones y las envían juntas: todas
+    se guardan en una sola sentencia. Si un mensaje aparece varias veces,
+    se conserva la última reacción.
+
+    Args:
+        body (schema.MessageUpdateBatch): `items`, una lista (1 a 500) de
+            objetos con el mismo formato que `/api/messages/update/`.
+
+    Returns:
+        List[schema.Message]: Los mensajes actualizados.
+
+    Raises:
+        HTTPException 500: Si falla la actualización (no se guarda ninguno).
+    """
+    try:
+        items = [item.model_dump() for item in body.items]
+        return await run_in_threadpool(chatbot.update_messages, items)
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/steps/{session_id}", tags=["Chatbot"])
 async def get_graph_steps(session_id: str):
     """
@@ -230,7 +423,7 @@ async def get_graph_steps(session_id: str):
         HTTPException 500: Si ocurre un error al recuperar los pasos.
     """
     try:
-        history = chatbot.get_steps(session_id)
+        history = await run_in_threadpool(chatbot.get_steps, session_id)
         return history
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -241,6 +434,8 @@ async def get_validation_message(user_id: str, interval: str, num_msg: int):
     """
     Obtiene el número de mensajes en un intervalo de tiempo.
 
+    Lee los mismos contadores de ventana deslizante que aplica el endpoint
+    de chat, por lo que no es necesario llamarlo antes de cada mensaje.
 
     Args:
         user_id (str): El identificador de la sesión a investigar.
@@ -255,8 +450,129 @@ async def get_validation_message(user_id: str, interval: str, num_msg: int):
         HTTPException 500: Si ocurre un error al recuperar los pasos.
     """
     try:
-        history = chatbot.get_validation(user_id, interval, num_msg)
+        history = await run_in_threadpool(chatbot.get_validation, user_id, interval, num_msg)
         return history
     except Exception as e:
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+
+
+
+@app.get("/stats/pool", tags=["Chatbot"])
+async def get_db_pool_stats():
+    """
+    [DEBUG] Obtiene las estadísticas de los pools de conexiones a Postgres.
+
+    Útil para dimensionar los pools bajo carga: conexiones en uso, overflow
+    y tiempo de espera del engine de SQLAlchemy, y los contadores del pool
+    de psycopg (checkpointer e historial).
+
+    Returns:
+        dict: Estadísticas `engine` y `db_pool`.
+    """
+    return get_pool_stats()
+
+
+
+@app.get("/stats/weaviate", tags=["Chatbot"])
+async def get_weaviate_stats():
+    """
+    [DEBUG] Obtiene el estado del cliente de Weaviate.
+
+    Returns:
+        dict: Salud de la conexión, generación del cliente (aumenta con cada
+        reconexión), segundos hasta que expire el token y último error.
+    """
+    return await run_in_threadpool(weaviate_manager.stats)
+
+
+
+@app.get("/stats/vector_backend", tags=["Chatbot"])
+async def get_vector_backend_stats():
+    """
+    [DEBUG] Obtiene el estado del backend vectorial del RAG (`RAG_BACKEND`).
+
+    Returns:
+        dict: Nombre del backend y su estado: salud del cliente de Weaviate,
+        o documentos, edad del snapshot y última sincronización de la réplica
+        local.
+    """
+    return await run_in_threadpool(lambda: vector_backends.get_backend().stats())
+
+
+
+@app.get("/stats/write_behind", tags=["Chatbot"])
+async def get_write_behind_stats():
+    """
+    [DEBUG] Obtiene el estado de la cola de escrituras diferidas.
+
+    Returns:
+        dict: Claves pendientes, encoladas, fusionadas, escritas, lotes,
+        escrituras en línea por contrapresión, fallos y último error.
+    """
+    return write_behind.queue.stats()
+
+
+@app.get("/stats/checkpoints", tags=["Chatbot"])
+async def get_checkpoint_stats():
+    """
+    [DEBUG] Obtiene el estado de la compactación de checkpoints.
+
+    Returns:
+        dict: Intervalo y antigüedad de compactación, resultado y error de la
+        última pasada (hilos reducidos a su último checkpoint y hilos borrados).
+    """
+    return checkpoint_compactor.stats()
+
+
+@app.get("/cache/answers", tags=["Chatbot"])
+async def get_answer_cache_stats():
+    """
+    [DEBUG] Obtiene las estadísticas de los caches del RAG.
+
+    Returns:
+        dict: Tamaño, aciertos, fallos y tasa de aciertos del cache semántico
+        de respuestas (`answers`), del cache de embeddings de consultas y del
+        cache de documentos recuperados.
+    """
+    return {"answers": chatbot.agent.get_answer_cache().stats(), **get_cache_stats(), "sync": cache_sync.watcher.stats()}
+
+
+@app.delete("/cache/answers", tags=["Chatbot"], status_code=200)
+async def invalidate_answer_cache():
+    """
+    Invalida los caches del RAG (respuestas y documentos recuperados).
+
+    Debe llamarse cuando se re-ingesta la colección "Rag" de Weaviate, para
+    que no se sirvan respuestas ni contexto basados en el contenido anterior
+    (`ingestion.py` ya lo hace al terminar). Invalida este worker de inmediato
+    y los demás en su siguiente revisión de la versión compartida
+    (`RAG_CACHE_SYNC_INTERVAL`).
+
+    Returns:
+        str: Mensaje de confirmación.
+
+    Raises:
+        HTTPException 500: Si no se pudo actualizar la versión compartida.
+    """
+    try:
+        version = await run_in_threadpool(cache_sync.watcher.publish)
+    except Exception as e:
+        logger.error(f"Error invalidando los caches del RAG: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    return f"Cache de respuestas invalidado (versión {version})"
+
+
+
+@app.get("/stats/startup", tags=["Chatbot"])
+async def get_startup_stats():
+    """
+    [DEBUG] Obtiene los tiempos de inicialización de cada dependencia.
+
+    El tiempo de importación por módulo se mide fuera del servicio con
+    `python startup.py imports`.
+
+    Returns:
+        dict: `dependencies` con la duración en segundos de cada paso del arranque.
+    """
+    return {"dependencies": startup.startup_timings}
@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import logging
+import argparse
+import subprocess
+import threading
+import uuid
+from datetime import datetime
+from typing import List, Optional
+from langchain_core.messages import message_to_dict
+
+from postgres_db import db_connection, get_checkpoint, get_table_name
+
+logger = logging.getLogger(__name__)
+
+# Dónde viven los mensajes de la conversación:
+# - "dual": el checkpointer guarda `State.messages` en cada paso del grafo y
+#   `chain_with_history` agrega la pregunta y la respuesta a chat_history.
+# - "history": chat_history es la única fuente; el grafo corre sin checkpointer
+#   (su estado solo tiene el turno actual) y el turno se guarda con un INSERT.
+MESSAGE_STORE = os.environ.get("MESSAGE_STORE", "dual").lower()
+if MESSAGE_STORE not in ("dual", "history"):
+    raise ValueError(f"MESSAGE_STORE debe ser 'dual' o 'history', no '{MESSAGE_STORE}'.")
+HISTORY_IS_AUTHORITATIVE = MESSAGE_STORE == "history"
+
+
+# --- Migración de sesiones existentes ---
+
+def _checkpoint_messages(session_id: str) -> Optional[list]:
+    """Mensajes del último checkpoint de la sesión (None si no tiene)."""
+    checkpoint = get_checkpoint().get_tuple({"configurable": {"thread_id": session_id}})
+    if checkpoint is None:
+        return None
+    return checkpoint.checkpoint["channel_values"].get("messages", [])
+
+
+def _created_at(message, fallback):
+    created_at = message.additional_kwargs.get("created_at")
+    try:
+        return datetime.fromisoformat(created_at) if created_at else fallback
+    except (TypeError, ValueError):
+        return fallback
+
+
+def migrate_session(session_id: str, drop_checkpoints: bool = False) -> str:
+    """
+    Completa chat_history con los mensajes de la sesión que solo están en el checkpoint.
+
+    Con MESSAGE_STORE=dual, los mensajes de fórmulas y de error solo quedaron
+    en el checkpoint. La migración es en el lugar: las filas existentes no se
+    tocan (conservan su `id`, así que los cursores de `get_history_page` y las
+    referencias a los mensajes siguen siendo válidos) y solo se insertan los
+    mensajes que faltan, en el orden del checkpoint y con su `created_at`. El
+    resumen de la sesión se borra y se regenera en el siguiente turno. Si
+    chat_history tiene mensajes que el checkpoint no conoce, la sesión no se toca.
+
+    Como el historial se ordena por `id`, un mensaje que faltaba entre dos
+    filas existentes queda después de ellas: en ese caso el estado es
+    'appended' en lugar de 'completed'.
+
+    Returns:
+        str: 'no_checkpoint', 'unchanged', 'completed', 'appended' o 'conflict'.
+    """
+    state_messages = _checkpoint_messages(session_id)
+    if state_messages is None:
+        return "no_checkpoint"
+    table = get_table_name()
+    with db_connection() as conn:
+        rows = conn.execute(
+            f"SELECT message, created_at FROM {table} WHERE session_id = %s ORDER BY id", (session_id,)
+        ).fetchall()
+        stored = {row[0]["data"].get("id"): row[1] for row in rows}
+        state_ids = {message.id for message in state_messages}
+        missing = [i for i, message in enumerate(state_messages) if message.id not in stored]
+        if not missing:
+            status = "unchanged"
+        elif not set(stored) <= state_ids:
+            status = "conflict"
+        else:
+            values, created_at = [], rows[0][1] if rows else None
+            for message in state_messages:
+                created_at = stored.get(message.id) or _created_at(message, created_at) or datetime.now()
+                if message.id not in stored:
+                    values.append((session_id, json.dumps(message_to_dict(message)), created_at, session_id, message.id))
+            with conn.transaction():
+                with conn.cursor() as cursor:
+                    # Idempotente aunque otra migración o un turno nuevo lo haya insertado entre medio
+                    cursor.executemany(
+                        f"""
+                        INSERT INTO {table} (session_id, message, created_at)
+                        SELECT %s, %s, %s
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM {table} WHERE session_id = %s AND message -> 'data' ->> 'id' = %s
+                        )
+                        """,
+                        values,
+                    )
+                conn.execute("DELETE FROM chat_summary WHERE session_id = %s", (session_id,))
+            last_stored = max((i for i, message in enumerate(state_messages) if message.id in stored), default=-1)
+            status = "completed" if missing[0] > last_stored else "appended"
+    if drop_checkpoints and status != "conflict":
+        get_checkpoint().delete_thread(session_id)
+    return status
+
+
+def migrate_all(drop_checkpoints: bool = False) -> dict:
+    """
+    Migra todas las sesiones con checkpoints (ver `migrate_session`).
+
+    Es idempotente: se puede correr antes de cambiar a MESSAGE_STORE=history y
+    otra vez después, para las sesiones que hayan llegado entre medio.
+    """
+    with db_connection() as conn:
+        session_ids = [row[0] for row in conn.execute("SELECT DISTINCT thread_id FROM checkpoints").fetchall()]
+    report = {"sessions": len(session_ids), "conflicts": []}
+    for session_id in session_ids:
+        try:
+            status = migrate_session(session_id, drop_checkpoints)
+        except Exception as e:
+            logger.error(f"Error migrando la sesión {session_id}: {e}", exc_info=True)
+            status = "error"
+        report[status] = report.get(status, 0) + 1
+        if status == "conflict":
+            report["conflicts"].append(session_id)
+    logger.info(f"Migración de mensajes: {report}")
+    return report
+
+
+# --- Benchmark ---
+
+class _WriteCounter():
+    """Cuenta las sentencias que los clientes psycopg envían a Postgres."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.statements = 0
+        self.writes = 0
+
+    def _count(self, query) -> None:
+        sql = str(query).upper()
+        with self._lock:
+            self.statements += 1
+            if "INSERT" in sql or "UPDATE" in sql or "DELETE" in sql:
+                self.writes += 1
+
+    def install(self) -> None:
+        import psycopg
+        counter = self
+        for name in ("execute", "executemany"):
+            original = getattr(psycopg.Cursor, name)
+
+            def wrapped(cursor, query, *args, _original=original, **kwargs):
+                counter._count(query)
+                return _original(cursor, query, *args, **kwargs)
+
+            setattr(psycopg.Cursor, name, wrapped)
+
+
+def _stored_bytes(session_id: str) -> dict:
+    """Bytes que ocupa la sesión en las tablas del checkpointer y en chat_history."""
+    sql = f"""
+        SELECT
+            (SELECT COALESCE(SUM(pg_column_size(t.*)), 0) FROM checkpoints t WHERE thread_id = %(s)s)
+          + (SELECT COALESCE(SUM(pg_column_size(t.*)), 0) FROM checkpoint_blobs t WHERE thread_id = %(s)s)
+          + (SELECT COALESCE(SUM(pg_column_size(t.*)), 0) FROM checkpoint_writes t WHERE thread_id = %(s)s),
+            (SELECT COALESCE(SUM(pg_column_size(t.*)), 0) FROM {get_table_name()} t WHERE session_id = %(s)s::uuid)
+    """
+    with db_connection() as conn:
+        checkpoint_bytes, history_bytes = conn.execute(sql, {"s": session_id}).fetchone()
+    return {"checkpoint": int(checkpoint_bytes), "history": int(history_bytes)}
+
+
+def measure(questions: List[str], user_id: str = "message-store-benchmark") -> dict:
+    """
+    Corre un turno por pregunta en una sesión nueva con el MESSAGE_STORE actual.
+
+    Cuenta las sentencias (y las de escritura) enviadas por psycopg durante los
+    turnos y los bytes que la sesión ocupa al final; después borra la sesión.
+    Lo que se escribe por SQLAlchemy (p. ej. los resúmenes) no se cuenta.
+    """
+    import chatbot
+
+    session_id = str(uuid.uuid4())
+    chatbot.get_new_session_id(session_id=session_id, user_id=user_id)
+    counter = _WriteCounter()
+    counter.install()
+    try:
+        for question in questions:
+            chatbot.get_response(question, session_id)
+        statements, writes = counter.statements, counter.writes
+        stored = _stored_bytes(session_id)
+        turns = len(questions)
+        return {
+            "message_store": MESSAGE_STORE,
+            "turns": turns,
+            "statements_per_turn": round(statements / turns, 2),
+            "writes_per_turn": round(writes / turns, 2),
+            "checkpoint_bytes_per_turn": round(stored["checkpoint"] / turns),
+            "history_bytes_per_turn": round(stored["history"] / turns),
+            "bytes_per_turn": round((stored["checkpoint"] + stored["history"]) / turns),
+        }
+    finally:
+        get_checkpoint().delete_thread(session_id)
+        with db_connection() as conn:
+            conn.execute(f"DELETE FROM {get_table_name()} WHERE session_id = %s", (session_id,))
+        chatbot.delete_conversation(session_id)
+
+
+def benchmark(questions: List[str]) -> dict:
+    """
+    Compara los dos modos con las mismas preguntas.
+
+    Cada modo corre en un proceso aparte porque MESSAGE_STORE se lee al
+    importar (el grafo se compila con o sin checkpointer).
+    """
+    report = {}
+    for mode in ("dual", "history"):
+        result = subprocess.run(
+            [sys.executable, __file__, "measure", *questions],
+            capture_output=True,
+            text=True,
+            env={**os.environ, "MESSAGE_STORE": mode},
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f"El benchmark en modo '{mode}' falló:\n{result.stderr}")
+        report[mode] = json.loads(result.stdout.strip().splitlines()[-1])
+    return report
+
+
+DEFAULT_QUESTIONS = [
+    "¿Qué es el CAC?",
+    "¿Cómo lo calculo?",
+    "¿Y el LTV?",
+    "¿Qué relación hay entre los dos?",
+    "Dame un ejemplo con números.",
+]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="Migración y benchmark del almacén de mensajes.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="Completa chat_history desde los checkpoints")
+    migrate_parser.add_argument("--drop-checkpoints", action="store_true", help="Borra los checkpoints ya migrados")
+    bench_parser = subparsers.add_parser("benchmark", help="Compara escrituras y bytes por turno de ambos modos")
+    bench_parser.add_argument("questions", nargs="*", default=DEFAULT_QUESTIONS)
+    measure_parser = subparsers.add_parser("measure", help="Mide el modo actual (lo usa 'benchmark')")
+    measure_parser.add_argument("questions", nargs="*", default=DEFAULT_QUESTIONS)
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        print(json.dumps(migrate_all(args.drop_checkpoints), indent=2))
+    elif args.command == "benchmark":
+        print(json.dumps(benchmark(args.questions), indent=2))
+    else:
+        print(json.dumps(measure(args.questions)))
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Uuid, Boolean, DateTime, JSON
+from sqlalchemy import Column, Integer, String, ForeignKey, Uuid, Boolean, DateTime, JSON, Text, Index, text
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql.expression import func
@@ -9,6 +10,12 @@ Base = declarative_base()
 
 class UserSession(Base):
     __tablename__ = 'user_sessions'
+    __table_args__ = (
+        # One row per conversation; lookups by session_id on every request
+        Index('uq_user_sessions_session_id', 'session_id', unique=True),
+        # A user's active conversations, newest first (keyset on updated_at, id)
+        Index('ix_user_sessions_user_id_updated_at', 'user_id', 'updated_at', 'id', postgresql_where=text('is_active')),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(String, nullable=False)
@@ -20,6 +27,10 @@ class UserSession(Base):
 
 class MessageInfo(Base):
     __tablename__ = 'message_revision'
+    __table_args__ = (
+        # One revision per message; also the conflict target of the upsert
+        Index('uq_message_revision_message_id', 'message_id', unique=True),
+    )
 
     id = Column(Integer, primary_key=True)
     message_id = Column(String, nullable=False)
@@ -30,9 +41,111 @@ class MessageInfo(Base):
 
 
 
+class ChatSummary(Base):
+    __tablename__ = 'chat_summary'
+
+    session_id = Column(Uuid, primary_key=True)
+    summary = Column(Text, nullable=False, default="")
+    # Id de la última fila del historial ya incluida en el resumen
+    summarized_until = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class RagCacheVersion(Base):
+    __tablename__ = 'rag_cache_version'
+
+    # Shared by every worker: bumping it invalidates the RAG caches of all of them
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
 def create_tables(engine):
     """
     Creates all tables defined in this module in the database.
     """
     Base.metadata.create_all(engine) # Create the tables
 
+
+# For each unique index: the duplicate row to keep, matching what the reads
+# already return (the first session row, the latest revision).
+UNIQUE_INDEX_KEEP = {
+    'uq_user_sessions_session_id': 'MIN',
+    'uq_message_revision_message_id': 'MAX',
+}
+
+
+# Unique indexes the code depends on: the ON CONFLICT target of
+# connection.upsert_message_revisions. Without them those writes fail.
+REQUIRED_UNIQUE_INDEXES = ('uq_message_revision_message_id',)
+
+
+def check_required_indexes(engine) -> None:
+    """
+    Fails if a unique index in REQUIRED_UNIQUE_INDEXES is missing or invalid.
+
+    Raises:
+        RuntimeError: With the missing indexes and how to create them.
+    """
+    with engine.connect() as conn:
+        existing = set(conn.execute(text("""
+            SELECT c.relname
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = ANY(:names) AND i.indisunique AND i.indisvalid
+        """), {"names": list(REQUIRED_UNIQUE_INDEXES)}).scalars())
+    missing = sorted(set(REQUIRED_UNIQUE_INDEXES) - existing)
+    if missing:
+        raise RuntimeError(
+            f"Missing required unique indexes {missing}; run `python query_plans.py migrate --dedupe`."
+        )
+
+
+def _count_duplicates(conn, index: Index) -> int:
+    columns = ", ".join(column.name for column in index.columns)
+    return conn.execute(text(f"""
+        SELECT COUNT(*) FROM (
+            SELECT 1 FROM {index.table.name} GROUP BY {columns} HAVING COUNT(*) > 1
+        ) AS duplicated
+    """)).scalar_one()
+
+
+def _delete_duplicates(conn, index: Index) -> int:
+    columns = ", ".join(column.name for column in index.columns)
+    keep = UNIQUE_INDEX_KEEP[index.name]
+    return conn.execute(text(f"""
+        DELETE FROM {index.table.name}
+        WHERE id NOT IN (SELECT {keep}(id) FROM {index.table.name} GROUP BY {columns})
+    """)).rowcount
+
+
+def migrate_indexes(engine, dedupe: bool = False) -> dict:
+    """
+    Brings an existing database up to the indexes declared on the models.
+
+    `create_tables` only creates missing tables, so indexes added to a model
+    later never reach tables that already exist. This creates every missing
+    index (`IF NOT EXISTS`, safe to run repeatedly). A unique index whose
+    columns already hold duplicates is skipped and reported, unless
+    `dedupe` is True, in which case the duplicates are deleted first
+    (keeping the row given by UNIQUE_INDEX_KEEP).
+
+    Returns:
+        dict: {index_name: 'ok' | 'skipped: N duplicated keys' | 'deduplicated: N rows'}.
+    """
+    create_tables(engine)
+    report = {}
+    for table in Base.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            with engine.begin() as conn:
+                status = 'ok'
+                if index.unique:
+                    duplicates = _count_duplicates(conn, index)
+                    if duplicates and not dedupe:
+                        report[index.name] = f'skipped: {duplicates} duplicated keys'
+                        continue
+                    if duplicates:
+                        status = f'deduplicated: {_delete_duplicates(conn, index)} rows'
+                conn.execute(CreateIndex(index, if_not_exists=True))
+                report[index.name] = status
+    return report
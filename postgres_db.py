@@ -1,38 +1,199 @@
 import os
 from dotenv import load_dotenv
-from langgraph.checkpoint.postgres import PostgresSaver
-from psycopg_pool import ConnectionPool
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
 from langchain_postgres import PostgresChatMessageHistory
 from langchain_core.messages import BaseMessage
 from typing import List
+import threading
+import time
+import logging
+from contextlib import contextmanager
 from sqlalchemy import create_engine, text
-from models import create_tables
-from configs import get_secret
+from sqlalchemy.pool import QueuePool
+from models import migrate_indexes, check_required_indexes
+from checkpoint_store import TurnPostgresSaver, TurnAsyncPostgresSaver
+from configs import get_secret, on_secret_change
 
+logger = logging.getLogger(__name__)
 
-secret_name = os.environ.get("DB_SECRET_NAME")
-db_settings: dict = get_secret(secret_name)
-env_name = os.environ.get("ENV")
-host = db_settings.get('POSTGRES_HOST') if env_name == 'local' else db_settings.get('POSTGRES_HOST_PRIVATE') 
 
-
-DB_URI = f"postgresql://{db_settings.get('POSTGRES_USER')}:{db_settings.get('POSTGRES_PASSWORD')}@{host}:{db_settings.get('POSTGRES_PORT')}/{db_settings.get('POSTGRES_DB')}"
 connection_kwargs = {
     "autocommit": True,
     "prepare_threshold": 0,
 }
 
-table_name = db_settings.get('TABLE_HISTORY_NAME')
-
-db_pool = ConnectionPool(
-    conninfo=DB_URI,
-    min_size=1,
-    max_size=10,
-    kwargs=connection_kwargs
-)
+# Pool sizing. The psycopg pool (checkpointer + chat history) and the SQLAlchemy
+# engine (connection.py) share the same database, so both are sized from here.
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+ASYNC_DB_POOL_MAX_SIZE = int(os.environ.get("ASYNC_DB_POOL_MAX_SIZE", 20))
+ENGINE_POOL_SIZE = int(os.environ.get("ENGINE_POOL_SIZE", 5))
+ENGINE_MAX_OVERFLOW = int(os.environ.get("ENGINE_MAX_OVERFLOW", 5))
+ENGINE_POOL_TIMEOUT = float(os.environ.get("ENGINE_POOL_TIMEOUT", 30))
+ENGINE_POOL_RECYCLE = int(os.environ.get("ENGINE_POOL_RECYCLE", 1800))
+
+# Everything below is built on first use (or from the FastAPI lifespan), so
+# importing this module does no network I/O.
+_db_pool = None
+_checkpoint = None
+_async_db_pool = None
+_acheckpoint = None
+_lazy_lock = threading.RLock()
+_table_name = None
+
+
+def get_db_settings() -> dict:
+    """Database settings from the secret DB_SECRET_NAME (cached by configs)."""
+    return get_secret(os.environ.get("DB_SECRET_NAME"))
+
+
+def get_db_uri() -> str:
+    db_settings = get_db_settings()
+    env_name = os.environ.get("ENV")
+    host = db_settings.get('POSTGRES_HOST') if env_name == 'local' else db_settings.get('POSTGRES_HOST_PRIVATE') 
+    return f"postgresql://{db_settings.get('POSTGRES_USER')}:{db_settings.get('POSTGRES_PASSWORD')}@{host}:{db_settings.get('POSTGRES_PORT')}/{db_settings.get('POSTGRES_DB')}"
+
+
+def get_table_name() -> str:
+    """Name of the chat history table (read once; updated if the DB secret rotates)."""
+    global _table_name
+    if _table_name is None:
+        _table_name = get_db_settings().get('TABLE_HISTORY_NAME')
+    return _table_name
+
+
+def get_db_pool() -> ConnectionPool:
+    """Returns the psycopg pool, opening it on first use."""
+    global _db_pool
+    if _db_pool is None:
+        with _lazy_lock:
+            if _db_pool is None:
+                pool = ConnectionPool(
+                    conninfo=get_db_uri(),
+                    min_size=1,
+                    max_size=DB_POOL_MAX_SIZE,
+                    kwargs=connection_kwargs,
+                    open=False,
+                )
+                pool.open()
+                _db_pool = pool
+    return _db_pool
+
+
+def get_checkpoint() -> TurnPostgresSaver:
+    """Checkpointer with the retention and durability settings of checkpoint_store."""
+    global _checkpoint
+    if _checkpoint is None:
+        with _lazy_lock:
+            if _checkpoint is None:
+                _checkpoint = TurnPostgresSaver(get_db_pool())
+    return _checkpoint
+
+
+def get_async_db_pool() -> AsyncConnectionPool:
+    """
+    Returns the async pool for the async graph path.
 
+    It must be opened inside the running event loop, so it is created closed
+    and opened from the FastAPI lifespan (`open_async_pool`).
+    """
+    global _async_db_pool
+    if _async_db_pool is None:
+        with _lazy_lock:
+            if _async_db_pool is None:
+                _async_db_pool = AsyncConnectionPool(
+                    conninfo=get_db_uri(),
+                    min_size=1,
+                    max_size=ASYNC_DB_POOL_MAX_SIZE,
+                    kwargs=connection_kwargs,
+                    open=False,
+                )
+    return _async_db_pool
+
+
+def get_acheckpoint() -> TurnAsyncPostgresSaver:
+    global _acheckpoint
+    if _acheckpoint is None:
+        with _lazy_lock:
+            if _acheckpoint is None:
+                _acheckpoint = TurnAsyncPostgresSaver(get_async_db_pool())
+    return _acheckpoint
+
+
+async def open_async_pool():
+    """Opens the async connection pool (call from the application lifespan)."""
+    await get_async_db_pool().open()
+
+
+async def close_async_pool():
+    """Closes the async connection pool."""
+    if _async_db_pool is not None:
+        await _async_db_pool.close()
+
+
+def close_db_pool():
+    """Closes the sync connection pool."""
+    if _db_pool is not None:
+        _db_pool.close()
+
+
+class _CheckoutStats():
+    """Thread-safe counters for connections checked out of `db_pool`."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+
+    def acquired(self, waited: float) -> None:
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def released(self, held: float) -> None:
+        with self._lock:
+            self.in_use -= 1
+            self.hold_total += held
+            self.hold_max = max(self.hold_max, held)
+
+    def as_dict(self) -> dict:
+        """Returns the counters; durations are in milliseconds."""
+        with self._lock:
+            count = self.checkouts
+            return {
+                "in_use": self.in_use,
+                "checkouts": count,
+                "wait_avg_ms": (self.wait_total / count * 1000) if count else 0.0,
+                "wait_max_ms": self.wait_max * 1000,
+                "hold_avg_ms": (self.hold_total / count * 1000) if count else 0.0,
+                "hold_max_ms": self.hold_max * 1000,
+            }
+
+
+checkout_stats = _CheckoutStats()
+
+
+@contextmanager
+def db_connection():
+    """
+    Checks out a connection from `db_pool` for the duration of the block.
 
-checkpoint = PostgresSaver(db_pool)
+    The connection always goes back to the pool when the block exits, and
+    the wait and hold times are recorded in `checkout_stats`.
+    """
+    start = time.perf_counter()
+    with get_db_pool().connection() as conn:
+        acquired_at = time.perf_counter()
+        checkout_stats.acquired(acquired_at - start)
+        try:
+            yield conn
+        finally:
+            checkout_stats.released(time.perf_counter() - acquired_at)
 
 
 def init_tables():
@@ -41,58 +202,56 @@ def init_tables():
     
     Uses env variables of TABLE_CHECKPOINT_NAME, TABLE_HISTORY_NAME, TABLE_VECTOR_NAME
     """
-    checkpoint.setup()
+    get_checkpoint().setup()
     
-    db_conn = next(get_db())
-    try:
-        PostgresChatMessageHistory.create_tables(db_conn, table_name)
-    finally:
-        db_conn.close()
-    engine = get_db_engine()
-    create_tables(engine)
+    with db_connection() as db_conn:
+        PostgresChatMessageHistory.create_tables(db_conn, get_table_name())
+        # Serves the paginated history (session_id filter + keyset on id)
+        db_conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{get_table_name()}_session_id_id ON {get_table_name()} (session_id, id)"
+        )
+    # Missing tables and indexes; unique indexes over duplicated rows are reported
+    skipped = {name: status for name, status in migrate_indexes(get_db_engine()).items() if status.startswith("skipped")}
+    if skipped:
+        logger.warning(f"Indexes not created, run `python query_plans.py migrate --dedupe`: {skipped}")
+    check_required_indexes(get_db_engine())
 
 
 
 
 class PostgresChatHistory():
-    """Postgres-backed chat message history using LangChain's PostgresChatMessageHistory."""
+    """
+    Postgres-backed chat message history using LangChain's PostgresChatMessageHistory.
+
+    No connection is held by the instance: each operation checks one out
+    from `db_pool` and returns it before the call ends.
+    """
 
     def __init__(self, session_id:str):
-        # Consider applying the connection_string fix to init_memory if not already done
-        history = init_memory(session_id)
-        self.chat_history = history
         self.session_id = session_id
 
     def add_messages(self, messages: List[BaseMessage]) -> None:
         """Stores messages in the Postgres database"""
-        # Now, call the underlying standard method
         try:
-            # Note: The standard PostgresChatMessageHistory doesn't have add_messages (plural)
-            # It has add_message (singular). The checkpointer likely calls add_message repeatedly.
-            # If LangGraph calls your wrapper's add_messages (plural), you need the loop.
-            # If LangGraph somehow calls the underlying add_message directly, this wrapper method might not even be hit by the checkpointer.
-            # Let's assume for now your wrapper *is* somehow involved or you call it manually.
-            # A more direct test might involve subclassing PostgresChatMessageHistory itself.
-            for message in messages:
-                self.chat_history.add_message(message) # Call standard add_message
+            with init_memory(self.session_id) as chat_history:
+                chat_history.add_messages(messages)
 
         except Exception as e:
-            print(f"Error during self.chat_history.add_message: {e}")
+            print(f"Error during self.chat_history.add_messages: {e}")
             import traceback
             traceback.print_exc()
 
 
     def get_messages(self) -> List[BaseMessage]:
         """Retrieves messages from the database"""
-        return self.chat_history.messages # Use the property
+        with init_memory(self.session_id) as chat_history:
+            return chat_history.messages
 
     @property
     def messages(self) -> List[BaseMessage]:
         """Retrieves messages from the database."""
-        # Call the underlying get_messages method or messages property
         try:
-            # The standard class uses the .messages property primarily
-            return self.chat_history.messages
+            return self.get_messages()
         except Exception as e:
             print(f"Error during self.chat_history.messages: {e}")
             return []
@@ -100,47 +259,187 @@ class PostgresChatHistory():
 
     def clear(self) -> None:
         """Deletes chat history for a session"""
-        self.chat_history.clear()
+        with init_memory(self.session_id) as chat_history:
+            chat_history.clear()
+
+
+class AsyncPostgresChatHistory():
+    """
+    Async chat message history for RunnableWithMessageHistory.
+
+    Each operation checks out its own connection from `async_db_pool` and
+    returns it when done, so no connection is held between turns.
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+
+    def _history(self, conn) -> PostgresChatMessageHistory:
+        return PostgresChatMessageHistory(
+            get_table_name(),
+            self.session_id,
+            async_connection=conn
+        )
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        """Retrieves messages from the database"""
+        async with get_async_db_pool().connection() as conn:
+            return await self._history(conn).aget_messages()
+
+    async def aadd_messages(self, messages: List[BaseMessage]) -> None:
+        """Stores messages in the Postgres database"""
+        try:
+            async with get_async_db_pool().connection() as conn:
+                await self._history(conn).aadd_messages(messages)
+        except Exception as e:
+            print(f"Error during aadd_messages: {e}")
+            import traceback
+            traceback.print_exc()
+
+    async def aclear(self) -> None:
+        """Deletes chat history for a session"""
+        async with get_async_db_pool().connection() as conn:
+            await self._history(conn).aclear()
 
 
 def get_by_session_id(session_id: str) -> PostgresChatHistory:
     """Retrieve chat history from Postgres based on session_id."""
     return PostgresChatHistory(session_id=session_id)
 
-def get_db():
-    """Yields a persistent database connection from the pool."""
-    conn = db_pool.getconn()
-    try:
-        yield conn
-    finally:
-        db_pool.putconn(conn)  # Return connection to the pool instead of closing it
-
-def init_memory(session_id: str) -> PostgresChatMessageHistory:
-    """Retrieve chat history for a session using a raw connection."""
-    db_conn = next(get_db())
-
-    # Initialize the chat history manager
-    chat_history = PostgresChatMessageHistory(
-        table_name,
-        session_id,
-        sync_connection=db_conn
-    )
-    return chat_history
+def get_async_by_session_id(session_id: str) -> AsyncPostgresChatHistory:
+    """Retrieve async chat history from Postgres based on session_id."""
+    return AsyncPostgresChatHistory(session_id=session_id)
+
+@contextmanager
+def init_memory(session_id: str):
+    """
+    Chat history for a session bound to a pooled connection.
+
+    Use as a context manager; the connection is returned to the pool on exit.
+    """
+    with db_connection() as db_conn:
+        # Initialize the chat history manager
+        yield PostgresChatMessageHistory(
+            get_table_name(),
+            session_id,
+            sync_connection=db_conn
+        )
+
+class _TimedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait to check out a connection."""
+
+    wait_count = 0
+    wait_total = 0.0
+    wait_max = 0.0
+    _stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                _TimedQueuePool.wait_count += 1
+                _TimedQueuePool.wait_total += waited
+                _TimedQueuePool.wait_max = max(_TimedQueuePool.wait_max, waited)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
 
 def get_db_engine():
-    """Creates a SQLAlchemy engine for database operations."""
+    """Returns the process-wide SQLAlchemy engine, creating it on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(
+                    get_db_uri(),
+                    poolclass=_TimedQueuePool,
+                    pool_size=ENGINE_POOL_SIZE,
+                    max_overflow=ENGINE_MAX_OVERFLOW,
+                    pool_timeout=ENGINE_POOL_TIMEOUT,
+                    pool_recycle=ENGINE_POOL_RECYCLE,
+                    pool_pre_ping=True,
+                )
+    return _engine
+
+
+def dispose_db_engine():
+    """Closes every pooled connection of the shared engine (e.g. at shutdown)."""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+
+
+def _on_db_secret_change(db_settings: dict) -> None:
+    """
+    Picks up rotated DB credentials (called by configs when the secret changes).
+
+    The psycopg pools get the new conninfo, so connections they open from now
+    on use it; existing ones keep working until `max_lifetime` recycles them.
+    The SQLAlchemy engine is disposed and rebuilt on the next `get_db_engine`.
+    """
+    global _table_name
+    _table_name = db_settings.get('TABLE_HISTORY_NAME')
+    uri = get_db_uri()
+    for pool in (_db_pool, _async_db_pool):
+        if pool is not None:
+            pool.conninfo = uri
+    dispose_db_engine()
+    logger.info("DB secret rotated: pools and engine now use the new credentials")
 
-    return create_engine(DB_URI)
+
+on_secret_change(os.environ.get("DB_SECRET_NAME"), _on_db_secret_change)
+
+
+def get_pool_stats() -> dict:
+    """
+    Returns connection pool statistics for the SQLAlchemy engine and the psycopg pool.
+
+    Wait times are in milliseconds.
+    """
+    engine_stats = {
+        "pool_size": ENGINE_POOL_SIZE,
+        "max_overflow": ENGINE_MAX_OVERFLOW,
+        "checked_out": 0,
+        "checked_in": 0,
+        "overflow": 0,
+    }
+    if _engine is not None:
+        pool = _engine.pool
+        engine_stats.update({
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+        })
+    wait_count = _TimedQueuePool.wait_count
+    engine_stats.update({
+        "checkouts": wait_count,
+        "wait_avg_ms": (_TimedQueuePool.wait_total / wait_count * 1000) if wait_count else 0.0,
+        "wait_max_ms": _TimedQueuePool.wait_max * 1000,
+    })
+
+    return {
+        "engine": engine_stats,
+        "db_pool": {**(_db_pool.get_stats() if _db_pool else {}), **checkout_stats.as_dict()},
+        "async_db_pool": _async_db_pool.get_stats() if _async_db_pool else {},
+    }
 
 def get_all_sessions():
-    db_conn = next(get_db())
     """Retrieve all unique session_ids from the chat history table."""
 
-    query = f"SELECT DISTINCT session_id FROM {table_name};"
-    with db_conn.cursor() as cursor:
+    query = f"SELECT DISTINCT session_id FROM {get_table_name()};"
+    with db_connection() as db_conn, db_conn.cursor() as cursor:
         cursor.execute(query)
         session_ids = [row[0] for row in cursor.fetchall()]
 
     return session_ids
 
-#init_tables()
\ No newline at end of file
+
+
+#init_tables()
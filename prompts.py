@@ -48,6 +48,31 @@ prompt_formula_analysis = PromptTemplate(
 )
 
 
+# --- 2b. Prompt combinado: Routing + Análisis de Fórmulas en una sola llamada ---
+ROUTE_AND_ANALYZE_TEMPLATE = """
+Eres un agente experto en preguntas de emprendedores sobre fórmulas de negocio.
+Con UNA sola respuesta debes decidir el siguiente paso y, si aplica, analizar las fórmulas.
+
+Lista Completa de Fórmulas Disponibles (incluye 'key', 'name', 'params'):
+{formulas_json}
+
+Instrucciones:
+1. 'decision': responde 'formula' si la pregunta menciona (explícita o implícitamente) alguna fórmula de la lista, ya sea para calcularla o para entenderla. En cualquier otro caso responde 'chatbot'.
+2. 'formulas': si la decisión es 'formula', incluye CADA fórmula relevante con:
+    a. 'key' y 'name' tal como aparecen en la lista.
+    b. 'params_required': la lista de 'params' de la fórmula.
+    c. 'is_calculated': true si el usuario quiere CALCULARLA, false si solo busca información o explicación.
+   Si la decisión es 'chatbot', devuelve una lista vacía.
+
+Pregunta del Usuario:
+{question}
+"""
+
+prompt_route_and_analyze = PromptTemplate(
+    template=ROUTE_AND_ANALYZE_TEMPLATE,
+    input_variables=["question", "formulas_json"]
+)
+
 # --- 3. Prompt para Extracción de Parámetros (Opcional, si se necesita un paso LLM dedicado) ---
 PARAMS_EXTRACTION_TEMPLATE = """
 Dada la conversación y la pregunta del usuario, extrae los valores numéricos para los siguientes parámetros requeridos para calcular una fórmula. Si un valor no se encuentra explícitamente o no es numérico, déjalo como `null`.
@@ -98,4 +123,24 @@ prompt_niilo = ChatPromptTemplate.from_messages([
     SystemMessagePromptTemplate.from_template(SYSTEM_TEMPLATE_NIILO),
     MessagesPlaceholder(variable_name="chat_history"),
     HumanMessagePromptTemplate.from_template("{question}")
-])
\ No newline at end of file
+])
+
+
+# --- Prompt para el Resumen Incremental del Historial ---
+SUMMARY_TEMPLATE = """
+Eres el encargado de mantener la memoria de largo plazo de Niilo, un asistente para emprendedores.
+Actualiza el resumen de la conversación incorporando los mensajes nuevos.
+
+Conserva: datos del usuario y de su startup (sector, etapa, cifras, métricas calculadas),
+objetivos, decisiones tomadas, preguntas pendientes y recomendaciones dadas.
+Omite saludos y detalles que no aporten. Escribe en español, en tercera persona y en
+máximo 200 palabras.
+
+Resumen actual (puede estar vacío):
+{summary}
+
+Mensajes nuevos:
+{messages}
+
+Resumen actualizado:"""
+prompt_summary = PromptTemplate.from_template(SUMMARY_TEMPLATE)
@@ -0,0 +1,166 @@
+import sys
+import json
+import uuid
+import inspect
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Tuple
+from sqlalchemy import event
+
+import connection
+from models import migrate_indexes
+from postgres_db import get_db_engine, get_table_name
+
+logger = logging.getLogger(__name__)
+
+# Funciones de connection.py que no consultan por índice (solo insertan)
+NOT_CHECKED = {"create_session"}
+
+INDEX_NODE_TYPES = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+
+def _sample_calls() -> List[Tuple[str, Callable]]:
+    """Una llamada por consulta de connection.py, con argumentos de ejemplo."""
+    session_id = str(uuid.uuid4())
+    user_id = "query-plans"
+    message_id = f"chatbot_{uuid.uuid4()}"
+    now = datetime.now(timezone.utc)
+    yesterday = now - timedelta(days=1)
+    return [
+        ("get_sessions_by_user", lambda: connection.get_sessions_by_user(user_id)),
+        ("get_sessions_with_first_message", lambda: connection.get_sessions_with_first_message(user_id, limit=20, cursor=(now, 1))),
+        ("get_session_user", lambda: connection.get_session_user(session_id)),
+        ("update_user_session", lambda: connection.update_user_session(session_id, {"updated_at": now})),
+        ("touch_sessions", lambda: connection.touch_sessions({session_id: now, str(uuid.uuid4()): now})),
+        ("create_message_revision", lambda: connection.create_message_revision(
+            {"message_id": message_id, "like": True, "feedback": [], "observations": ""})),
+        ("upsert_message_revisions", lambda: connection.upsert_message_revisions([
+            {"message_id": message_id, "like": False, "feedback": [], "observations": ""},
+            {"message_id": f"chatbot_{uuid.uuid4()}", "like": True, "feedback": [], "observations": ""},
+        ])),
+        ("get_message_revision", lambda: connection.get_message_revision([message_id, f"user_{uuid.uuid4()}"])),
+        ("count_user_messages_by_bucket", lambda: connection.count_user_messages_by_bucket(user_id, yesterday, 3600)),
+        ("get_chat_summary", lambda: connection.get_chat_summary(session_id)),
+        ("save_chat_summary", lambda: connection.save_chat_summary(session_id, "", 1)),
+        ("count_session_messages", lambda: connection.count_session_messages(session_id, 1)),
+        ("get_rag_cache_version", lambda: connection.get_rag_cache_version()),
+        ("bump_rag_cache_version", lambda: connection.bump_rag_cache_version()),
+        ("get_chat_history_after", lambda: connection.get_chat_history_after(session_id, 0)),
+        ("get_chat_history_page", lambda: connection.get_chat_history_page(session_id, 20)),
+        ("get_chat_history_page", lambda: connection.get_chat_history_page(session_id, 20, before=100)),
+        ("get_chat_history_page", lambda: connection.get_chat_history_page(session_id, 20, after=100)),
+    ]
+
+
+class _PlanRecorder():
+    """
+    Convierte cada sentencia del engine en `EXPLAIN (FORMAT JSON)` y guarda el plan.
+
+    EXPLAIN sin ANALYZE no ejecuta la sentencia, así que las funciones que
+    escriben no modifican nada. Con `enable_seqscan = off` el planificador solo
+    elige un Seq Scan si no hay un índice utilizable.
+    """
+
+    def __init__(self):
+        self.current = None
+        self.plans: List[Tuple[str, str, dict]] = []
+
+    def before(self, conn, cursor, statement, parameters, context, executemany):
+        return "SET LOCAL enable_seqscan = off; EXPLAIN (FORMAT JSON) " + statement, parameters
+
+    def after(self, conn, cursor, statement, parameters, context, executemany):
+        plan = cursor.fetchall()[0][0]
+        self.plans.append((self.current, statement, plan[0]["Plan"] if isinstance(plan, list) else plan))
+
+
+def _walk(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _walk(child)
+
+
+def explain_queries() -> dict:
+    """
+    Planes de las consultas de connection.py sobre la base configurada.
+
+    Llama a cada función con argumentos de ejemplo mientras el engine
+    compartido explica sus sentencias en lugar de ejecutarlas; como las
+    funciones reciben un plan en vez de filas, sus errores se ignoran. No
+    debe correr dentro del servicio: afecta a todo el engine mientras dura.
+
+    Returns:
+        dict: {función: [{"statement", "index_scans", "seq_scans"}]}.
+    """
+    engine = get_db_engine()
+    with engine.connect():
+        pass # La inicialización del dialecto no debe pasar por el recorder
+    recorder = _PlanRecorder()
+    event.listen(engine, "before_cursor_execute", recorder.before, retval=True)
+    event.listen(engine, "after_cursor_execute", recorder.after)
+    try:
+        for name, call in _sample_calls():
+            recorder.current = name
+            try:
+                call()
+            except Exception as e:
+                logger.debug(f"{name}: {e}")
+    finally:
+        event.remove(engine, "before_cursor_execute", recorder.before)
+        event.remove(engine, "after_cursor_execute", recorder.after)
+        engine.dispose() # Descarta conexiones con enable_seqscan alterado
+
+    report = {}
+    for name, statement, plan in recorder.plans:
+        nodes = list(_walk(plan))
+        report.setdefault(name, []).append({
+            "statement": " ".join(statement.split()),
+            "index_scans": [node["Index Name"] for node in nodes if node.get("Node Type") in INDEX_NODE_TYPES],
+            "seq_scans": [node["Relation Name"] for node in nodes if node.get("Node Type") == "Seq Scan"],
+        })
+    return report
+
+
+def index_usage_problems(report: dict = None) -> dict:
+    """
+    Consultas de connection.py que recorren completa una tabla de la aplicación.
+
+    También lista las funciones de connection.py sin llamada de ejemplo en
+    `_sample_calls`, para que no escapen a la verificación.
+
+    Returns:
+        dict: `unchecked` (funciones sin plan) y `seq_scans` ({función:
+        sentencia}); ambos vacíos si todo usa índices.
+    """
+    tables = {"user_sessions", "message_revision", "chat_summary", "rag_cache_version", get_table_name()}
+    report = explain_queries() if report is None else report
+    functions = {
+        name for name, fn in inspect.getmembers(connection, inspect.isfunction)
+        if fn.__module__ == connection.__name__
+    }
+    return {
+        "unchecked": sorted(functions - set(report) - NOT_CHECKED),
+        "seq_scans": {
+            name: plan["statement"]
+            for name, plans in report.items()
+            for plan in plans
+            if tables & set(plan["seq_scans"])
+        },
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Índices de la base de la aplicación.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="Crea los índices declarados en models.py que falten")
+    migrate_parser.add_argument("--dedupe", action="store_true", help="Borra filas duplicadas antes de crear índices únicos")
+    subparsers.add_parser("check", help="Verifica con EXPLAIN que las consultas usan índices")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        print(json.dumps(migrate_indexes(get_db_engine(), dedupe=args.dedupe), indent=2))
+    else:
+        problems = index_usage_problems()
+        print(json.dumps(problems, indent=2))
+        sys.exit(1 if problems["unchecked"] or problems["seq_scans"] else 0)
@@ -0,0 +1,233 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, NamedTuple, Optional, Tuple
+import connection
+from helpers import get_interval
+
+logger = logging.getLogger(__name__)
+
+# Cuota aplicada en el endpoint de chat. QUOTA_MAX_MESSAGES=0 la desactiva.
+QUOTA_MAX_MESSAGES = int(os.environ.get("QUOTA_MAX_MESSAGES", 0))
+QUOTA_INTERVAL = os.environ.get("QUOTA_INTERVAL", "24 hour")
+# Cada cuánto se resincroniza un contador con Postgres (otras instancias también escriben)
+QUOTA_RESYNC_SECONDS = int(os.environ.get("QUOTA_RESYNC_SECONDS", 300))
+QUOTA_MAX_COUNTERS = int(os.environ.get("QUOTA_MAX_COUNTERS", 10000))
+# Número de "buckets" en que se divide cada ventana
+QUOTA_BUCKETS = 60
+# Filas que un turno escribe en el historial (mensaje humano + respuesta de Niilo)
+MESSAGES_PER_TURN = 2
+
+
+class QuotaExceeded(Exception):
+    """El usuario superó el número de mensajes permitido en la ventana."""
+
+    def __init__(self, status: dict):
+        super().__init__(f"Límite de {status['num_msg']} mensajes cada {status['interval']} alcanzado.")
+        self.status = status
+
+
+class Reservation(NamedTuple):
+    """Mensajes sumados por adelantado a los contadores de un usuario (ver `reserve_turn`)."""
+    user_id: str
+    at: float
+    amount: int
+
+
+class SlidingWindowCounter():
+    """
+    Contador de ventana deslizante por buckets.
+
+    La ventana se divide en `QUOTA_BUCKETS` buckets de igual ancho; el total se
+    mantiene incrementalmente, así que sumar y consultar es O(1) amortizado.
+    """
+
+    def __init__(self, window_seconds: int, buckets: Dict[int, int] = None):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = max(1, window_seconds // QUOTA_BUCKETS)
+        self.buckets: Dict[int, int] = dict(buckets or {})
+        self.total = sum(self.buckets.values())
+        self.synced_at = time.time()
+
+    def _bucket(self, now: float) -> int:
+        return int(now // self.bucket_seconds)
+
+    def _expire(self, now: float) -> None:
+        oldest = self._bucket(now - self.window_seconds)
+        for bucket in [b for b in self.buckets if b <= oldest]:
+            self.total -= self.buckets.pop(bucket)
+
+    def add(self, amount: int = 1, now: Optional[float] = None) -> int:
+        now = now or time.time()
+        self._expire(now)
+        bucket = self._bucket(now)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + amount
+        self.total += amount
+        return self.total
+
+    def count(self, now: Optional[float] = None) -> int:
+        self._expire(now or time.time())
+        return self.total
+
+    def remove(self, amount: int, at: float) -> None:
+        """Descuenta lo sumado en el instante `at` (nada si ya salió de la ventana)."""
+        bucket = self._bucket(at)
+        if bucket in self.buckets:
+            removed = min(amount, self.buckets[bucket])
+            self.buckets[bucket] -= removed
+            self.total -= removed
+
+
+class QuotaTracker():
+    """
+    Contadores de mensajes por (usuario, ventana) en memoria.
+
+    Un contador ausente o viejo se carga desde Postgres con una sola consulta
+    agrupada por bucket; a partir de ahí cada turno solo suma en memoria.
+    """
+
+    def __init__(self, max_counters: int = QUOTA_MAX_COUNTERS):
+        self.max_counters = max_counters
+        self._counters: "OrderedDict[Tuple[str, int], SlidingWindowCounter]" = OrderedDict()
+        self._windows: Dict[str, set] = {} # user_id -> ventanas con contador en memoria
+        self._session_users: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, user_id: str, window_seconds: int) -> SlidingWindowCounter:
+        bucket_seconds = max(1, window_seconds // QUOTA_BUCKETS)
+        first_date = datetime.fromtimestamp(time.time() - window_seconds, tz=timezone.utc)
+        buckets = connection.count_user_messages_by_bucket(user_id, first_date, bucket_seconds)
+        return SlidingWindowCounter(window_seconds, buckets)
+
+    def _counter(self, user_id: str, window_seconds: int) -> SlidingWindowCounter:
+        key = (user_id, window_seconds)
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter and time.time() - counter.synced_at < QUOTA_RESYNC_SECONDS:
+                self._counters.move_to_end(key)
+                return counter
+        # La consulta se hace fuera del lock
+        counter = self._load(user_id, window_seconds)
+        with self._lock:
+            self._counters[key] = counter
+            self._counters.move_to_end(key)
+            self._windows.setdefault(user_id, set()).add(window_seconds)
+            while len(self._counters) > self.max_counters:
+                (old_user, old_window), _ = self._counters.popitem(last=False)
+                windows = self._windows.get(old_user, set())
+                windows.discard(old_window)
+                if not windows:
+                    self._windows.pop(old_user, None)
+        return counter
+
+    def user_for_session(self, session_id: str) -> Optional[str]:
+        """Dueño de la sesión (cacheado; una sesión nunca cambia de usuario)."""
+        with self._lock:
+            user_id = self._session_users.get(session_id)
+        if user_id is None:
+            user_session = connection.get_session_user(session_id)
+            if user_session is None:
+                return None
+            user_id = user_session.user_id
+            with self._lock:
+                self._session_users[session_id] = user_id
+                while len(self._session_users) > self.max_counters:
+                    self._session_users.popitem(last=False)
+        return user_id
+
+    @staticmethod
+    def _status(user_id: str, interval: str, num_msg: int, total: int) -> dict:
+        msg_left = num_msg - total
+        return {
+            'user_id': user_id,
+            'interval': interval,
+            'num_msg': num_msg,
+            'total_msg': total,
+            'msg_left': msg_left,
+            'valid': msg_left > 0
+        }
+
+    def status(self, user_id: str, interval: str, num_msg: int) -> dict:
+        """Estado de la cuota del usuario para la ventana `interval`."""
+        window_seconds = int(get_interval(interval).total_seconds())
+        counter = self._counter(user_id, window_seconds)
+        with self._lock:
+            total = counter.count()
+        return self._status(user_id, interval, num_msg, total)
+
+    def _add(self, user_id: str, amount: int, extra: Optional[SlidingWindowCounter] = None) -> Reservation:
+        # Con el lock tomado: suma en todas las ventanas en memoria del usuario
+        now = time.time()
+        counters = [self._counters[(user_id, window_seconds)] for window_seconds in self._windows.get(user_id, ())]
+        if extra is not None and all(counter is not extra for counter in counters):
+            counters.append(extra)  # Desalojado entre la carga y el lock
+        for counter in counters:
+            counter.add(amount, now)
+        return Reservation(user_id, now, amount)
+
+    def record(self, user_id: str, amount: int = MESSAGES_PER_TURN) -> Reservation:
+        """Suma mensajes en todas las ventanas en memoria del usuario."""
+        with self._lock:
+            return self._add(user_id, amount)
+
+    def reserve(self, user_id: str, interval: str, num_msg: int, amount: int = MESSAGES_PER_TURN) -> Tuple[dict, Optional[Reservation]]:
+        """
+        Verifica la cuota y, si queda, suma el turno en la misma sección crítica.
+
+        Así dos turnos concurrentes del mismo usuario no pasan ambos la
+        verificación con el mismo total.
+
+        Returns:
+            tuple: (estado previo a la reserva, reserva o None si no había cuota).
+        """
+        window_seconds = int(get_interval(interval).total_seconds())
+        counter = self._counter(user_id, window_seconds)
+        with self._lock:
+            status = self._status(user_id, interval, num_msg, counter.count())
+            if not status['valid']:
+                return status, None
+            return status, self._add(user_id, amount, extra=counter)
+
+    def refund(self, reservation: Reservation) -> None:
+        """Devuelve una reserva de un turno que no se completó."""
+        with self._lock:
+            for window_seconds in self._windows.get(reservation.user_id, ()):
+                self._counters[(reservation.user_id, window_seconds)].remove(reservation.amount, reservation.at)
+
+
+tracker = QuotaTracker()
+
+
+def reserve_turn(session_id: str) -> Optional[Reservation]:
+    """
+    Reserva un turno en la cuota del dueño de la sesión antes de llamar al LLM.
+
+    La verificación y la suma son atómicas, así que turnos concurrentes del
+    mismo usuario no superan el límite. Si el turno falla hay que devolver la
+    reserva con `refund_turn`. Con la cuota desactivada solo cuenta el turno.
+
+    Returns:
+        Reservation: La reserva (None si la sesión no tiene dueño).
+
+    Raises:
+        QuotaExceeded: Si el usuario ya no tiene mensajes disponibles.
+    """
+    user_id = tracker.user_for_session(session_id)
+    if user_id is None:
+        return None
+    if QUOTA_MAX_MESSAGES <= 0:
+        return tracker.record(user_id)
+    status, reservation = tracker.reserve(user_id, QUOTA_INTERVAL, QUOTA_MAX_MESSAGES)
+    if reservation is None:
+        logger.info(f"Cuota excedida para {user_id}: {status}")
+        raise QuotaExceeded(status)
+    return reservation
+
+
+def refund_turn(reservation: Optional[Reservation]) -> None:
+    """Devuelve la reserva de un turno que falló (no hace nada con None)."""
+    if reservation is not None:
+        tracker.refund(reservation)
@@ -0,0 +1,222 @@
+import os
+import time
+import asyncio
+import threading
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
+from pydantic import ConfigDict
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_MAX_SIZE = int(os.environ.get("EMBEDDING_CACHE_MAX_SIZE", 5000))
+EMBEDDING_CACHE_TTL = int(os.environ.get("EMBEDDING_CACHE_TTL", 7 * 24 * 3600))
+RETRIEVAL_CACHE_MAX_SIZE = int(os.environ.get("RETRIEVAL_CACHE_MAX_SIZE", 2000))
+RETRIEVAL_CACHE_TTL = int(os.environ.get("RETRIEVAL_CACHE_TTL", 3600))
+
+# Opciones de búsqueda por defecto del retriever (se pueden cambiar por consulta)
+SEARCH_TYPES = ("vector", "bm25", "hybrid")
+# 'weaviate' (consulta Weaviate Cloud) o 'local' (réplica en memoria, ver local_index)
+RAG_BACKEND = os.environ.get("RAG_BACKEND", "weaviate").lower()
+RAG_SEARCH_TYPE = os.environ.get("RAG_SEARCH_TYPE", "vector").lower()
+RAG_K = int(os.environ.get("RAG_K", 3))
+RAG_ALPHA = float(os.environ.get("RAG_ALPHA", 0.5))
+RAG_SCORE_THRESHOLD = float(os.environ["RAG_SCORE_THRESHOLD"]) if os.environ.get("RAG_SCORE_THRESHOLD") else None
+
+
+class LRUTTLCache():
+    """Cache LRU acotado con expiración por TTL y contadores de aciertos."""
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, stored_at = item
+                if time.time() - stored_at <= self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = (value, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# Versión de la colección indexada; cambiarla invalida los resultados cacheados
+_collection_version = 0
+embedding_cache = LRUTTLCache(EMBEDDING_CACHE_MAX_SIZE, EMBEDDING_CACHE_TTL)
+retrieval_cache = LRUTTLCache(RETRIEVAL_CACHE_MAX_SIZE, RETRIEVAL_CACHE_TTL)
+
+
+def get_collection_version() -> int:
+    return _collection_version
+
+
+def bump_collection_version() -> int:
+    """Marca la colección como re-ingestada: los documentos cacheados dejan de ser válidos."""
+    global _collection_version
+    _collection_version += 1
+    retrieval_cache.clear()
+    logger.info(f"Versión de la colección RAG: {_collection_version}")
+    return _collection_version
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def get_cache_stats() -> dict:
+    return {
+        "collection_version": _collection_version,
+        "embeddings": embedding_cache.stats(),
+        "retrieval": retrieval_cache.stats(),
+    }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Envuelve un modelo de embeddings y cachea `embed_query` por texto normalizado.
+
+    Los embeddings de documentos (ingesta) no se cachean.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: LRUTTLCache = embedding_cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.embeddings.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.set(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            self.cache.set(key, vector)
+        return vector
+
+
+class CachedRetriever(BaseRetriever):
+    """
+    Retriever que cachea los documentos recuperados.
+
+    La clave es (embedding o texto de la consulta, opciones de búsqueda,
+    versión de la colección), así que una pregunta repetida no llama ni al
+    modelo de embeddings (ver `CachedEmbeddings`) ni a la base vectorial.
+
+    Las opciones (`k`, `search_type`, `alpha`, `filters`, `score_threshold`)
+    tienen valores por defecto en el retriever y se pueden cambiar por consulta:
+    `retriever.invoke(pregunta, k=5, search_type="bm25")`. Las subclases
+    implementan `_search` (ver `vector_backends.BackendRetriever`).
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    embeddings: Embeddings
+    k: int = RAG_K
+    search_type: str = "vector"
+    # Peso del vector en la búsqueda híbrida (0 = solo BM25, 1 = solo vector)
+    alpha: float = RAG_ALPHA
+    filters: Optional[Dict[str, Any]] = None
+    score_threshold: Optional[float] = RAG_SCORE_THRESHOLD
+
+    def _options(self, overrides: dict) -> dict:
+        options = {
+            "k": self.k,
+            "search_type": self.search_type,
+            "alpha": self.alpha,
+            "filters": self.filters,
+            "score_threshold": self.score_threshold,
+        }
+        options.update({key: value for key, value in overrides.items() if key in options and value is not None})
+        if options["search_type"] not in SEARCH_TYPES:
+            raise ValueError(f"search_type debe ser uno de {SEARCH_TYPES}, no '{options['search_type']}'.")
+        return options
+
+    def _cache_key(self, query: str, vector: Optional[List[float]], options: dict) -> str:
+        # El umbral se aplica después del cache: no forma parte de la clave
+        search = {key: value for key, value in options.items() if key != "score_threshold"}
+        digest = hashlib.sha1()
+        if vector is not None:
+            digest.update(json.dumps(vector).encode())
+        if options["search_type"] != "vector":
+            digest.update(normalize_query(query).encode())
+        digest.update(json.dumps(search, sort_keys=True, default=str).encode())
+        return f"{get_collection_version()}:{digest.hexdigest()}"
+
+    @staticmethod
+    def _apply_threshold(docs: List[Document], threshold: Optional[float]) -> List[Document]:
+        if threshold is None:
+            return docs
+        return [doc for doc in docs if doc.metadata.get("score") is None or doc.metadata["score"] >= threshold]
+
+    def _search(self, query: str, vector: Optional[List[float]], options: dict) -> List[Document]:
+        raise NotImplementedError
+
+    async def _asearch(self, query: str, vector: Optional[List[float]], options: dict) -> List[Document]:
+        return await asyncio.to_thread(self._search, query, vector, options)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun, **overrides) -> List[Document]:
+        options = self._options(overrides)
+        # BM25 no necesita embedding de la consulta
+        vector = self.embeddings.embed_query(query) if options["search_type"] != "bm25" else None
+        key = self._cache_key(query, vector, options)
+        docs = retrieval_cache.get(key)
+        if docs is None:
+            docs = self._search(query, vector, options)
+            retrieval_cache.set(key, docs)
+        return self._apply_threshold(docs, options["score_threshold"])
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun, **overrides) -> List[Document]:
+        options = self._options(overrides)
+        vector = await self.embeddings.aembed_query(query) if options["search_type"] != "bm25" else None
+        key = self._cache_key(query, vector, options)
+        docs = retrieval_cache.get(key)
+        if docs is None:
+            docs = await self._asearch(query, vector, options)
+            retrieval_cache.set(key, docs)
+        return self._apply_threshold(docs, options["score_threshold"])
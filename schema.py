@@ -1,11 +1,31 @@
-from pydantic import BaseModel
-from typing import List, Optional, Union, Literal
+from pydantic import BaseModel, Field, field_validator
+from typing import Any, Dict, List, Optional, Union, Literal
 from uuid import UUID
 from datetime import datetime
 
+class RetrievalOptions(BaseModel):
+    k: Optional[int] = Field(None, ge=1, le=20)
+    search_type: Optional[Literal["vector", "bm25", "hybrid"]] = None
+    alpha: Optional[float] = Field(None, ge=0, le=1)
+    filters: Optional[Dict[str, Any]] = None
+    score_threshold: Optional[float] = None
+
+    @field_validator("search_type")
+    @classmethod
+    def backend_supports_search_type(cls, search_type):
+        # 422 en lugar de un error dentro del backend (p. ej. alloydb solo soporta vector)
+        if search_type is not None:
+            from vector_backends import get_backend
+            get_backend().check_search_type(search_type)
+        return search_type
+
 class ChatRequest(BaseModel):
     session_id: str
     user_input: str
+    retrieval: Optional[RetrievalOptions] = None
+
+    def retrieval_options(self) -> Optional[dict]:
+        return self.retrieval.model_dump(exclude_none=True) if self.retrieval else None
 
 class ChatResponse(BaseModel):
     assistant_response: str
@@ -22,15 +42,20 @@ class Session(BaseModel):
 
 class SessionList(BaseModel):
     chats: List[Session]
+    next_cursor: Optional[str] = None
 
 
 class MessageUpdate(BaseModel):
     message_id: str
-    like: bool = True,
+    like: bool = True
     feedback: List[str]
     observations: Optional[str]
 
 
+class MessageUpdateBatch(BaseModel):
+    items: List[MessageUpdate] = Field(..., min_length=1, max_length=500)
+
+
 class NewSession(BaseModel):
     session_id: str
     user_id: str
@@ -47,6 +72,12 @@ class ConversationHistory(BaseModel):
     feedback: List[str]
     observations: str
 
+class HistoryPage(BaseModel):
+    messages: List[ConversationHistory]
+    before_cursor: Optional[str] = None
+    after_cursor: Optional[str] = None
+    has_more: bool
+
 class Message(MessageUpdate):
     created_at: datetime
 
@@ -0,0 +1,147 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Callable, Awaitable, List, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.95))
+SEMANTIC_CACHE_TTL = int(os.environ.get("SEMANTIC_CACHE_TTL", 24 * 3600))
+SEMANTIC_CACHE_MAX_SIZE = int(os.environ.get("SEMANTIC_CACHE_MAX_SIZE", 1000))
+# Mensajes de la sesión (incluida la pregunta actual) por debajo de los cuales se usa el cache
+SEMANTIC_CACHE_MAX_HISTORY = int(os.environ.get("SEMANTIC_CACHE_MAX_HISTORY", 1))
+
+
+class _Entry():
+    def __init__(self, question: str, vector: np.ndarray, answer: str):
+        self.question = question
+        self.vector = vector
+        self.answer = answer
+        self.created_at = time.time()
+        self.hits = 0
+
+
+class SemanticCache():
+    """
+    Cache de respuestas por similitud semántica de la pregunta.
+
+    Guarda (pregunta, embedding normalizado, respuesta) y devuelve la respuesta
+    de la pregunta más parecida si su similitud coseno supera `threshold`.
+    Las entradas expiran por TTL y se desalojan por LRU al superar `max_size`.
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[str], List[float]],
+        aembed_fn: Optional[Callable[[str], Awaitable[List[float]]]] = None,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl: int = SEMANTIC_CACHE_TTL,
+        max_size: int = SEMANTIC_CACHE_MAX_SIZE,
+    ):
+        self.embed_fn = embed_fn
+        self.aembed_fn = aembed_fn
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None
+        self._keys: List[str] = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        arr = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(arr)
+        return arr / norm if norm else arr
+
+    @staticmethod
+    def _key(question: str) -> str:
+        return " ".join(question.lower().split())
+
+    def _evict_expired(self, now: float) -> None:
+        expired = [k for k, e in self._entries.items() if now - e.created_at > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _search(self, vector: np.ndarray) -> Optional[_Entry]:
+        with self._lock:
+            self._evict_expired(time.time())
+            if not self._entries:
+                return None
+            if self._matrix is None:
+                self._keys = list(self._entries.keys())
+                self._matrix = np.stack([self._entries[k].vector for k in self._keys])
+            scores = self._matrix @ vector
+            best = int(np.argmax(scores))
+            score = float(scores[best])
+            if score < self.threshold:
+                return None
+            key = self._keys[best]
+            entry = self._entries[key]
+            entry.hits += 1
+            self._entries.move_to_end(key)
+            logger.info(f"Semantic cache hit ({score:.3f}): '{entry.question}' (hits={entry.hits})")
+            return entry
+
+    def _store(self, question: str, vector: np.ndarray, answer: str) -> None:
+        with self._lock:
+            self._entries[self._key(question)] = _Entry(question, vector, answer)
+            self._entries.move_to_end(self._key(question))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def _count(self, entry: Optional[_Entry]) -> Optional[str]:
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry.answer
+
+    def lookup(self, question: str) -> tuple:
+        """
+        Busca una respuesta para la pregunta.
+
+        Returns:
+            tuple: (respuesta o None, vector de la pregunta para `store`).
+        """
+        vector = self._normalize(self.embed_fn(question))
+        return self._count(self._search(vector)), vector
+
+    async def alookup(self, question: str) -> tuple:
+        """Versión async de `lookup`."""
+        if self.aembed_fn is None:
+            return self.lookup(question)
+        vector = self._normalize(await self.aembed_fn(question))
+        return self._count(self._search(vector)), vector
+
+    def store(self, question: str, vector: np.ndarray, answer: str) -> None:
+        """Guarda la respuesta generada para la pregunta."""
+        self._store(question, vector, answer)
+
+    def invalidate(self) -> None:
+        """Vacía el cache (p.ej. al re-ingestar la colección "Rag" de Weaviate)."""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+        logger.info("Semantic cache invalidado.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits, misses, size = self.hits, self.misses, len(self._entries)
+        total = hits + misses
+        return {
+            "size": size,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
@@ -0,0 +1,155 @@
+import os
+import sys
+import time
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# Duración (segundos) de cada paso de inicialización del último arranque
+startup_timings: Dict[str, float] = {}
+
+
+@contextmanager
+def timed(name: str):
+    """Registra la duración del bloque en `startup_timings`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - start
+        logger.info(f"Startup '{name}': {startup_timings[name] * 1000:.0f} ms")
+
+
+@asynccontextmanager
+async def atimed(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - start
+        logger.info(f"Startup '{name}': {startup_timings[name] * 1000:.0f} ms")
+
+
+def _timed_call(name: str, fn):
+    with timed(name):
+        return fn()
+
+
+def init_dependencies():
+    """
+    Inicializa los clientes externos (lo llama el lifespan de FastAPI).
+
+    Primero se cargan los secretos en paralelo, luego se crean los clientes
+    independientes en paralelo y por último se construyen las cadenas
+    (necesitan el backend vectorial y los LLMs) y se compila el grafo.
+
+    Weaviate solo se conecta si lo usa el backend: `weaviate` al abrirlo y
+    `local` en su sincronización en segundo plano (o al delegar en el
+    fallback), así que con `alloydb` no hacen falta sus credenciales.
+    """
+    import agent, chatbot, configs, models, postgres_db, vector_backends
+
+    with timed("total"):
+        # Un solo lote de RPCs en paralelo; el resto de clientes lee del cache
+        secret_envs = ["AGENT_SECRET_NAME", "DB_SECRET_NAME"]
+        if vector_backends.RAG_BACKEND == "weaviate":
+            secret_envs.append("WCD_CRED_SECRET_NAME")
+        _timed_call("secrets", lambda: configs.prefetch_secrets([os.environ.get(name) for name in secret_envs]))
+        independent = {
+            "agent_configs": agent.get_agent_configs,
+            "embeddings": agent.get_embeddings,
+            "db_pool": postgres_db.get_db_pool,
+            "db_engine": postgres_db.get_db_engine,
+        }
+        # weaviate: conecta el cliente; local: carga el snapshot de disco y sincroniza en segundo plano
+        independent["vector_backend"] = vector_backends.open_backend
+        with ThreadPoolExecutor(max_workers=len(independent)) as executor:
+            futures = [executor.submit(_timed_call, name, fn) for name, fn in independent.items()]
+            for future in futures:
+                future.result() # Propaga el primer error
+        # Sin el índice único de message_revision fallarían todas las reacciones
+        _timed_call("db_indexes", lambda: models.check_required_indexes(postgres_db.get_db_engine()))
+        _timed_call("agent_clients", agent.init_clients)
+        _timed_call("graph", chatbot.get_graph)
+
+    return dict(startup_timings)
+
+
+def import_report(module: str = "main", top: int = 25) -> List[dict]:
+    """
+    Tiempo de importación por módulo (`python -X importtime`), ordenado por tiempo acumulado.
+
+    Se ejecuta en un proceso aparte para medir un arranque en frío.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        rows.append({"module": name.strip(), "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+    rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+    return rows[:top]
+
+
+# Código que se ejecuta en un proceso aparte: bloquea sockets, Secret Manager y
+# conexiones de Postgres/Weaviate, importa `main` y reporta cualquier intento.
+_NO_NETWORK_CHECK = """
+import json, socket, sys
+attempts = []
+def _blocked(name):
+    def fn(*args, **kwargs):
+        attempts.append(name)
+        raise RuntimeError(f"network I/O during import: {name}")
+    return fn
+socket.socket.connect = _blocked("socket.connect")
+socket.create_connection = _blocked("socket.create_connection")
+socket.getaddrinfo = _blocked("socket.getaddrinfo")
+from google.cloud import secretmanager
+secretmanager.SecretManagerServiceClient.access_secret_version = _blocked("secretmanager.access_secret_version")
+import psycopg
+psycopg.Connection.connect = _blocked("psycopg.connect")
+import weaviate
+weaviate.connect_to_weaviate_cloud = _blocked("weaviate.connect_to_weaviate_cloud")
+error = None
+try:
+    import main
+except Exception as e:
+    error = repr(e)
+print(json.dumps({"attempts": attempts, "error": error}))
+"""
+
+
+def import_network_report(module: str = "main") -> dict:
+    """
+    Importa `module` en un proceso aparte con la red bloqueada.
+
+    Returns:
+        dict: `attempts` con los intentos de I/O de red y `error` con la
+        excepción de la importación (None si importó bien).
+    """
+    import json
+    result = subprocess.run(
+        [sys.executable, "-c", _NO_NETWORK_CHECK.replace("import main", f"import {module}")],
+        capture_output=True,
+        text=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    import json
+    if len(sys.argv) > 1 and sys.argv[1] == "imports":
+        print(json.dumps(import_report(), indent=2))
+    else:
+        report = import_network_report()
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if report["attempts"] or report["error"] else 0)
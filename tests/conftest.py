@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+# Los módulos del servicio viven en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def live_db():
+    """Los tests que usan la base configurada solo corren con RUN_DB_TESTS=true."""
+    if os.environ.get("RUN_DB_TESTS", "false").lower() != "true":
+        pytest.skip("requiere RUN_DB_TESTS=true y la base configurada")
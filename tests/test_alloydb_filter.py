@@ -0,0 +1,18 @@
+import pytest
+
+document = pytest.importorskip("document")
+
+
+def test_no_filters():
+    assert document.build_filter(None) == ("", {})
+
+
+def test_values_are_bound_parameters():
+    condition, params = document.build_filter({"source": "x' OR '1'='1", "page": [1, 2], "draft": False})
+    assert "x' OR" not in condition
+    assert "page" not in condition and "source" not in condition
+    assert params == {
+        "filter_key_0": "source", "filter_value_0": "x' OR '1'='1",
+        "filter_key_1": "page", "filter_value_1": ["1", "2"],
+        "filter_key_2": "draft", "filter_value_2": "false",
+    }
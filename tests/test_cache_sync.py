@@ -0,0 +1,42 @@
+import pytest
+
+cache_sync = pytest.importorskip("cache_sync")
+connection = pytest.importorskip("connection")
+agent = pytest.importorskip("agent")
+
+
+@pytest.fixture
+def shared(monkeypatch):
+    """Versión compartida en memoria en lugar de la tabla rag_cache_version."""
+    state = {"version": 0, "invalidations": 0}
+
+    def bump():
+        state["version"] += 1
+        return state["version"]
+
+    def invalidate():
+        state["invalidations"] += 1
+
+    monkeypatch.setattr(connection, "get_rag_cache_version", lambda: state["version"])
+    monkeypatch.setattr(connection, "bump_rag_cache_version", bump)
+    monkeypatch.setattr(agent, "invalidate_rag_caches", invalidate)
+    return state
+
+
+def test_other_workers_invalidate_when_the_shared_version_changes(shared):
+    publisher, worker = cache_sync.CacheVersionWatcher(), cache_sync.CacheVersionWatcher()
+    assert not worker.check_once()  # Primera lectura: solo registra la versión
+
+    assert publisher.publish() == 1
+    assert shared["invalidations"] == 1  # El que publica se invalida de inmediato
+
+    assert worker.check_once()
+    assert shared["invalidations"] == 2
+    assert not worker.check_once()  # Sin cambios, no vuelve a invalidar
+    assert not publisher.check_once()  # Ya conoce su propia versión
+
+
+def test_interval_zero_does_not_start(shared):
+    watcher = cache_sync.CacheVersionWatcher(interval=0)
+    watcher.start()
+    assert watcher._thread is None
@@ -0,0 +1,167 @@
+import asyncio
+import threading
+
+import pytest
+
+chatbot = pytest.importorskip("chatbot")
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph import END, START, StateGraph
+
+from chatbot_schemas import State
+
+RETRIEVAL = {"k": 7, "search_type": "hybrid", "filters": {"source": "manual.pdf"}, "score_threshold": None}
+
+
+class FakeRetriever:
+    def __init__(self):
+        self.calls = []
+        self.chain_inputs = []
+
+    def invoke(self, query, **options):
+        self.calls.append(options)
+        return [Document(page_content="doc", metadata={})]
+
+    async def ainvoke(self, query, **options):
+        return self.invoke(query, **options)
+
+
+@pytest.fixture
+def rag(monkeypatch):
+    """Cadena RAG falsa que recupera con el config que recibe, como la real."""
+    retriever = FakeRetriever()
+
+    def chain(chain_input, config):
+        retriever.chain_inputs.append(chain_input)
+        chatbot.agent.get_info_to_docs(chain_input, config)
+        return chatbot.agent.AIMessage(content="respuesta", id="chatbot_1")
+
+    async def achain(chain_input, config):
+        retriever.chain_inputs.append(chain_input)
+        await chatbot.agent.aget_info_to_docs(chain_input, config)
+        return chatbot.agent.AIMessage(content="respuesta", id="chatbot_1")
+
+    monkeypatch.setattr(chatbot.agent, "get_retriever", lambda: retriever)
+    monkeypatch.setattr(chatbot.agent, "get_chain_with_history", lambda: RunnableLambda(chain))
+    monkeypatch.setattr(chatbot.agent, "get_achain_with_history", lambda: RunnableLambda(achain))
+    monkeypatch.setattr(chatbot, "HISTORY_IS_AUTHORITATIVE", False)
+    return retriever
+
+
+def graph():
+    builder = StateGraph(State)
+    builder.add_node("chatbot", RunnableLambda(chatbot.chatbot_node, afunc=chatbot.achatbot_node))
+    builder.add_edge(START, "chatbot")
+    builder.add_edge("chatbot", END)
+    return builder.compile()
+
+
+def test_retrieval_options_reach_the_retriever(rag):
+    config, message = chatbot._build_turn_input("¿Qué es el CAC?", "s1", RETRIEVAL)
+    graph().invoke({"messages": [message]}, config)
+    assert rag.calls == [{"k": 7, "search_type": "hybrid", "filters": {"source": "manual.pdf"}}]
+
+
+def test_retrieval_options_reach_the_retriever_async(rag):
+    config, message = chatbot._build_turn_input("¿Qué es el CAC?", "s1", RETRIEVAL)
+    asyncio.run(graph().ainvoke({"messages": [message]}, config))
+    assert rag.calls == [{"k": 7, "search_type": "hybrid", "filters": {"source": "manual.pdf"}}]
+
+
+def test_session_id_is_merged_into_configurable():
+    _, message = chatbot._build_turn_input("hola", "s1")
+    config = {"configurable": {"thread_id": "s1", "retrieval": {"k": 2}}, "tags": ["t"]}
+    _, chain_config, _ = chatbot._chatbot_node_input({"messages": [message]}, config)
+    assert chain_config["configurable"] == {"thread_id": "s1", "retrieval": {"k": 2}, "session_id": "s1"}
+    assert chain_config["tags"] == ["t"]
+
+
+def test_answer_cache_is_skipped_with_retrieval_options(monkeypatch):
+    monkeypatch.setattr(chatbot, "SEMANTIC_CACHE_ENABLED", True)
+    _, message = chatbot._build_turn_input("hola", "s1")
+    state = {"messages": [message]}
+    assert chatbot._use_answer_cache(state, config={"configurable": {}})
+    assert not chatbot._use_answer_cache(state, config={"configurable": {"retrieval": {"filters": {"source": "a"}}}})
+
+
+class SlowRetriever(FakeRetriever):
+    """Retriever que no termina hasta que lo libera el análisis de fórmulas."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+        self.finished = threading.Event()
+
+    def invoke(self, query, **options):
+        self.release.wait(timeout=5)
+        result = super().invoke(query, **options)
+        self.finished.set()
+        return result
+
+    async def ainvoke(self, query, **options):
+        return await asyncio.to_thread(self.invoke, query, **options)
+
+
+@pytest.fixture
+def slow_rag(rag, monkeypatch):
+    retriever = SlowRetriever()
+    retriever.chain_inputs = rag.chain_inputs
+    monkeypatch.setattr(chatbot.agent, "get_retriever", lambda: retriever)
+    monkeypatch.setattr(chatbot, "SEMANTIC_CACHE_ENABLED", False)
+    return retriever
+
+
+def speculative_graph(retriever, overlapped):
+    """Router -> analyze_formulas -> chatbot, con la recuperación lanzada desde START como en `builder`."""
+    def analyze_formulas(state):
+        # Si la recuperación retuviera el super-step del router, ya habría terminado
+        overlapped.append(not retriever.finished.is_set())
+        retriever.release.set()
+        return {}
+
+    builder = StateGraph(State)
+    builder.add_node("router", lambda state: {"decision": "formula"})
+    builder.add_node("retrieve", RunnableLambda(chatbot.retrieve_node, afunc=chatbot.aretrieve_node))
+    builder.add_node("analyze_formulas", analyze_formulas)
+    builder.add_node("chatbot", RunnableLambda(chatbot.chatbot_node, afunc=chatbot.achatbot_node))
+    builder.add_edge(START, "router")
+    builder.add_edge(START, "retrieve")
+    builder.add_edge("retrieve", END)
+    builder.add_edge("router", "analyze_formulas")
+    builder.add_edge("analyze_formulas", "chatbot")
+    builder.add_edge("chatbot", END)
+    return builder.compile()
+
+
+def test_formula_analysis_overlaps_retrieval(slow_rag):
+    overlapped = []
+    config, message = chatbot._build_turn_input("calcula el CAC", "s1", RETRIEVAL)
+
+    speculative_graph(slow_rag, overlapped).invoke({"messages": [message]}, config)
+
+    assert overlapped == [True]
+    # La cadena recibe el contexto ya recuperado (con las opciones del turno) y no vuelve a buscar
+    assert slow_rag.calls == [{"k": 7, "search_type": "hybrid", "filters": {"source": "manual.pdf"}}]
+    assert slow_rag.chain_inputs[0].get("context") is not None
+    assert message.id not in chatbot._prefetches
+
+
+def test_formula_analysis_overlaps_retrieval_async(slow_rag):
+    overlapped = []
+    config, message = chatbot._build_turn_input("calcula el CAC", "s1", RETRIEVAL)
+
+    asyncio.run(speculative_graph(slow_rag, overlapped).ainvoke({"messages": [message]}, config))
+
+    assert overlapped == [True]
+    assert len(slow_rag.calls) == 1
+    assert slow_rag.chain_inputs[0].get("context") is not None
+    assert message.id not in chatbot._prefetches
+
+
+def test_failed_prefetch_falls_back_to_chain_retrieval(monkeypatch):
+    _, message = chatbot._build_turn_input("hola", "s1")
+    monkeypatch.setattr(chatbot.agent, "get_info_to_docs", lambda info, config=None: 1 / 0)
+    failed = chatbot._prefetch_executor.submit(chatbot._prefetch_context, message, None)
+
+    assert chatbot._prefetched_context(failed) is None
+    assert chatbot._prefetched_context(None) is None
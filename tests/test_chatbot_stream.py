@@ -0,0 +1,21 @@
+import pytest
+
+chatbot = pytest.importorskip("chatbot")
+
+
+@pytest.mark.parametrize("node_output", [None, {}])
+def test_empty_node_update_is_pass(node_output):
+    # calculation_node devuelve {} sin fórmulas a calcular; LangGraph lo emite como None
+    event = chatbot._format_node_output("calculate", node_output)
+    assert event["event_value"] == "pass"
+
+
+def test_retrieve_node_update_is_pass():
+    # El contexto se recupera en segundo plano y nunca pasa por el estado ni llega al cliente
+    event = chatbot._format_node_output("retrieve", {})
+    assert event["event_value"] == "pass"
+
+
+def test_decision_event():
+    event = chatbot._format_node_output("router", {"decision": "formula"})
+    assert event["decision"] == "formula"
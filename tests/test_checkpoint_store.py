@@ -0,0 +1,85 @@
+import uuid
+
+import pytest
+
+checkpoint_store = pytest.importorskip("checkpoint_store")
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.postgres import PostgresSaver
+
+
+def config(thread_id, checkpoint_id=None):
+    configurable = {"thread_id": thread_id, "checkpoint_ns": ""}
+    if checkpoint_id:
+        configurable["checkpoint_id"] = checkpoint_id
+    return {"configurable": configurable}
+
+
+def checkpoint(checkpoint_id):
+    return {**empty_checkpoint(), "id": checkpoint_id}
+
+
+@pytest.fixture
+def saver(monkeypatch):
+    """Saver en modo turno con las escrituras a Postgres registradas en memoria."""
+    saver = checkpoint_store.TurnPostgresSaver(object(), turn_only=True, keep_last=2)
+    saver.written, saver.pruned = [], []
+    monkeypatch.setattr(PostgresSaver, "put", lambda self, *args: self.written.append(args))
+    monkeypatch.setattr(PostgresSaver, "put_writes", lambda self, *args, **kwargs: pytest.fail("put_writes en modo turno"))
+    monkeypatch.setattr(checkpoint_store.TurnPostgresSaver, "prune", lambda self, *args: self.pruned.append(args))
+    return saver
+
+
+def test_turn_only_writes_the_last_checkpoint_with_all_versions(saver):
+    parent = config("t", "c0")
+    saver.put(parent, checkpoint("c1"), {"step": 1}, {"messages": "v1"})
+    next_config = saver.put(config("t", "c1"), checkpoint("c2"), {"step": 2}, {"decision": "v2"})
+    saver.put_writes(next_config, [("messages", "x")], "task")
+    assert saver.written == []
+    assert next_config["configurable"]["checkpoint_id"] == "c2"
+
+    saver.end_turn("t")
+    [(written_config, written, metadata, versions)] = saver.written
+    assert written_config == parent # El padre es el último checkpoint persistido
+    assert written["id"] == "c2" and metadata == {"step": 2}
+    assert versions == {"messages": "v1", "decision": "v2"}
+    assert saver.pruned == [("t", 2, "")]
+
+
+def test_end_turn_only_flushes_its_thread(saver):
+    saver.put(config("a"), checkpoint("a1"), {}, {})
+    saver.put(config("b"), checkpoint("b1"), {}, {})
+    saver.end_turn("a")
+    assert [args[1]["id"] for args in saver.written] == ["a1"]
+    assert len(saver._buffer) == 1
+
+
+def test_keep_last_zero_does_not_prune(saver):
+    saver.keep_last = 0
+    saver.put(config("t"), checkpoint("c1"), {}, {})
+    saver.end_turn("t")
+    assert saver.pruned == []
+
+
+def test_prune_keeps_the_latest_checkpoints(live_db):
+    from langgraph.checkpoint.base.id import uuid6
+    from postgres_db import get_db_pool
+
+    saver = checkpoint_store.TurnPostgresSaver(get_db_pool(), turn_only=False, keep_last=0)
+    saver.setup()
+    thread_id = f"test-{uuid.uuid4()}"
+    current = config(thread_id)
+    try:
+        for step in range(5):
+            # uuid6: el orden de los ids es el cronológico, como en LangGraph
+            new = {
+                **checkpoint(str(uuid6(clock_seq=step))),
+                "channel_values": {"messages": [step]},
+                "channel_versions": {"messages": str(step)},
+            }
+            current = saver.put(current, new, {"step": step}, {"messages": str(step)})
+        saver.prune(thread_id, 2)
+        remaining = [item.metadata["step"] for item in saver.list(config(thread_id))]
+        assert remaining == [4, 3]
+        assert saver.get_tuple(config(thread_id)).checkpoint["channel_values"]["messages"] == [4]
+    finally:
+        saver.delete_thread(thread_id)
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+chatbot = pytest.importorskip("chatbot")
+from langchain_core.exceptions import OutputParserException
+from langchain_core.runnables import RunnableLambda
+
+from chatbot_schemas import FormulaInfo, RouterWithFormulas
+
+CAC = FormulaInfo(key="CAC", name="Costo de Adquisición de Clientes",
+                  params_required=["costo_marketing", "clientes_nuevos"], is_calculated=True)
+
+FALLBACK = {"decision": "chatbot", "analyzed_formulas": []}
+
+
+class FakeStructuredLLM():
+    """LLM estructurado falso: devuelve (o lanza) `output` y registra los prompts."""
+
+    def __init__(self, output):
+        self.output = output
+        self.prompts = []
+        self.schemas = []
+
+    def with_structured_output(self, schema):
+        self.schemas.append(schema)
+        return RunnableLambda(self._respond)
+
+    def _respond(self, prompt):
+        self.prompts.append(prompt.to_string())
+        if isinstance(self.output, Exception):
+            raise self.output
+        return self.output
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    def install(output):
+        fake = FakeStructuredLLM(output)
+        monkeypatch.setattr(chatbot.agent, "get_llm_structured", lambda: fake)
+        return fake
+    return install
+
+
+def state(question):
+    _, message = chatbot._build_turn_input(question, "s1")
+    return {"messages": [message]}
+
+
+def route(question, run_async):
+    if run_async:
+        return asyncio.run(chatbot.aroute_and_analyze_node(state(question)))
+    return chatbot.route_and_analyze_node(state(question))
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_formula_outcome_keeps_analyzed_formulas(llm, run_async):
+    fake = llm(RouterWithFormulas(decision="formula", formulas=[CAC]))
+
+    result = route("¿Cuánto me cuesta cada cliente si gasté 500 y conseguí 10?", run_async)
+
+    assert result == {"decision": "formula", "analyzed_formulas": [CAC]}
+    assert fake.schemas == [RouterWithFormulas]
+    assert "gasté 500" in fake.prompts[0]
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_chatbot_outcome_drops_formulas(llm, run_async):
+    fake = llm(RouterWithFormulas(decision="chatbot", formulas=[CAC]))
+
+    result = route("¿Cómo consigo mis primeros inversionistas?", run_async)
+
+    assert result == FALLBACK
+    assert len(fake.prompts) == 1
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+@pytest.mark.parametrize("output", [
+    None,
+    {"decision": "formula", "formulas": []},
+    OutputParserException("json inválido"),
+    ValueError("respuesta vacía"),
+])
+def test_missing_or_malformed_output_falls_back_to_chatbot(llm, run_async, output):
+    llm(output)
+
+    assert route("¿Cuánto me cuesta cada cliente si gasté 500 y conseguí 10?", run_async) == FALLBACK
+
+
+@pytest.mark.parametrize("run_async", [False, True])
+def test_smalltalk_skips_the_llm(llm, run_async):
+    fake = llm(RouterWithFormulas(decision="formula", formulas=[CAC]))
+
+    assert route("Hola", run_async) == FALLBACK
+    assert fake.prompts == []
+
+
+def test_no_human_message_falls_back(llm):
+    fake = llm(RouterWithFormulas(decision="formula", formulas=[CAC]))
+
+    assert chatbot.route_and_analyze_node({"messages": []}) == FALLBACK
+    assert fake.prompts == []
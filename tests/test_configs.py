@@ -0,0 +1,144 @@
+import json
+import threading
+import time
+
+import pytest
+
+import configs
+
+
+def _store(monkeypatch, value, ttl=60):
+    monkeypatch.setenv("SECRET_DB", json.dumps(value))
+    return configs.SecretStore(configs.LocalSecretProvider(path="missing.json"), ttl=ttl)
+
+
+def test_secret_is_cached_until_ttl(monkeypatch):
+    store = _store(monkeypatch, {"POSTGRES_PASSWORD": "a"})
+    assert store.get("db") == {"POSTGRES_PASSWORD": "a"}
+    monkeypatch.setenv("SECRET_DB", json.dumps({"POSTGRES_PASSWORD": "b"}))
+    assert store.get("db") == {"POSTGRES_PASSWORD": "a"}
+
+
+class FlakyProvider:
+    def __init__(self, value):
+        self.value = value
+        self.error = None
+        self.loads = 0
+
+    def load(self, secret_name):
+        self.loads += 1
+        if self.error:
+            raise self.error
+        return self.value
+
+
+def test_rotation_notifies_listeners(monkeypatch):
+    store = _store(monkeypatch, {"POSTGRES_PASSWORD": "a"})
+    changes = []
+    store.on_change("db", changes.append)
+    store.get("db")
+    assert changes == []  # La primera lectura no es una rotación
+
+    store.refresh("db")
+    assert changes == []  # Mismo valor
+
+    monkeypatch.setenv("SECRET_DB", json.dumps({"POSTGRES_PASSWORD": "b"}))
+    assert store.refresh("db") == {"POSTGRES_PASSWORD": "b"}
+    assert store.get("db") == {"POSTGRES_PASSWORD": "b"}
+    assert changes == [{"POSTGRES_PASSWORD": "b"}]
+
+
+def test_expired_secret_is_served_while_refreshing_in_background():
+    provider = FlakyProvider({"v": 1})
+    store = configs.SecretStore(provider, ttl=60)
+    store.get("db")
+    provider.value = {"v": 2}
+    store.invalidate("db")
+
+    assert store.get("db") == {"v": 1}  # No espera la relectura
+    for thread in [t for t in threading.enumerate() if t.name == "secret-refresh-db"]:
+        thread.join(timeout=5)
+    assert store.get("db") == {"v": 2}
+
+
+def test_failed_refresh_keeps_the_cached_value():
+    provider = FlakyProvider({"v": 1})
+    store = configs.SecretStore(provider, ttl=60, retry_delay=30)
+    store.get("db")
+    provider.error = RuntimeError("Secret Manager caído")
+
+    assert store.refresh("db") == {"v": 1}
+    assert store.get("db") == {"v": 1}
+    assert store.refresh_errors == 1
+    # Se reintenta tras retry_delay, no en cada lectura
+    assert store._cache["db"][1] - time.time() <= 30
+
+
+def test_first_load_failure_raises():
+    provider = FlakyProvider({"v": 1})
+    provider.error = RuntimeError("Secret Manager caído")
+    with pytest.raises(RuntimeError):
+        configs.SecretStore(provider).get("db")
+
+
+def test_refresh_expired_only_rereads_expired_secrets():
+    provider = FlakyProvider({"v": 1})
+    store = configs.SecretStore(provider, ttl=60)
+    store.get("a")
+    store.get("b")
+    store.invalidate("a")
+    store.refresh_expired()
+    assert provider.loads == 3
+
+
+def test_failing_listener_does_not_break_reads(monkeypatch):
+    store = _store(monkeypatch, {"POSTGRES_PASSWORD": "a"})
+    store.get("db")
+
+    def fail(value):
+        raise RuntimeError("boom")
+
+    store.on_change("db", fail)
+    monkeypatch.setenv("SECRET_DB", json.dumps({"POSTGRES_PASSWORD": "b"}))
+    assert store.refresh("db") == {"POSTGRES_PASSWORD": "b"}
+    assert store.get("db") == {"POSTGRES_PASSWORD": "b"}
+
+
+def test_agent_clients_rebuilt_after_rotation(monkeypatch):
+    agent = pytest.importorskip("agent")
+    store = _store(monkeypatch, {"GOOGLE_API_KEY": "k1", "MODEL_NAME": "m1"})
+    monkeypatch.setenv("AGENT_SECRET_NAME", "db")
+    monkeypatch.setattr(agent, "get_secret", store.get)
+    store.on_change("db", agent._on_agent_secret_change)
+    monkeypatch.setattr(agent, "_clients", {})
+
+    assert agent.get_model_name() == "m1"
+    monkeypatch.setenv("SECRET_DB", json.dumps({"GOOGLE_API_KEY": "k2", "MODEL_NAME": "m2"}))
+    assert agent.get_model_name() == "m1"  # Leído una vez, sin releer el secreto
+    store.refresh("db")
+    assert agent.get_model_name() == "m2"
+
+
+def test_db_pools_and_engine_follow_rotation(monkeypatch):
+    postgres_db = pytest.importorskip("postgres_db")
+
+    class FakePool:
+        conninfo = "old"
+
+    class FakeEngine:
+        disposed = False
+
+        def dispose(self):
+            self.disposed = True
+
+    pool, engine = FakePool(), FakeEngine()
+    monkeypatch.setattr(postgres_db, "_db_pool", pool)
+    monkeypatch.setattr(postgres_db, "_async_db_pool", None)
+    monkeypatch.setattr(postgres_db, "_engine", engine)
+    monkeypatch.setattr(postgres_db, "get_db_uri", lambda: "postgresql://new")
+    monkeypatch.setattr(postgres_db, "_table_name", "chat_history")
+
+    postgres_db._on_db_secret_change({"TABLE_HISTORY_NAME": "chat_history_v2"})
+    assert pool.conninfo == "postgresql://new"
+    assert postgres_db.get_table_name() == "chat_history_v2"
+    assert engine.disposed and postgres_db._engine is None
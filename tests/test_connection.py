@@ -0,0 +1,51 @@
+import uuid
+
+import pytest
+
+connection = pytest.importorskip("connection")
+
+
+def revision(message_id, **values):
+    return {"message_id": message_id, "feedback": [], "observations": "", **values}
+
+
+def stored(message_ids):
+    return {row.message_id: row for row in connection.get_message_revision(message_ids)}
+
+
+def test_upsert_keeps_last_item_per_message(live_db):
+    a, b = str(uuid.uuid4()), str(uuid.uuid4())
+
+    revisions = connection.upsert_message_revisions([
+        revision(a, like=True, feedback=["útil"]),
+        revision(b, like=True),
+        revision(a, like=False, feedback=["incorrecto"], observations="la fórmula está mal"),
+    ])
+
+    # Un solo registro por mensaje, con el último valor del lote
+    assert sorted(row.message_id for row in revisions) == sorted([a, b])
+    rows = stored([a, b])
+    assert (rows[a].like, rows[a].feedback, rows[a].observations) == (False, ["incorrecto"], "la fórmula está mal")
+    assert rows[b].like is True
+
+
+def test_upsert_conflict_updates_only_given_columns(live_db):
+    a, b = str(uuid.uuid4()), str(uuid.uuid4())
+    connection.upsert_message_revisions([revision(a, like=False, feedback=["lento"])])
+    first = stored([a])[a]
+
+    # Sin `like` en el lote: el conflicto actualiza el resto y conserva el valor guardado
+    revisions = connection.upsert_message_revisions([
+        revision(a, feedback=["lento", "incompleto"], observations="faltó el ltv"),
+        revision(b, feedback=[]),
+    ])
+
+    rows = stored([a, b])
+    assert len(revisions) == 2
+    assert rows[a].id == first.id
+    assert rows[a].like is False
+    assert rows[a].feedback == ["lento", "incompleto"]
+    assert rows[a].observations == "faltó el ltv"
+    assert rows[a].created_at == first.created_at
+    # Un mensaje nuevo toma el valor por defecto de la columna
+    assert rows[b].like is True
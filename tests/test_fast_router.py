@@ -0,0 +1,42 @@
+import pytest
+
+fast_router = pytest.importorskip("fast_router")
+
+THRESHOLD = 0.8
+
+
+@pytest.mark.parametrize("question", [
+    "¿Qué es el CAC?",
+    "Calcula mi ROI si gané 5000 e invertí 2000",
+    "cómo calculo el runway",
+    "Tengo 300 usuarios activos y 9000 de ingresos totales, ¿cuál es mi ARPU?",
+])
+def test_formula_questions_skip_the_llm(question):
+    assert fast_router.fast_route(question, THRESHOLD) == "formula"
+
+
+@pytest.mark.parametrize("question", ["Hola", "Gracias Niilo!", "hola, ¿cómo estás?", "muchas gracias"])
+def test_smalltalk_skips_the_llm(question):
+    assert fast_router.fast_route(question, THRESHOLD) == "chatbot"
+
+
+@pytest.mark.parametrize("question", [
+    "ticket promedio si vendí 100",
+    "¿Cómo consigo mis primeros inversionistas?",
+    "Dame ideas para validar mi producto",
+    "explica qué es una ronda semilla",
+])
+def test_questions_without_clear_signals_go_to_the_llm(question):
+    assert fast_router.classify(question).confidence < THRESHOLD
+    assert fast_router.fast_route(question, THRESHOLD) is None
+
+
+def test_accuracy_report_counts_only_local_decisions():
+    fast_router_eval = pytest.importorskip("fast_router_eval")
+    report = fast_router_eval.accuracy_report(
+        [("¿Qué es el CAC?", "formula"), ("Hola", "formula"), ("ticket promedio si vendí 100", "formula")],
+        THRESHOLD,
+    )
+    assert report["coverage"] == pytest.approx(2 / 3)
+    assert report["accuracy"] == 0.5
+    assert [error["question"] for error in report["errors"]] == ["Hola"]
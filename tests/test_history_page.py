@@ -0,0 +1,73 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+chatbot = pytest.importorskip("chatbot")
+
+CREATED_AT = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def row(row_id):
+    kind = "human" if row_id % 2 else "ai"
+    message = {"type": kind, "data": {"content": f"m{row_id}", "id": f"{kind}_{row_id}", "type": kind}}
+    return SimpleNamespace(id=row_id, message=message, created_at=CREATED_AT, user_id="u",
+                           like=None, feedback=None, observations=None)
+
+
+@pytest.fixture
+def history(monkeypatch):
+    # Ids con huecos, como en una tabla compartida entre sesiones
+    rows = [row(row_id) for row_id in (3, 4, 7, 8, 9, 12, 15)]
+
+    def get_chat_history_page(session_id, limit, before=None, after=None):
+        if after is not None:
+            page = [r for r in rows if r.id > after]
+        else:
+            page = [r for r in rows if before is None or r.id < before][::-1]
+        return page[:limit + 1]
+
+    monkeypatch.setattr(chatbot.connection, "get_chat_history_page", get_chat_history_page)
+    return rows
+
+
+def contents(page):
+    return [message["content"] for message in page["messages"]]
+
+
+def test_first_page_is_the_latest_messages_in_order(history):
+    page = chatbot.get_history_page("s", limit=3)
+    assert contents(page) == ["m9", "m12", "m15"]
+    assert page["has_more"] is True
+
+
+def test_paging_back_and_forward(history):
+    seen, page = [], chatbot.get_history_page("s", limit=3)
+    while True:
+        seen = contents(page) + seen
+        if not page["has_more"]:
+            break
+        page = chatbot.get_history_page("s", limit=3, before=page["before_cursor"])
+    assert seen == [f"m{i}" for i in (3, 4, 7, 8, 9, 12, 15)]
+
+    forward = chatbot.get_history_page("s", limit=4, after=page["before_cursor"])
+    assert contents(forward) == ["m4", "m7", "m8", "m9"]
+    assert forward["has_more"] is True
+
+
+def test_page_defaults_for_missing_revisions(history):
+    message = chatbot.get_history_page("s", limit=1)["messages"][0]
+    assert (message["like"], message["feedback"], message["observations"]) == (False, [], "")
+    assert message["type"] == "human" and message["message_id"] == "human_15"
+
+
+def test_before_and_after_together_are_rejected(history):
+    cursor = chatbot._encode_message_cursor(9)
+    with pytest.raises(ValueError):
+        chatbot.get_history_page("s", before=cursor, after=cursor)
+
+
+@pytest.mark.parametrize("cursor", ["no-es-base64", chatbot._encode_session_cursor(CREATED_AT, 1)])
+def test_invalid_message_cursor(history, cursor):
+    with pytest.raises(ValueError):
+        chatbot.get_history_page("s", before=cursor)
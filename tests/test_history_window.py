@@ -0,0 +1,181 @@
+import sys
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+history_window = pytest.importorskip("history_window")
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, message_to_dict
+from langchain_core.runnables import RunnableLambda
+
+
+def conversation(turns, size=10):
+    """`turns` turnos de pregunta y respuesta con contenido de `size` caracteres."""
+    messages = []
+    for i in range(turns):
+        messages.append(HumanMessage(content=f"p{i}".ljust(size, ".")))
+        messages.append(AIMessage(content=f"r{i}".ljust(size, ".")))
+    return messages
+
+
+class FakeStore():
+    """Historial y resumen de una sesión en memoria, con las reglas de `connection`."""
+
+    def __init__(self):
+        self.rows = []
+        self.summary = None
+        self.saved = []
+
+    def add(self, messages):
+        for message in messages:
+            self.rows.append(SimpleNamespace(id=len(self.rows) + 1, message=message_to_dict(message)))
+
+    def get_chat_summary(self, session_id):
+        return self.summary
+
+    def get_chat_history_after(self, session_id, after_id=0):
+        return [row for row in self.rows if row.id > after_id]
+
+    def save_chat_summary(self, session_id, summary, summarized_until):
+        self.saved.append(summarized_until)
+        # Igual que el ON CONFLICT de la base: solo avanza
+        if self.summary is None or self.summary.summarized_until < summarized_until:
+            self.summary = SimpleNamespace(summary=summary, summarized_until=summarized_until)
+
+
+class FakeSummarizer():
+    """LLM de resumen: registra lo que recibe y devuelve un resumen numerado."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, prompt):
+        self.calls.append(prompt.to_string())
+        return AIMessage(content=f"resumen {len(self.calls)}")
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FakeStore()
+    for name in ("get_chat_summary", "get_chat_history_after", "save_chat_summary"):
+        monkeypatch.setattr(history_window.connection, name, getattr(store, name))
+    return store
+
+
+@pytest.fixture
+def summarizer(monkeypatch):
+    summarizer = FakeSummarizer()
+    fake_agent = SimpleNamespace(get_llm_structured=lambda: RunnableLambda(summarizer))
+    monkeypatch.setitem(sys.modules, "agent", fake_agent)
+    return summarizer
+
+
+# --- window_start ---
+
+def test_window_keeps_last_turns():
+    messages = conversation(5)
+
+    start = history_window.window_start(messages, max_turns=2, max_tokens=0)
+
+    assert start == 6
+    assert [m.content[:2] for m in messages[start:]] == ["p3", "r3", "p4", "r4"]
+
+
+def test_window_respects_token_budget():
+    messages = conversation(5, size=40)
+    per_message = history_window.estimate_tokens(messages[0])
+
+    # Caben tres mensajes: la ventana empieza en la última pregunta completa
+    start = history_window.window_start(messages, max_turns=10, max_tokens=3 * per_message)
+
+    assert start == 8
+    assert isinstance(messages[start], HumanMessage)
+
+
+def test_window_is_empty_when_last_turn_exceeds_budget():
+    messages = conversation(1, size=400)
+
+    assert history_window.window_start(messages, max_turns=10, max_tokens=10) == len(messages)
+
+
+def test_window_keeps_everything_under_limits():
+    messages = conversation(2)
+
+    assert history_window.window_start(messages, max_turns=6, max_tokens=3000) == 0
+
+
+# --- build_window ---
+
+def test_build_window_prepends_summary(store):
+    # Con los límites por defecto (6 turnos) y mensajes cortos
+    store.add(conversation(8))
+    store.summary = SimpleNamespace(summary="habló del cac", summarized_until=2)
+
+    window = history_window.build_window(str(uuid.uuid4()))
+
+    assert isinstance(window[0], SystemMessage)
+    assert window[0].content == history_window.SUMMARY_PREFIX + "habló del cac"
+    assert [m.content[:2] for m in window[1:3]] == ["p2", "r2"]
+    assert len(window) == 1 + 2 * history_window.HISTORY_MAX_TURNS
+
+
+def test_build_window_without_summary(store):
+    store.add(conversation(1))
+
+    window = history_window.build_window(str(uuid.uuid4()))
+
+    assert [m.content[:2] for m in window] == ["p0", "r0"]
+
+
+# --- update_summary ---
+
+def test_update_summary_only_sends_new_overflow(store, summarizer):
+    session_id = str(uuid.uuid4())
+    turns = history_window.HISTORY_MAX_TURNS
+
+    store.add(conversation(turns))
+    assert history_window.update_summary(session_id) is False
+    assert summarizer.calls == []
+
+    store.add(conversation(turns + 1)[-2:])
+    assert history_window.update_summary(session_id) is True
+    assert store.summary.summarized_until == 2
+    assert "p0" in summarizer.calls[0] and "r0" in summarizer.calls[0]
+    assert "p1" not in summarizer.calls[0]
+
+    # La ventana ya no desborda: no se vuelve a llamar al LLM
+    assert history_window.update_summary(session_id) is False
+    assert len(summarizer.calls) == 1
+
+    store.add(conversation(turns + 2)[-2:])
+    assert history_window.update_summary(session_id) is True
+    assert store.summary.summarized_until == 4
+    # Solo el resumen anterior y los mensajes que salieron desde entonces
+    assert "resumen 1" in summarizer.calls[1]
+    assert "p1" in summarizer.calls[1] and "r1" in summarizer.calls[1]
+    assert "p0" not in summarizer.calls[1] and "r0" not in summarizer.calls[1]
+    assert store.saved == [2, 4]
+
+
+def test_summarized_until_only_moves_forward(store, summarizer):
+    session_id = str(uuid.uuid4())
+    store.add(conversation(history_window.HISTORY_MAX_TURNS + 2))
+    history_window.update_summary(session_id)
+    assert store.summary.summarized_until == 4
+
+    # Un escritor atrasado (otro worker) no retrocede el resumen
+    history_window.connection.save_chat_summary(session_id, "resumen viejo", 2)
+
+    assert store.summary.summarized_until == 4
+    assert store.summary.summary == "resumen 1"
+
+
+def test_save_chat_summary_never_moves_back(live_db):
+    connection = history_window.connection
+    session_id = str(uuid.uuid4())
+
+    connection.save_chat_summary(session_id, "nuevo", 10)
+    connection.save_chat_summary(session_id, "viejo", 5)
+
+    summary = connection.get_chat_summary(session_id)
+    assert (summary.summary, summary.summarized_until) == ("nuevo", 10)
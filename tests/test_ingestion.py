@@ -0,0 +1,79 @@
+import pytest
+
+ingestion = pytest.importorskip("ingestion")
+
+
+class FakeEmbeddings:
+    def embed_documents(self, texts):
+        return [[float(len(text))] for text in texts]
+
+
+class FakeBackend:
+    def __init__(self):
+        self.rows = {}
+
+    def add(self, ids, texts, vectors, metadatas):
+        self.rows.update({i: (text, metadata) for i, text, metadata in zip(ids, texts, metadatas)})
+        return len(ids)
+
+    def delete(self, ids):
+        for i in ids:
+            self.rows.pop(i, None)
+
+
+def chunks(source, *texts):
+    return [ingestion.Chunk(text, {"source": source, "chunk": i}) for i, text in enumerate(texts)]
+
+
+def run(backend, items, path, **kwargs):
+    return ingestion.ingest(items, backend, FakeEmbeddings(), checkpoint_path=str(path), concurrency=1, **kwargs)
+
+
+def test_same_text_in_two_sources_is_stored_per_source(tmp_path):
+    backend = FakeBackend()
+    report = run(backend, chunks("a.md", "CAC", "LTV") + chunks("b.md", "CAC"), tmp_path / "ckpt")
+
+    assert report["chunks_written"] == 3
+    assert sorted(metadata["source"] for _, metadata in backend.rows.values()) == ["a.md", "a.md", "b.md"]
+
+
+def test_duplicate_text_within_a_source_is_written_once(tmp_path):
+    backend = FakeBackend()
+    report = run(backend, chunks("a.md", "CAC", "CAC"), tmp_path / "ckpt")
+    assert (report["chunks_written"], report["chunks_skipped"]) == (1, 1)
+
+
+def test_rerun_skips_unchanged_chunks(tmp_path):
+    backend = FakeBackend()
+    run(backend, chunks("a.md", "CAC", "LTV"), tmp_path / "ckpt")
+    report = run(backend, chunks("a.md", "CAC", "LTV"), tmp_path / "ckpt")
+    assert (report["chunks_written"], report["chunks_skipped"]) == (0, 2)
+
+
+def test_prune_deletes_chunks_removed_from_an_edited_source(tmp_path):
+    backend, path = FakeBackend(), tmp_path / "ckpt"
+    run(backend, chunks("a.md", "CAC", "LTV") + chunks("b.md", "ROI"), path)
+
+    report = run(backend, chunks("a.md", "CAC", "LTV v2"), path, prune=True)
+
+    assert report["chunks_deleted"] == 1
+    assert sorted(text for text, _ in backend.rows.values()) == ["CAC", "LTV v2", "ROI"]
+    # El checkpoint quedó al día: otra corrida no borra ni escribe nada
+    report = run(backend, chunks("a.md", "CAC", "LTV v2"), path, prune=True)
+    assert (report["chunks_written"], report["chunks_deleted"]) == (0, 0)
+
+
+def test_without_prune_stale_chunks_are_kept(tmp_path):
+    backend, path = FakeBackend(), tmp_path / "ckpt"
+    run(backend, chunks("a.md", "CAC", "LTV"), path)
+    run(backend, chunks("a.md", "CAC"), path)
+    assert len(backend.rows) == 2
+
+
+def test_delete_source_removes_every_chunk_of_a_removed_file(tmp_path):
+    backend, path = FakeBackend(), tmp_path / "ckpt"
+    run(backend, chunks("a.md", "CAC", "LTV") + chunks("b.md", "ROI"), path)
+
+    assert ingestion.delete_source("a.md", backend, str(path)) == 2
+    assert [text for text, _ in backend.rows.values()] == ["ROI"]
+    assert ingestion.IngestCheckpoint(str(path)).by_source == {"b.md": {chunks("b.md", "ROI")[0].id}}
@@ -0,0 +1,247 @@
+import os
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+local_index = pytest.importorskip("local_index")
+pytest.importorskip("weaviate")
+
+# Corpus de juguete: cada fragmento tiene un vector fijo y metadatos
+CORPUS = [
+    ("a", "el cac es el costo de adquisición de clientes", [1.0, 0.0, 0.0], {"source": "glosario", "tags": ["cac"]}),
+    ("b", "el ltv es el valor de vida del cliente", [0.8, 0.6, 0.0], {"source": "glosario", "tags": ["ltv"]}),
+    ("c", "el roi mide el retorno de la inversión", [0.0, 1.0, 0.0], {"source": "manual", "tags": ["roi", "cac"]}),
+    ("d", "fórmulas de margen bruto", [0.0, 0.0, 1.0], {"source": "manual", "tags": []}),
+]
+
+
+def make_doc(uid, content, metadata):
+    return {"uuid": uid, "content": content, "metadata": metadata,
+            "hash": local_index.content_hash(content, metadata)}
+
+
+def make_index(corpus=CORPUS, version="1"):
+    vectors = local_index._normalize_rows(np.asarray([v for _, _, v, _ in corpus], dtype=np.float32))
+    documents = [make_doc(uid, content, metadata) for uid, content, _, metadata in corpus]
+    return local_index.LocalVectorIndex(vectors, documents, 0.0, version)
+
+
+def uuids(docs):
+    return [doc.metadata["uuid"] for doc in docs]
+
+
+# --- Búsqueda ---
+
+def test_vector_search_returns_exact_top_k_in_order():
+    index = make_index()
+
+    assert uuids(index.search("", [1.0, 0.1, 0.0], k=3)) == ["a", "b", "c"]
+    assert uuids(index.search("", [0.0, 1.0, 0.0], k=2)) == ["c", "b"]
+    # k mayor que el corpus devuelve todo, ordenado
+    assert uuids(index.search("", [0.0, 0.0, 1.0], k=10))[0] == "d"
+    assert len(index.search("", [0.0, 0.0, 1.0], k=10)) == 4
+
+
+def test_bm25_excludes_documents_without_matching_terms():
+    index = make_index()
+
+    docs = index.search("cac adquisición", None, k=10, search_type="bm25")
+
+    # Solo el documento que contiene los términos; los de puntaje cero no se rellenan
+    assert uuids(docs) == ["a"]
+    assert docs[0].metadata["score"] > 0
+    assert index.search("inexistente", None, k=10, search_type="bm25") == []
+
+
+def test_hybrid_alpha_extremes_match_each_search():
+    index = make_index()
+    vector = [0.0, 1.0, 0.0]
+
+    dense = index.search("margen", vector, k=4, search_type="hybrid", alpha=1.0)
+    sparse = index.search("margen", vector, k=1, search_type="hybrid", alpha=0.0)
+
+    assert uuids(dense) == uuids(index.search("", vector, k=4))
+    assert uuids(sparse) == ["d"]
+
+
+def test_hybrid_fuses_normalized_scores():
+    index = make_index()
+
+    # Por vector gana "c" y por BM25 solo aparece "d"; con alpha 0.5 empatan en 0.5
+    docs = index.search("margen", [0.0, 1.0, 0.0], k=4, search_type="hybrid", alpha=0.5)
+    scores = {doc.metadata["uuid"]: doc.metadata["score"] for doc in docs}
+
+    assert scores["c"] == pytest.approx(0.5)
+    assert scores["d"] == pytest.approx(0.5)
+    assert scores["b"] == pytest.approx(0.5 * 0.6)
+    assert scores["a"] == pytest.approx(0.0)
+    assert all(doc.metadata["search_type"] == "hybrid" for doc in docs)
+
+
+def test_filters_scalar_list_and_list_valued_metadata():
+    index = make_index()
+    vector = [1.0, 0.0, 0.0]
+
+    assert uuids(index.search("", vector, k=10, filters={"source": "manual"})) == ["c", "d"]
+    assert set(uuids(index.search("", vector, k=10, filters={"source": ["manual", "glosario"]}))) == {"a", "b", "c", "d"}
+    # Metadatos con lista: basta con que alguno esté permitido
+    assert uuids(index.search("", vector, k=10, filters={"tags": "cac"})) == ["a", "c"]
+    assert uuids(index.search("", vector, k=10, filters={"source": "glosario", "tags": ["roi", "ltv"]})) == ["b"]
+    assert index.search("", vector, k=10, filters={"source": "otro"}) == []
+
+
+def test_filters_combine_with_bm25_mask():
+    index = make_index()
+
+    assert index.search("cac", None, k=10, search_type="bm25", filters={"source": "manual"}) == []
+
+
+# --- Sincronización incremental ---
+
+class FakeCollection():
+    """Colección de Weaviate en memoria: `iterator` sin vectores y `fetch_objects` por id."""
+
+    def __init__(self):
+        self.objects = {}
+        self.fetched = []
+
+    def put(self, uid, content, vector, **metadata):
+        self.objects[uid] = (dict(metadata, content=content), vector)
+
+    def iterator(self):
+        for uid, (properties, _) in list(self.objects.items()):
+            yield SimpleNamespace(uuid=uuid.UUID(uid), properties=dict(properties))
+
+    @property
+    def query(self):
+        return self
+
+    def fetch_objects(self, filters, include_vector, limit):
+        ids = [str(uid) for uid in filters.value]
+        self.fetched.extend(ids)
+        return SimpleNamespace(objects=[
+            SimpleNamespace(uuid=uuid.UUID(uid), vector={"default": self.objects[uid][1]})
+            for uid in ids if uid in self.objects
+        ])
+
+
+class FakeClient():
+    def __init__(self, collection):
+        self.collections = SimpleNamespace(get=lambda name: collection)
+
+
+def test_sync_adds_changes_and_removes_objects():
+    a, b, c = (str(uuid.uuid4()) for _ in range(3))
+    collection = FakeCollection()
+    collection.put(a, "el cac", [1.0, 0.0], source="glosario")
+    collection.put(b, "el ltv", [0.0, 1.0], source="glosario")
+    client = FakeClient(collection)
+
+    first = local_index.sync_from_weaviate(client)
+    assert sorted(doc["uuid"] for doc in first.documents) == sorted([a, b])
+    assert sorted(collection.fetched) == sorted([a, b])
+
+    # Sin cambios no hay versión nueva ni se descargan vectores
+    collection.fetched.clear()
+    assert local_index.sync_from_weaviate(client, first) is None
+    assert collection.fetched == []
+
+    # `a` cambia, `b` se borra y `c` es nuevo: solo se descargan `a` y `c`
+    collection.put(a, "el cac revisado", [0.0, 1.0], source="glosario")
+    del collection.objects[b]
+    collection.put(c, "el roi", [1.0, 1.0], source="manual")
+    second = local_index.sync_from_weaviate(client, first)
+
+    assert sorted(collection.fetched) == sorted([a, c])
+    assert sorted(doc["uuid"] for doc in second.documents) == sorted([a, c])
+    changed = next(doc for doc in second.documents if doc["uuid"] == a)
+    assert changed["content"] == "el cac revisado"
+    assert changed["metadata"] == {"source": "glosario"}
+    assert uuids(second.search("", [0.0, 1.0], k=1)) == [a]
+    assert np.linalg.norm(second.vectors, axis=1) == pytest.approx([1.0, 1.0])
+
+
+def test_sync_keeps_vectors_of_unchanged_objects():
+    a, b = str(uuid.uuid4()), str(uuid.uuid4())
+    collection = FakeCollection()
+    collection.put(a, "el cac", [1.0, 0.0])
+    client = FakeClient(collection)
+    first = local_index.sync_from_weaviate(client)
+
+    collection.put(b, "el ltv", [0.0, 1.0])
+    collection.fetched.clear()
+    second = local_index.sync_from_weaviate(client, first)
+
+    assert collection.fetched == [b]
+    assert uuids(second.search("", [1.0, 0.0], k=1)) == [a]
+
+
+# --- Snapshots ---
+
+def test_save_and_load_roundtrip(tmp_path):
+    index = make_index()
+    index.save(str(tmp_path))
+
+    loaded = local_index.LocalVectorIndex.load(str(tmp_path))
+
+    assert loaded.version == index.version
+    assert loaded.documents == index.documents
+    assert uuids(loaded.search("", [1.0, 0.1, 0.0], k=3)) == ["a", "b", "c"]
+
+
+def snapshot_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith(("vectors-", "documents-")))
+
+
+def age(directory, version, seconds):
+    """Hace que el snapshot `version` parezca escrito hace `seconds` segundos."""
+    for name in (f"vectors-{version}.npy", f"documents-{version}.json"):
+        path = os.path.join(directory, name)
+        mtime = os.path.getmtime(path) - seconds
+        os.utime(path, (mtime, mtime))
+
+
+def published(directory, seconds):
+    """Hace que el manifiesto vigente parezca publicado hace `seconds` segundos."""
+    mtime = time.time() - seconds
+    os.utime(os.path.join(directory, "manifest.json"), (mtime, mtime))
+
+
+def test_cleanup_keeps_current_and_previous_snapshots(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_index, "LOCAL_INDEX_KEEP_SNAPSHOTS", 0)
+    directory = str(tmp_path)
+
+    make_index(version="1").save(directory)
+    age(directory, "1", 300)
+    published(directory, 200)
+    make_index(version="2").save(directory)
+
+    # El del manifiesto anterior se conserva: otro worker puede estar abriéndolo
+    assert snapshot_files(directory) == ["documents-1.json", "documents-2.json", "vectors-1.npy", "vectors-2.npy"]
+
+    published(directory, 100)
+    age(directory, "2", 150)
+    make_index(version="3").save(directory)
+
+    assert snapshot_files(directory) == ["documents-2.json", "documents-3.json", "vectors-2.npy", "vectors-3.npy"]
+
+
+def test_cleanup_spares_snapshots_written_after_previous_manifest(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_index, "LOCAL_INDEX_KEEP_SNAPSHOTS", 0)
+    directory = str(tmp_path)
+
+    make_index(version="1").save(directory)
+    age(directory, "1", 300)
+    published(directory, 200)
+    # Otro worker escribió su snapshot pero aún no publica el manifiesto
+    unpublished = make_index(version="pending")
+    np.save(os.path.join(directory, "vectors-pending.npy"), unpublished.vectors)
+    with open(os.path.join(directory, "documents-pending.json"), "w") as f:
+        f.write("[]")
+    make_index(version="2").save(directory)
+
+    assert "vectors-pending.npy" in snapshot_files(directory)
+    assert "documents-pending.json" in snapshot_files(directory)
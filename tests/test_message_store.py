@@ -0,0 +1,89 @@
+import json
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+import pytest
+
+message_store = pytest.importorskip("message_store")
+from langchain_core.messages import AIMessage, HumanMessage, message_to_dict
+
+CREATED_AT = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeConnection:
+    """chat_history en memoria: filas (id, message, created_at) con ids globales."""
+
+    def __init__(self, messages):
+        self.rows = [(row_id, message_to_dict(message), CREATED_AT) for row_id, message in messages]
+        self.statements = []
+
+    def execute(self, sql, params=()):
+        self.statements.append(sql)
+        rows = [(message, created_at) for _, message, created_at in sorted(self.rows)]
+        return type("Result", (), {"fetchall": lambda _: rows})()
+
+    def transaction(self):
+        return nullcontext()
+
+    def cursor(self):
+        return nullcontext(self)
+
+    def executemany(self, sql, values):
+        self.statements.append(sql)
+        next_id = max((row[0] for row in self.rows), default=0) + 10
+        for i, (_, message, created_at, _, message_id) in enumerate(values):
+            if all(row[1]["data"]["id"] != message_id for row in self.rows):
+                self.rows.append((next_id + i, json.loads(message), created_at))
+
+
+@pytest.fixture
+def session(monkeypatch):
+    def setup(stored, checkpoint):
+        conn = FakeConnection(stored)
+
+        @contextmanager
+        def db_connection():
+            yield conn
+
+        monkeypatch.setattr(message_store, "db_connection", db_connection)
+        monkeypatch.setattr(message_store, "get_table_name", lambda: "chat_history")
+        monkeypatch.setattr(message_store, "_checkpoint_messages", lambda session_id: checkpoint)
+        return conn
+    return setup
+
+
+def ids(conn):
+    return [(row_id, message["data"]["id"]) for row_id, message, _ in sorted(conn.rows)]
+
+
+def test_trailing_messages_are_inserted_without_touching_existing_rows(session):
+    q1, a1 = HumanMessage("q1", id="h1"), AIMessage("a1", id="a1")
+    q2, a2 = HumanMessage("q2", id="h2"), AIMessage("a2", id="a2")
+    conn = session([(3, q1), (7, a1)], [q1, a1, q2, a2])
+
+    assert message_store.migrate_session("s") == "completed"
+    assert ids(conn) == [(3, "h1"), (7, "a1"), (17, "h2"), (18, "a2")]
+    assert not any(sql.lstrip().startswith("DELETE FROM chat_history") for sql in conn.statements)
+
+
+def test_interleaved_messages_are_appended(session):
+    q1, a1 = HumanMessage("q1", id="h1"), AIMessage("a1", id="a1")
+    q2, a2 = HumanMessage("q2", id="h2"), AIMessage("a2", id="a2")
+    conn = session([(3, q1), (7, a2)], [q1, a1, q2, a2])
+
+    assert message_store.migrate_session("s") == "appended"
+    assert ids(conn)[:2] == [(3, "h1"), (7, "a2")]
+
+
+def test_unknown_history_messages_are_a_conflict(session):
+    q1, a1 = HumanMessage("q1", id="h1"), AIMessage("a1", id="a1")
+    conn = session([(3, q1), (7, AIMessage("x", id="other"))], [q1, a1])
+
+    assert message_store.migrate_session("s") == "conflict"
+    assert len(conn.rows) == 2
+
+
+def test_complete_history_is_unchanged(session):
+    q1 = HumanMessage("q1", id="h1")
+    session([(3, q1)], [q1])
+    assert message_store.migrate_session("s") == "unchanged"
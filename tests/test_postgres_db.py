@@ -0,0 +1,93 @@
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pytest
+
+postgres_db = pytest.importorskip("postgres_db")
+
+
+def read_concurrently(session_id: str, workers: int, iterations: int) -> None:
+    """Lee el historial de la sesión desde muchos hilos a la vez."""
+    def read_history(_):
+        return len(postgres_db.get_by_session_id(session_id).messages)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(read_history, range(workers * iterations)))
+
+
+class FakePool:
+    """Pool acotado que cuenta las conexiones prestadas."""
+
+    def __init__(self, size):
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.max_in_use = 0
+
+    @contextmanager
+    def connection(self):
+        assert self.slots.acquire(timeout=5), "pool agotado: una conexión no se devolvió"
+        with self.lock:
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+        try:
+            yield object()
+        finally:
+            with self.lock:
+                self.in_use -= 1
+            self.slots.release()
+
+
+class FakeHistory:
+    """Historial que falla en una de cada tres lecturas."""
+
+    calls = 0
+    lock = threading.Lock()
+
+    def __init__(self, table, session_id, sync_connection):
+        self.connection = sync_connection
+
+    @property
+    def messages(self):
+        with FakeHistory.lock:
+            FakeHistory.calls += 1
+            fail = FakeHistory.calls % 3 == 0
+        if fail:
+            raise RuntimeError("conexión perdida")
+        return []
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = FakePool(size=4)
+    monkeypatch.setattr(postgres_db, "get_db_pool", lambda: pool)
+    monkeypatch.setattr(postgres_db, "get_table_name", lambda: "chat_history")
+    monkeypatch.setattr(postgres_db, "PostgresChatMessageHistory", FakeHistory)
+    monkeypatch.setattr(postgres_db, "checkout_stats", postgres_db._CheckoutStats())
+    return pool
+
+
+def test_every_checkout_is_returned_even_on_errors(pool):
+    read_concurrently("s1", workers=20, iterations=5)
+    assert pool.in_use == 0
+    assert pool.max_in_use <= 4
+    assert postgres_db.checkout_stats.in_use == 0
+    assert postgres_db.checkout_stats.checkouts == 100
+
+
+def test_connection_is_returned_when_the_block_raises(pool):
+    with pytest.raises(ValueError):
+        with postgres_db.db_connection():
+            assert pool.in_use == 1
+            raise ValueError("boom")
+    assert pool.in_use == 0
+    assert postgres_db.checkout_stats.in_use == 0
+
+
+def test_concurrent_history_reads_return_every_connection(live_db):
+    read_concurrently(str(uuid.uuid4()), workers=20, iterations=5)
+    stats = postgres_db.get_pool_stats()["db_pool"]
+    assert postgres_db.checkout_stats.in_use == 0
+    assert stats["pool_available"] == stats["pool_size"]
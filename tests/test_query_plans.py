@@ -0,0 +1,9 @@
+import pytest
+
+query_plans = pytest.importorskip("query_plans")
+
+
+def test_connection_queries_use_indexes(live_db):
+    problems = query_plans.index_usage_problems()
+    assert problems["unchecked"] == [], "funciones de connection.py sin llamada en _sample_calls"
+    assert problems["seq_scans"] == {}
@@ -0,0 +1,115 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+quota = pytest.importorskip("quota")
+
+HOUR = 3600
+
+
+def test_counter_expires_old_buckets():
+    counter = quota.SlidingWindowCounter(HOUR)
+    start = 1_000_000.0
+    counter.add(2, now=start)
+    counter.add(3, now=start + HOUR / 2)
+    assert counter.count(now=start + HOUR / 2) == 5
+    # El primer bucket sale de la ventana; el segundo sigue dentro
+    assert counter.count(now=start + HOUR + counter.bucket_seconds) == 3
+    assert counter.count(now=start + 2 * HOUR) == 0
+
+
+def test_counter_starts_from_loaded_buckets():
+    counter = quota.SlidingWindowCounter(HOUR, {1: 4, 2: 6})
+    assert counter.total == 10
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """Historial y sesiones falsos en lugar de Postgres."""
+    state = SimpleNamespace(stored=0, loads=0, sessions={"s1": "u1", "s2": "u2"})
+
+    def count_user_messages_by_bucket(user_id, first_date, bucket_seconds):
+        state.loads += 1
+        return {int(first_date.timestamp() // bucket_seconds) + 1: state.stored} if state.stored else {}
+
+    def get_session_user(session_id):
+        user_id = state.sessions.get(session_id)
+        return SimpleNamespace(user_id=user_id) if user_id else None
+
+    monkeypatch.setattr(quota.connection, "count_user_messages_by_bucket", count_user_messages_by_bucket)
+    monkeypatch.setattr(quota.connection, "get_session_user", get_session_user)
+    monkeypatch.setattr(quota, "tracker", quota.QuotaTracker())
+    monkeypatch.setattr(quota, "QUOTA_MAX_MESSAGES", 4)
+    monkeypatch.setattr(quota, "QUOTA_INTERVAL", "1 hour")
+    return state
+
+
+def test_quota_counts_turns_in_memory(db):
+    db.stored = 2
+    quota.reserve_turn("s1")
+    # 2 guardados + 2 del turno: sin mensajes disponibles, sin volver a consultar
+    with pytest.raises(quota.QuotaExceeded) as excinfo:
+        quota.reserve_turn("s1")
+    assert excinfo.value.status["total_msg"] == 4
+    assert db.loads == 1
+
+
+def test_quota_is_per_user(db):
+    quota.reserve_turn("s1")
+    quota.reserve_turn("s1")
+    quota.reserve_turn("s2")
+
+
+def test_unknown_session_is_not_limited(db):
+    assert quota.reserve_turn("desconocida") is None
+    quota.refund_turn(None)
+
+
+def test_concurrent_turns_do_not_overshoot_the_limit(db):
+    # Cuota de 4 mensajes = 2 turnos; 10 turnos simultáneos del mismo usuario
+    barrier = threading.Barrier(10)
+    results = []
+
+    def turn():
+        barrier.wait()
+        try:
+            results.append(quota.reserve_turn("s1"))
+        except quota.QuotaExceeded:
+            results.append(None)
+
+    threads = [threading.Thread(target=turn) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(result is not None for result in results) == 2
+    assert quota.tracker.status("u1", "1 hour", 4)["total_msg"] == 4
+
+
+def test_failed_turn_is_refunded(db):
+    reservation = quota.reserve_turn("s1")
+    quota.reserve_turn("s1")
+    with pytest.raises(quota.QuotaExceeded):
+        quota.reserve_turn("s1")
+    quota.refund_turn(reservation)
+    assert quota.tracker.status("u1", "1 hour", 4)["total_msg"] == 2
+    quota.reserve_turn("s1")
+
+
+def test_disabled_quota_still_counts_turns(db, monkeypatch):
+    monkeypatch.setattr(quota, "QUOTA_MAX_MESSAGES", 0)
+    quota.tracker.status("u1", "1 hour", 4)  # Contador en memoria
+    for _ in range(3):
+        quota.reserve_turn("s1")
+    assert quota.tracker.status("u1", "1 hour", 4)["total_msg"] == 6
+
+
+def test_tracker_evicts_least_recently_used_counters(db):
+    tracker = quota.QuotaTracker(max_counters=2)
+    for user_id in ("a", "b", "a", "c"):
+        tracker.status(user_id, "1 hour", 10)
+    assert [key[0] for key in tracker._counters] == ["a", "c"]
+    # Las ventanas del usuario desalojado ya no reciben turnos
+    tracker.record("b")
+    assert "b" not in tracker._windows
@@ -0,0 +1,100 @@
+import pytest
+
+retrieval_cache = pytest.importorskip("retrieval_cache")
+vector_backends = pytest.importorskip("vector_backends")
+from langchain_core.documents import Document
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(retrieval_cache.time, "time", clock.time)
+    return clock
+
+
+def test_lru_evicts_least_recently_used(clock):
+    cache = retrieval_cache.LRUTTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1 # "a" pasa a ser el más reciente
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = retrieval_cache.LRUTTLCache(max_size=10, ttl=60)
+    cache.set("a", 1)
+    clock.now += 60
+    assert cache.get("a") == 1
+    clock.now += 1
+    assert cache.get("a") is None
+    assert cache.stats() == {"size": 0, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+class CountingEmbeddings():
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [float(len(text)), 1.0]
+
+
+def test_query_embeddings_are_cached_by_normalized_text(clock):
+    model = CountingEmbeddings()
+    embeddings = retrieval_cache.CachedEmbeddings(model, retrieval_cache.LRUTTLCache(10, 60))
+    assert embeddings.embed_query("¿Qué es el CAC?") == embeddings.embed_query("  ¿qué es   el CAC? ")
+    assert model.calls == 1
+
+
+class CountingBackend(vector_backends.VectorBackend):
+    name = "fake"
+    search_types = ("vector", "bm25")
+
+    def __init__(self):
+        self.calls = 0
+
+    def search(self, query, vector, k, search_type="vector", alpha=0.5, filters=None):
+        self.calls += 1
+        return [Document(page_content=f"doc {i}", metadata={"score": 1 - i / 10}) for i in range(k)]
+
+
+@pytest.fixture
+def retriever(monkeypatch, clock):
+    monkeypatch.setattr(retrieval_cache, "retrieval_cache", retrieval_cache.LRUTTLCache(10, 60))
+    embeddings = retrieval_cache.CachedEmbeddings(CountingEmbeddings(), retrieval_cache.LRUTTLCache(10, 60))
+    return vector_backends.BackendRetriever(backend=CountingBackend(), embeddings=embeddings)
+
+
+def test_retrieval_is_cached_per_options(retriever):
+    assert len(retriever.invoke("cac", k=3)) == 3
+    assert len(retriever.invoke("cac", k=3)) == 3
+    assert retriever.backend.calls == 1
+    retriever.invoke("cac", k=2)
+    retriever.invoke("cac", k=3, search_type="bm25")
+    assert retriever.backend.calls == 3
+
+
+def test_score_threshold_is_applied_after_the_cache(retriever):
+    retriever.invoke("cac", k=3)
+    docs = retriever.invoke("cac", k=3, score_threshold=0.85)
+    assert [doc.page_content for doc in docs] == ["doc 0", "doc 1"]
+    assert retriever.backend.calls == 1
+
+
+def test_collection_version_invalidates_retrieval(retriever, monkeypatch):
+    monkeypatch.setattr(retrieval_cache, "_collection_version", retrieval_cache._collection_version)
+    retriever.invoke("cac")
+    retrieval_cache.bump_collection_version()
+    retriever.invoke("cac")
+    assert retriever.backend.calls == 2
@@ -0,0 +1,27 @@
+import pytest
+
+schema = pytest.importorskip("schema")
+vector_backends = pytest.importorskip("vector_backends")
+
+
+class VectorOnlyBackend(vector_backends.VectorBackend):
+    name = "alloydb"
+    search_types = ("vector",)
+
+
+def test_unsupported_search_type_is_a_validation_error(monkeypatch):
+    from pydantic import ValidationError
+    monkeypatch.setattr(vector_backends, "get_backend", lambda name=None: VectorOnlyBackend())
+
+    with pytest.raises(ValidationError):
+        schema.ChatRequest(session_id="s", user_input="hola", retrieval={"search_type": "hybrid"})
+
+    request = schema.ChatRequest(session_id="s", user_input="hola", retrieval={"search_type": "vector", "k": 5})
+    assert request.retrieval_options() == {"search_type": "vector", "k": 5}
+
+
+def test_message_update_like_defaults_to_true():
+    update = schema.MessageUpdate(message_id="m", feedback=[], observations=None)
+
+    assert update.like is True
+    assert schema.MessageUpdate(message_id="m", like=False, feedback=[], observations=None).like is False
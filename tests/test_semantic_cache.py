@@ -0,0 +1,77 @@
+import pytest
+
+semantic_cache = pytest.importorskip("semantic_cache")
+
+# Embeddings de juguete: cada pregunta es un vector fijo
+VECTORS = {
+    "¿qué es el cac?": [1.0, 0.0, 0.0],
+    "que es el cac": [0.99, 0.14, 0.0],
+    "¿qué es el ltv?": [0.0, 1.0, 0.0],
+    "¿qué es el roi?": [0.0, 0.0, 1.0],
+}
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(semantic_cache.time, "time", clock.time)
+    return clock
+
+
+def make_cache(**kwargs):
+    return semantic_cache.SemanticCache(lambda question: VECTORS[question.lower()], **kwargs)
+
+
+def ask(cache, question, answer=None):
+    """Busca la pregunta; si falla y se da `answer`, la guarda como lo hace el nodo chatbot."""
+    found, vector = cache.lookup(question)
+    if found is None and answer is not None:
+        cache.store(question, vector, answer)
+    return found
+
+
+def test_similar_question_above_threshold_hits(clock):
+    cache = make_cache(threshold=0.95)
+    ask(cache, "¿Qué es el CAC?", "Costo de adquisición")
+    assert ask(cache, "que es el cac") == "Costo de adquisición"
+    assert ask(cache, "¿Qué es el LTV?") is None
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 2, "hit_rate": 1 / 3}
+
+
+def test_threshold_rejects_less_similar_questions(clock):
+    cache = make_cache(threshold=0.999)
+    ask(cache, "¿Qué es el CAC?", "Costo de adquisición")
+    assert ask(cache, "que es el cac") is None
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = make_cache(ttl=60)
+    ask(cache, "¿Qué es el CAC?", "Costo de adquisición")
+    clock.now += 61
+    assert ask(cache, "¿Qué es el CAC?") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_lru_evicts_least_recently_used(clock):
+    cache = make_cache(max_size=2)
+    ask(cache, "¿Qué es el CAC?", "cac")
+    ask(cache, "¿Qué es el LTV?", "ltv")
+    assert ask(cache, "¿Qué es el CAC?") == "cac"  # El CAC pasa a ser el más reciente
+    ask(cache, "¿Qué es el ROI?", "roi")
+    assert ask(cache, "¿Qué es el LTV?") is None
+    assert ask(cache, "¿Qué es el CAC?") == "cac"
+
+
+def test_invalidate_empties_the_cache(clock):
+    cache = make_cache()
+    ask(cache, "¿Qué es el CAC?", "cac")
+    cache.invalidate()
+    assert ask(cache, "¿Qué es el CAC?") is None
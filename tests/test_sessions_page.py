@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+chatbot = pytest.importorskip("chatbot")
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    # Varias sesiones con el mismo updated_at: el id desempata el orden
+    rows = [
+        SimpleNamespace(id=i, session_id=f"s{i}", user_id="u", created_at=START,
+                        updated_at=START + timedelta(minutes=i // 3), first_message=f"m{i}")
+        for i in range(1, 11)
+    ]
+
+    def get_sessions_with_first_message(user_id, limit=None, cursor=None):
+        page = sorted(rows, key=lambda row: (row.updated_at, row.id), reverse=True)
+        if cursor is not None:
+            page = [row for row in page if (row.updated_at, row.id) < cursor]
+        return page[:limit] if limit is not None else page
+
+    monkeypatch.setattr(chatbot.connection, "get_sessions_with_first_message", get_sessions_with_first_message)
+    return rows
+
+
+def test_pages_cover_every_session_once_in_order(sessions):
+    seen, cursor = [], None
+    while True:
+        page = chatbot.get_sessions_page("u", limit=3, cursor=cursor)
+        seen += [chat["session_id"] for chat in page["chats"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == [f"s{i}" for i in range(10, 0, -1)]
+
+
+def test_without_limit_there_is_no_cursor(sessions):
+    page = chatbot.get_sessions_page("u")
+    assert len(page["chats"]) == 10
+    assert page["next_cursor"] is None
+
+
+def test_cursor_round_trip():
+    cursor = chatbot._encode_session_cursor(START, 42)
+    assert chatbot._decode_session_cursor(cursor) == (START, 42)
+
+
+@pytest.mark.parametrize("cursor", ["no-es-base64", "bXNnfDE="])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        chatbot.get_sessions_page("u", limit=3, cursor=cursor)
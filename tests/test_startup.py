@@ -0,0 +1,12 @@
+import pytest
+
+startup = pytest.importorskip("startup")
+
+
+def test_importing_main_does_no_network_io():
+    # El proceso hijo bloquea los clientes de red; necesita las dependencias instaladas
+    for module in ("fastapi", "psycopg", "weaviate", "google.cloud.secretmanager"):
+        pytest.importorskip(module)
+    report = startup.import_network_report("main")
+    assert report["attempts"] == []
+    assert report["error"] is None
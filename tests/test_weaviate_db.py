@@ -0,0 +1,239 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+weaviate_db = pytest.importorskip("weaviate_db")
+
+
+class FakeClient():
+    """Cliente de Weaviate falso: salud configurable y registro de cierre."""
+
+    def __init__(self, token, ready=True):
+        self.token = token
+        self.ready = ready
+        self.closed = threading.Event()
+        self.collection = FakeCollection()
+
+    def is_ready(self):
+        if isinstance(self.ready, Exception):
+            raise self.ready
+        return self.ready
+
+    def close(self):
+        self.closed.set()
+
+    @property
+    def collections(self):
+        return SimpleNamespace(get=lambda name: self.collection)
+
+
+class FakeCollection():
+    def __init__(self):
+        self.calls = []
+
+    @property
+    def query(self):
+        return self
+
+    def _result(self, method, **kwargs):
+        self.calls.append((method, kwargs))
+        obj = SimpleNamespace(uuid="u1", properties={"content": "texto", "source": "manual"},
+                              metadata=SimpleNamespace(distance=0.25, score=0.8))
+        return SimpleNamespace(objects=[obj])
+
+    def near_vector(self, **kwargs):
+        return self._result("near_vector", **kwargs)
+
+    def bm25(self, **kwargs):
+        return self._result("bm25", **kwargs)
+
+    def hybrid(self, **kwargs):
+        return self._result("hybrid", **kwargs)
+
+
+class FakeCredentials():
+    """Token que vence en `lifetime` segundos; cada `refresh` emite uno de una hora."""
+
+    def __init__(self, lifetime):
+        self.lifetime = lifetime
+        self.refreshes = 0
+        self._issue()
+
+    def _issue(self):
+        self.token = f"token-{self.refreshes}"
+        self.expiry = datetime.utcnow() + timedelta(seconds=self.lifetime)
+
+    @property
+    def valid(self):
+        return datetime.utcnow() < self.expiry
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.lifetime = 3600
+        self._issue()
+
+
+@pytest.fixture
+def cloud(monkeypatch):
+    """Conexiones a Weaviate falsas: registra cada cliente creado."""
+    monkeypatch.setenv("WCD_URL", "https://weaviate.example")
+    monkeypatch.setenv("WCD_API_KEY", "key")
+    cloud = SimpleNamespace(clients=[], credentials=FakeCredentials(lifetime=3600), ready=True)
+
+    def connect(cluster_url, auth_credentials, headers, additional_config):
+        client = FakeClient(headers["X-Goog-Vertex-Api-Key"], cloud.ready)
+        cloud.clients.append(client)
+        return client
+
+    monkeypatch.setattr(weaviate_db, "connect_to_weaviate_cloud", connect)
+    monkeypatch.setattr(weaviate_db, "get_credentials", lambda: cloud.credentials)
+    return cloud
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+# --- WeaviateClientManager ---
+
+def test_reconnect_swaps_client_and_closes_old_after_grace(cloud):
+    manager = weaviate_db.WeaviateClientManager(close_grace_seconds=0.2)
+    old = manager.get_client()
+
+    manager.reconnect("prueba")
+
+    new = manager.get_client()
+    assert new is not old and new is cloud.clients[-1]
+    assert manager.stats()["generation"] == 1
+    # El cliente anterior sigue abierto para las consultas en curso
+    assert not old.closed.is_set()
+    assert old.closed.wait(timeout=5)
+    assert not new.closed.is_set()
+    manager.close()
+    assert new.closed.is_set()
+
+
+def test_refresh_thread_reconnects_before_token_expires(cloud):
+    # El token vence dentro del margen: el hilo lo renueva y publica un cliente nuevo
+    cloud.credentials = FakeCredentials(lifetime=1)
+    manager = weaviate_db.WeaviateClientManager(refresh_margin=600, health_check_interval=60, close_grace_seconds=0)
+    manager.start()
+    try:
+        assert wait_until(lambda: manager.reconnects >= 1)
+        assert cloud.credentials.refreshes == 1
+        assert manager.get_client().token == "token-1"
+        assert wait_until(lambda: cloud.clients[0].closed.is_set())
+    finally:
+        manager.close()
+
+
+def test_refresh_thread_reconnects_unhealthy_client(cloud):
+    cloud.ready = False
+    manager = weaviate_db.WeaviateClientManager(health_check_interval=0.05, close_grace_seconds=0)
+    manager.start()
+    try:
+        cloud.ready = True
+        assert wait_until(lambda: manager.reconnects >= 1)
+        assert manager.is_healthy()
+        assert manager.get_client() is cloud.clients[-1]
+        # El token sigue vigente: no se renovó, solo se reconectó
+        assert cloud.credentials.refreshes == 0
+    finally:
+        manager.close()
+
+
+def test_health_check(cloud):
+    manager = weaviate_db.WeaviateClientManager()
+    assert manager.is_healthy() is False
+
+    client = manager.get_client()
+    assert manager.is_healthy() is True
+
+    client.ready = False
+    assert manager.is_healthy() is False
+
+    client.ready = ConnectionError("sin red")
+    assert manager.is_healthy() is False
+    assert "sin red" in manager.stats()["last_error"]
+    manager.close()
+
+
+def test_failed_reconnect_keeps_current_client(cloud, monkeypatch):
+    manager = weaviate_db.WeaviateClientManager(close_grace_seconds=0)
+    client = manager.get_client()
+
+    def fail(**kwargs):
+        raise ConnectionError("cluster caído")
+    monkeypatch.setattr(weaviate_db, "connect_to_weaviate_cloud", fail)
+
+    with pytest.raises(ConnectionError):
+        manager.reconnect("prueba")
+    assert manager.get_client() is client
+    assert not client.closed.is_set()
+    manager.close()
+
+
+def test_close_closes_retired_clients(cloud):
+    manager = weaviate_db.WeaviateClientManager(close_grace_seconds=60)
+    old = manager.get_client()
+    manager.reconnect("prueba")
+
+    manager.close()
+
+    assert old.closed.is_set()
+    assert cloud.clients[-1].closed.is_set()
+    assert manager.stats()["connected"] is False
+
+
+# --- Filtros ---
+
+def test_build_filters_scalar_and_list_values():
+    assert weaviate_db.build_filters(None) is None
+    assert weaviate_db.build_filters({}) is None
+
+    scalar = weaviate_db.build_filters({"source": "manual.pdf"})
+    assert (scalar.target, scalar.operator.name, scalar.value) == ("source", "EQUAL", "manual.pdf")
+
+    for value in (["a", "b"], ("a", "b"), {"a", "b"}):
+        any_of = weaviate_db.build_filters({"tags": value})
+        assert (any_of.target, any_of.operator.name) == ("tags", "CONTAINS_ANY")
+        assert sorted(any_of.value) == ["a", "b"]
+
+
+def test_build_filters_combines_properties_with_and():
+    combined = weaviate_db.build_filters({"source": "manual.pdf", "tags": ["cac"], "page": 3})
+
+    assert combined.operator.name == "AND"
+    assert [(f.target, f.operator.name, f.value) for f in combined.filters] == [
+        ("source", "EQUAL", "manual.pdf"),
+        ("tags", "CONTAINS_ANY", ["cac"]),
+        ("page", "EQUAL", 3),
+    ]
+
+
+@pytest.mark.parametrize("search_type,method,score", [
+    ("vector", "near_vector", 0.75),
+    ("bm25", "bm25", 0.8),
+    ("hybrid", "hybrid", 0.8),
+])
+def test_backend_search_passes_filters_and_maps_scores(cloud, search_type, method, score):
+    manager = weaviate_db.WeaviateClientManager()
+    backend = weaviate_db.WeaviateBackend(manager=manager)
+
+    docs = backend.search("cac", [0.1, 0.2], k=3, search_type=search_type, filters={"source": "manual"})
+
+    name, kwargs = cloud.clients[0].collection.calls[0]
+    assert name == method
+    assert kwargs["limit"] == 3
+    assert (kwargs["filters"].target, kwargs["filters"].value) == ("source", "manual")
+    assert docs[0].page_content == "texto"
+    assert docs[0].metadata == {"source": "manual", "uuid": "u1", "score": pytest.approx(score), "search_type": search_type}
+    manager.close()
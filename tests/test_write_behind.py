@@ -0,0 +1,90 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+write_behind = pytest.importorskip("write_behind")
+
+
+class FakeStore():
+    """Escribe lotes {clave: valor} en memoria; las claves en `bad` hacen fallar el lote."""
+
+    def __init__(self, bad=()):
+        self.rows = {}
+        self.batches = []
+        self.bad = set(bad)
+
+    def write(self, items):
+        if self.bad & set(items):
+            raise ValueError("clave inválida")
+        self.batches.append(dict(items))
+        self.rows.update(items)
+
+
+def make_queue(store, **kwargs):
+    queue = write_behind.WriteBehindQueue(flush_seconds=60, batch_size=500, max_pending=1000, **kwargs)
+    queue.register("touch", store.write, max)
+    queue._running = True # Encola sin arrancar el hilo: los tests llaman a flush
+    return queue
+
+
+def test_repeated_keys_are_coalesced():
+    store = FakeStore()
+    queue = make_queue(store)
+    now = datetime.now(timezone.utc)
+    queue.put("touch", "a", now)
+    queue.put("touch", "a", now + timedelta(seconds=5))
+    queue.put("touch", "a", now - timedelta(seconds=5))
+    queue.put("touch", "b", now)
+
+    assert queue.flush() == 2
+    assert store.batches == [{"a": now + timedelta(seconds=5), "b": now}]
+    assert queue.stats()["coalesced"] == 2
+
+
+def test_put_writes_inline_when_not_running():
+    store = FakeStore()
+    queue = make_queue(store)
+    queue._running = False
+    queue.put("touch", "a", 1)
+    assert store.rows == {"a": 1}
+    assert queue.stats()["inline_writes"] == 1
+
+
+def test_bad_key_does_not_block_the_batch():
+    store = FakeStore(bad={"bad"})
+    queue = make_queue(store, max_retries=2)
+    for key in ("a", "bad", "b"):
+        queue.put("touch", key, 1)
+
+    assert queue.flush() == 2
+    assert store.rows == {"a": 1, "b": 1}
+    assert queue.stats()["pending"] == 1
+
+    # La clave inválida se descarta al llegar al límite de reintentos
+    assert queue.flush() == 0
+    stats = queue.stats()
+    assert stats["pending"] == 0
+    assert stats["dropped"] == 1
+    assert queue.flush() == 0
+
+
+def test_stop_drains_pending_writes():
+    store = FakeStore()
+    queue = make_queue(store)
+    queue.start()
+    queue.put("touch", "a", 1)
+    assert queue.stop() == 0
+    assert store.rows == {"a": 1}
+
+
+def test_update_timestamp_skips_invalid_session_ids(monkeypatch):
+    chatbot = pytest.importorskip("chatbot")
+    calls = []
+    monkeypatch.setattr(chatbot.write_behind.queue, "put", lambda *args: calls.append(args))
+
+    chatbot.update_timestamp("no-es-un-uuid")
+    session_id = str(uuid.uuid4())
+    chatbot.update_timestamp(session_id)
+
+    assert [call[1] for call in calls] == [session_id]
@@ -0,0 +1,227 @@
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from typing import Any, Dict, List, Optional
+from langchain_core.documents import Document
+
+from retrieval_cache import CachedEmbeddings, CachedRetriever, RAG_BACKEND, RAG_SEARCH_TYPE
+
+logger = logging.getLogger(__name__)
+
+BACKEND_NAMES = ("weaviate", "alloydb", "local")
+
+
+class VectorBackend():
+    """
+    Interfaz común de los almacenes vectoriales del RAG.
+
+    Cada backend recibe el vector de la consulta ya calculado (los embeddings
+    se cachean en `CachedEmbeddings`) y devuelve documentos con `uuid`,
+    `score` y `search_type` en `metadata`. Las instancias son de larga vida:
+    se crean una vez por proceso con `get_backend`.
+    """
+
+    name = "base"
+    search_types = ("vector",)
+
+    def open(self) -> None:
+        """Crea las conexiones (lo llama el lifespan; por defecto en el primer uso)."""
+
+    def search(
+        self,
+        query: str,
+        vector: Optional[List[float]],
+        k: int,
+        search_type: str = "vector",
+        alpha: float = 0.5,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> List[Document]:
+        raise NotImplementedError
+
+    def add(self, ids: List[str], texts: List[str], vectors: List[List[float]], metadatas: List[dict]) -> int:
+        """Escribe un lote con vectores precalculados. Devuelve cuántos se escribieron."""
+        raise NotImplementedError
+
+    def delete(self, ids: List[str]) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+    def check_search_type(self, search_type: str) -> None:
+        if search_type not in self.search_types:
+            raise ValueError(f"El backend '{self.name}' no soporta search_type='{search_type}' (soporta {self.search_types}).")
+
+
+class BackendRetriever(CachedRetriever):
+    """Retriever con cache sobre cualquier `VectorBackend`."""
+
+    backend: Any
+
+    def _search(self, query: str, vector: Optional[List[float]], options: dict) -> List[Document]:
+        return self.backend.search(
+            query, vector, options["k"], options["search_type"], options["alpha"], options["filters"]
+        )
+
+
+def create_backend(name: str, **kwargs) -> VectorBackend:
+    """Crea un backend nuevo (los módulos de cada backend se importan solo si se usan)."""
+    if name == "weaviate":
+        from weaviate_db import WeaviateBackend
+        return WeaviateBackend(**kwargs)
+    if name == "alloydb":
+        from document import AlloyDBBackend
+        return AlloyDBBackend(**kwargs)
+    if name == "local":
+        from local_index import LocalBackend
+        return LocalBackend(**kwargs)
+    raise ValueError(f"Backend desconocido '{name}'; opciones: {BACKEND_NAMES}.")
+
+
+_backends: Dict[str, VectorBackend] = {}
+_lock = threading.Lock()
+
+
+def get_backend(name: Optional[str] = None) -> VectorBackend:
+    """Backend compartido por el proceso (`RAG_BACKEND` por defecto)."""
+    name = name or RAG_BACKEND
+    backend = _backends.get(name)
+    if backend is None:
+        with _lock:
+            backend = _backends.get(name)
+            if backend is None:
+                backend = _backends[name] = create_backend(name)
+    return backend
+
+
+def open_backend() -> None:
+    get_backend().open()
+
+
+def close_backends() -> None:
+    with _lock:
+        backends = list(_backends.values())
+        _backends.clear()
+    for backend in backends:
+        try:
+            backend.close()
+        except Exception as e:
+            logger.warning(f"Error cerrando el backend '{backend.name}': {e}")
+
+
+def get_retriever(embeddings, name: Optional[str] = None) -> BackendRetriever:
+    """Retriever del RAG sobre el backend configurado."""
+    backend = get_backend(name)
+    search_type = RAG_SEARCH_TYPE
+    if search_type not in backend.search_types:
+        logger.warning(f"El backend '{backend.name}' no soporta '{search_type}'; se usa 'vector'.")
+        search_type = "vector"
+    # Cachea embedding de la consulta y documentos recuperados (ver retrieval_cache)
+    return BackendRetriever(backend=backend, embeddings=CachedEmbeddings(embeddings), search_type=search_type)
+
+
+# --- Benchmark ---
+
+# Destinos aislados para no tocar la colección en producción
+BENCHMARK_TARGETS = {
+    "weaviate": {"collection_name": "RagBenchmark"},
+    "alloydb": {"table_name": "rag_benchmark"},
+    "local": {"directory": ".rag_index_benchmark", "fallback": None},
+}
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def benchmark(paths: List[str], backends: List[str], queries: int = 50, k: int = 3, batch_size: int = 64) -> dict:
+    """
+    Compara backends sobre el mismo corpus.
+
+    Fragmenta y embebe el corpus una sola vez, escribe los mismos vectores en
+    cada backend (destino aislado, ver `BENCHMARK_TARGETS`) y mide:
+    throughput de escritura (fragmentos/s), latencia p50/p95 por modo de
+    búsqueda y recall@k frente a la búsqueda exacta por coseno. Las consultas
+    son los primeros 200 caracteres de fragmentos del corpus elegidos al azar.
+    Al terminar borra lo escrito.
+    """
+    import numpy as np
+    import agent, ingestion
+
+    chunks = list({chunk.hash: chunk for chunk in ingestion.iter_chunks(paths)}.values())
+    if not chunks:
+        raise ValueError("El corpus no tiene fragmentos.")
+    embeddings = agent.get_embeddings()
+    vectors = []
+    for start in range(0, len(chunks), batch_size):
+        batch = [chunk.text for chunk in chunks[start:start + batch_size]]
+        vectors.extend(ingestion.with_retry(embeddings.embed_documents, batch))
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    sample = random.Random(0).sample(chunks, min(queries, len(chunks)))
+    query_texts = [chunk.text[:200] for chunk in sample]
+    query_vectors = [embeddings.embed_query(text) for text in query_texts]
+    ids = [chunk.id for chunk in chunks]
+    truth = []
+    for vector in query_vectors:
+        scores = matrix @ (np.asarray(vector, dtype=np.float32) / np.linalg.norm(vector))
+        truth.append({ids[i] for i in np.argsort(-scores)[:k]})
+
+    report = {"chunks": len(chunks), "queries": len(query_texts), "k": k, "backends": {}}
+    for name in backends:
+        backend = create_backend(name, **BENCHMARK_TARGETS.get(name, {}))
+        result = {}
+        try:
+            start = time.perf_counter()
+            for i in range(0, len(chunks), batch_size):
+                batch = chunks[i:i + batch_size]
+                backend.add([c.id for c in batch], [c.text for c in batch], vectors[i:i + batch_size], [c.metadata for c in batch])
+            elapsed = time.perf_counter() - start
+            result["ingest_chunks_per_second"] = round(len(chunks) / elapsed, 2) if elapsed else None
+            for search_type in backend.search_types:
+                latencies, hits = [], 0
+                for text, vector, expected in zip(query_texts, query_vectors, truth):
+                    start = time.perf_counter()
+                    docs = backend.search(text, vector, k, search_type)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    hits += len(expected & {doc.metadata.get("uuid") for doc in docs})
+                result[search_type] = {
+                    "p50_ms": round(_percentile(latencies, 0.5), 3),
+                    "p95_ms": round(_percentile(latencies, 0.95), 3),
+                    "recall_at_k": round(hits / (k * len(truth)), 3),
+                }
+        except Exception as e:
+            logger.error(f"Benchmark de '{name}' falló: {e}", exc_info=True)
+            result["error"] = repr(e)
+        finally:
+            try:
+                backend.delete(ids)
+            except Exception as e:
+                logger.warning(f"No se pudo limpiar '{name}': {e}")
+            backend.close()
+        report["backends"][name] = result
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Benchmark de backends vectoriales del RAG.")
+    parser.add_argument("paths", nargs="+", help="Archivos o directorios del corpus")
+    parser.add_argument("--backends", nargs="+", choices=BACKEND_NAMES, default=list(BACKEND_NAMES))
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+    try:
+        print(json.dumps(benchmark(args.paths, args.backends, args.queries, args.k), indent=2))
+    finally:
+        if "weaviate" in args.backends or "local" in args.backends:
+            import weaviate_db
+            weaviate_db.close_db()
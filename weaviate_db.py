@@ -1,21 +1,29 @@
-
 from weaviate import connect_to_weaviate_cloud, WeaviateClient
 from weaviate.classes.init import Auth
-from weaviate.classes.query import Filter
+from weaviate.classes.query import Filter, MetadataQuery
+from weaviate.classes.data import DataObject
 from weaviate.classes.init import AdditionalConfig, Timeout
-from langchain_weaviate.vectorstores import WeaviateVectorStore
+from langchain_core.documents import Document
 import os
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
 from google.auth.transport.requests import Request
 from google.oauth2.service_account import Credentials
 
 import configs
+from vector_backends import VectorBackend
 
+logger = logging.getLogger(__name__)
 
-wcd_url = os.environ["WCD_URL"]
-wcd_api_key = os.environ["WCD_API_KEY"]
-
-# Weaviate client instance
-weaviate_client: WeaviateClient = None
+# Segundos antes de la expiración del token en que se renueva
+WEAVIATE_TOKEN_REFRESH_MARGIN = int(os.environ.get("WEAVIATE_TOKEN_REFRESH_MARGIN", 600))
+# Cada cuánto (s) se verifica que Weaviate responde
+WEAVIATE_HEALTH_CHECK_INTERVAL = int(os.environ.get("WEAVIATE_HEALTH_CHECK_INTERVAL", 60))
+# Espera antes de cerrar un cliente reemplazado (debe superar el timeout de consulta)
+WEAVIATE_CLOSE_GRACE_SECONDS = int(os.environ.get("WEAVIATE_CLOSE_GRACE_SECONDS", 150))
 
 
 def get_credentials() -> Credentials:
@@ -34,32 +42,267 @@ def get_credentials() -> Credentials:
     return credentials
 
 
+class WeaviateClientManager():
+    """
+    Mantiene el cliente de Weaviate con un token de Vertex vigente.
 
-credentials = get_credentials()
-token = credentials.token
+    Un hilo en segundo plano renueva el token antes de que expire y revisa la
+    salud de la conexión. El token va en el header `X-Goog-Vertex-Api-Key`, que
+    se fija al conectar, así que renovar implica crear un cliente nuevo: se
+    reemplaza de forma atómica y el anterior se cierra después de
+    `WEAVIATE_CLOSE_GRACE_SECONDS`, para no cortar las consultas en curso.
+    """
 
-def connect_to_db():
-    global weaviate_client
-
-    weaviate_client = connect_to_weaviate_cloud(
-            cluster_url=wcd_url,
-            auth_credentials=Auth.api_key(wcd_api_key),
-            headers={'X-Goog-Vertex-Api-Key': token},
-            additional_config=AdditionalConfig(
-                timeout=Timeout(init=300, query=120, insert=240)
+    def __init__(
+        self,
+        refresh_margin: int = WEAVIATE_TOKEN_REFRESH_MARGIN,
+        health_check_interval: int = WEAVIATE_HEALTH_CHECK_INTERVAL,
+        close_grace_seconds: int = WEAVIATE_CLOSE_GRACE_SECONDS,
+    ):
+        self.refresh_margin = refresh_margin
+        self.health_check_interval = health_check_interval
+        self.close_grace_seconds = close_grace_seconds
+        self._client: Optional[WeaviateClient] = None
+        self._credentials: Optional[Credentials] = None
+        self._generation = 0
+        self._lock = threading.RLock()
+        self._reconnect_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._retired: List[threading.Timer] = []
+        self.reconnects = 0
+        self.last_refresh: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def _connect(self) -> WeaviateClient:
+        if self._credentials is None:
+            self._credentials = get_credentials()
+        elif not self._credentials.valid or self._seconds_until_refresh() <= 0:
+            self._credentials.refresh(Request())
+        client = connect_to_weaviate_cloud(
+                cluster_url=os.environ["WCD_URL"],
+                auth_credentials=Auth.api_key(os.environ["WCD_API_KEY"]),
+                headers={'X-Goog-Vertex-Api-Key': self._credentials.token},
+                additional_config=AdditionalConfig(
+                    timeout=Timeout(init=300, query=120, insert=240)
+                )
             )
+        self.last_refresh = time.time()
+        return client
+
+    def get_client(self) -> WeaviateClient:
+        """Devuelve el cliente vigente (conecta en el primer uso)."""
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._connect()
+                client = self._client
+        return client
+
+    def reconnect(self, reason: str = "manual") -> None:
+        """Crea un cliente nuevo, lo publica y retira el anterior con gracia."""
+        # Se conecta fuera de `_lock` para no bloquear a quien pide el cliente
+        with self._reconnect_lock:
+            new_client = self._connect()
+            with self._lock:
+                old_client, self._client = self._client, new_client
+                self._generation += 1
+                self.reconnects += 1
+        logger.info(f"Weaviate reconectado ({reason}), generación {self._generation}.")
+        if old_client is not None:
+            timer = threading.Timer(self.close_grace_seconds, self._close_quietly, args=(old_client,))
+            timer.daemon = True
+            timer.start()
+            self._retired = [t for t in self._retired if t.is_alive()] + [timer]
+
+    @staticmethod
+    def _close_quietly(client: WeaviateClient) -> None:
+        try:
+            client.close()
+        except Exception as e:
+            logger.warning(f"Error cerrando un cliente de Weaviate reemplazado: {e}")
+
+    def _seconds_until_refresh(self) -> float:
+        expiry: Optional[datetime] = self._credentials.expiry if self._credentials else None
+        if expiry is None:
+            return float(self.health_check_interval)
+        # google-auth expresa `expiry` como datetime UTC sin zona horaria
+        remaining = (expiry - datetime.utcnow()).total_seconds()
+        return remaining - self.refresh_margin
+
+    def is_healthy(self) -> bool:
+        client = self._client
+        if client is None:
+            return False
+        try:
+            return bool(client.is_ready())
+        except Exception as e:
+            self.last_error = repr(e)
+            return False
+
+    def _run(self) -> None:
+        while True:
+            wait = max(0.0, min(self._seconds_until_refresh(), self.health_check_interval))
+            if self._stop.wait(wait):
+                return
+            try:
+                if self._seconds_until_refresh() <= 0:
+                    self.reconnect("token por expirar")
+                elif not self.is_healthy():
+                    self.reconnect("health check fallido")
+                self.last_error = None
+            except Exception as e:
+                # Se reintenta en la siguiente vuelta; el cliente anterior sigue en uso
+                self.last_error = repr(e)
+                logger.error(f"Error renovando el cliente de Weaviate: {e}")
+                if self._stop.wait(min(30, self.health_check_interval)):
+                    return
+
+    def start(self) -> None:
+        """Conecta y arranca el hilo de renovación (idempotente)."""
+        self.get_client()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="weaviate-refresh", daemon=True)
+                self._thread.start()
+
+    def close(self) -> None:
+        """Detiene el hilo y cierra el cliente vigente y los retirados."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        for timer in self._retired:
+            if timer.is_alive():
+                timer.cancel()
+                self._close_quietly(timer.args[0])
+        self._retired = []
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            self._close_quietly(client)
+
+    def stats(self) -> dict:
+        expiry = self._credentials.expiry if self._credentials else None
+        return {
+            "connected": self._client is not None,
+            "healthy": self.is_healthy(),
+            "generation": self._generation,
+            "reconnects": self.reconnects,
+            "token_expires_in": (expiry - datetime.utcnow()).total_seconds() if expiry else None,
+            "last_refresh": self.last_refresh,
+            "last_error": self.last_error,
+        }
+
+
+client_manager = WeaviateClientManager()
+
+
+def connect_to_db():
+    """Connects the managed client and starts token refresh (called from the FastAPI lifespan, not at import)."""
+    client_manager.start()
+
+
+def get_client() -> WeaviateClient:
+    return client_manager.get_client()
+
+
+def build_filters(filters: Optional[Dict[str, Any]]) -> Optional[Filter]:
+    """
+    Convierte `{propiedad: valor}` en un filtro de Weaviate.
+
+    Un valor lista filtra por cualquiera de sus elementos; varias propiedades
+    se combinan con AND.
+    """
+    if not filters:
+        return None
+    conditions = [
+        Filter.by_property(name).contains_any(list(value)) if isinstance(value, (list, tuple, set))
+        else Filter.by_property(name).equal(value)
+        for name, value in filters.items()
+    ]
+    return conditions[0] if len(conditions) == 1 else Filter.all_of(conditions)
+
+
+class WeaviateBackend(VectorBackend):
+    """
+    Backend sobre una colección de Weaviate con búsqueda por vector, BM25 o híbrida.
+
+    Usa el vector de la consulta ya calculado (y cacheado) en lugar del
+    vectorizador de Weaviate. Cada documento lleva `score` en `metadata`:
+    similitud coseno (1 - distancia) en `vector`, puntaje BM25 en `bm25` y
+    puntaje de fusión en [0, 1] en `hybrid`.
+    """
+
+    name = "weaviate"
+    search_types = ("vector", "bm25", "hybrid")
+
+    def __init__(self, collection_name: str = "Rag", text_key: str = "content", manager: WeaviateClientManager = None):
+        self.collection_name = collection_name
+        self.text_key = text_key
+        self.manager = manager or client_manager
+
+    def _collection(self):
+        # El cliente se resuelve en cada llamada para usar el vigente (ver WeaviateClientManager)
+        return self.manager.get_client().collections.get(self.collection_name)
+
+    def open(self) -> None:
+        self.manager.start()
+
+    def _to_document(self, obj, search_type: str) -> Document:
+        properties = dict(obj.properties)
+        content = properties.pop(self.text_key, "")
+        if search_type == "vector":
+            score = 1 - obj.metadata.distance if obj.metadata.distance is not None else None
+        else:
+            score = obj.metadata.score
+        return Document(
+            page_content=content or "",
+            metadata={**properties, "uuid": str(obj.uuid), "score": score, "search_type": search_type},
         )
 
-def get_weaviate_retriever(embeddings):
-    global weaviate_client
-    vectorstore = WeaviateVectorStore(weaviate_client, "Rag", "content", embedding=embeddings)
-    retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 3})
-    return retriever
+    def search(self, query, vector, k, search_type="vector", alpha=0.5, filters=None) -> List[Document]:
+        self.check_search_type(search_type)
+        collection = self._collection()
+        where = build_filters(filters)
+        if search_type == "vector":
+            result = collection.query.near_vector(
+                near_vector=vector, limit=k, filters=where,
+                return_metadata=MetadataQuery(distance=True),
+            )
+        elif search_type == "bm25":
+            result = collection.query.bm25(
+                query=query, limit=k, filters=where,
+                return_metadata=MetadataQuery(score=True),
+            )
+        else:
+            result = collection.query.hybrid(
+                query=query, vector=vector, alpha=alpha, limit=k, filters=where,
+                return_metadata=MetadataQuery(score=True),
+            )
+        return [self._to_document(obj, search_type) for obj in result.objects]
 
+    def add(self, ids, texts, vectors, metadatas) -> int:
+        result = self._collection().data.insert_many([
+            DataObject(properties={self.text_key: text, **metadata}, uuid=id_, vector=vector)
+            for id_, text, vector, metadata in zip(ids, texts, vectors, metadatas)
+        ])
+        # Un id existente significa que el fragmento ya estaba indexado
+        errors = [e.message for e in result.errors.values() if "already exists" not in e.message]
+        if errors:
+            raise RuntimeError(f"{len(errors)} objetos no se insertaron en Weaviate: {errors[0]}")
+        return len(ids) - len(result.errors)
 
-def close_db():
-    global weaviate_client
-    if weaviate_client:
-            weaviate_client.close()
+    def delete(self, ids) -> None:
+        collection = self._collection()
+        for start in range(0, len(ids), 100):
+            collection.data.delete_many(where=Filter.by_id().contains_any(ids[start:start + 100]))
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "collection": self.collection_name, **self.manager.stats()}
 
-connect_to_db()
\ No newline at end of file
+
+def close_db():
+    client_manager.close()
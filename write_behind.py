@@ -0,0 +1,257 @@
+import os
+import time
+import logging
+import threading
+from itertools import islice
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import connection
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto se escriben las actualizaciones pendientes
+WRITE_BEHIND_FLUSH_SECONDS = float(os.environ.get("WRITE_BEHIND_FLUSH_SECONDS", 2))
+# Máximo de filas por escritura; al llegar a este número se escribe sin esperar el intervalo
+WRITE_BEHIND_BATCH_SIZE = int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", 500))
+# Claves pendientes permitidas antes de aplicar contrapresión
+WRITE_BEHIND_MAX_PENDING = int(os.environ.get("WRITE_BEHIND_MAX_PENDING", 10000))
+# Espera máxima (segundos) con la cola llena antes de escribir en línea
+WRITE_BEHIND_PUT_TIMEOUT = float(os.environ.get("WRITE_BEHIND_PUT_TIMEOUT", 1))
+# Pasadas fallidas que tolera una clave antes de descartarla
+WRITE_BEHIND_MAX_RETRIES = int(os.environ.get("WRITE_BEHIND_MAX_RETRIES", 3))
+
+
+def _chunks(items: Dict[Any, Any], size: int):
+    iterator = iter(items.items())
+    while True:
+        chunk = dict(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class WriteBehindQueue():
+    """
+    Cola en proceso para escrituras no críticas (p. ej. `updated_at` de la sesión).
+
+    Cada tipo de escritura se registra con una función que escribe un lote
+    {clave: valor} y una función que combina dos valores de la misma clave:
+    las actualizaciones repetidas de una clave se fusionan mientras esperan.
+    Un hilo escribe los lotes cada `flush_seconds` o al juntar `batch_size`
+    claves. Nada se pierde en silencio:
+
+    - Con `max_pending` claves pendientes, `put` espera a que se libere
+      espacio hasta `put_timeout` y, si no, escribe en línea.
+    - Si la cola no está corriendo (antes de `start` o después de `stop`),
+      `put` escribe en línea.
+    - Si un lote falla, sus claves se escriben una por una para aislar las
+      que fallan; esas vuelven a la cola y, tras `max_retries` pasadas
+      fallidas, se descartan y se registran como error.
+    - `stop` vacía la cola antes de terminar y registra como error lo que no
+      se pudo escribir.
+    """
+
+    def __init__(
+        self,
+        flush_seconds: float = WRITE_BEHIND_FLUSH_SECONDS,
+        batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+        max_pending: int = WRITE_BEHIND_MAX_PENDING,
+        put_timeout: float = WRITE_BEHIND_PUT_TIMEOUT,
+        max_retries: int = WRITE_BEHIND_MAX_RETRIES,
+    ):
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self._writers: Dict[str, Tuple[Callable, Callable]] = {}
+        self._pending: Dict[str, Dict[Any, Any]] = {}
+        self._size = 0
+        self._attempts: Dict[Tuple[str, Any], int] = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self.enqueued = 0
+        self.coalesced = 0
+        self.written = 0
+        self.batches = 0
+        self.inline_writes = 0
+        self.failures = 0
+        self.dropped = 0
+        self.last_error: Optional[str] = None
+
+    def register(self, kind: str, write: Callable[[Dict[Any, Any]], None], merge: Callable[[Any, Any], Any] = lambda old, new: new) -> None:
+        """Registra un tipo de escritura; `merge(anterior, nuevo)` combina valores de la misma clave."""
+        self._writers[kind] = (write, merge)
+
+    def _merge_pending(self, kind: str, key, value) -> bool:
+        """Fusiona con la clave pendiente si existe (llamar con `_cond` tomado)."""
+        pending = self._pending.get(kind)
+        if pending is None or key not in pending:
+            return False
+        pending[key] = self._writers[kind][1](pending[key], value)
+        self.coalesced += 1
+        return True
+
+    def put(self, kind: str, key, value) -> None:
+        """Encola una escritura; solo bloquea si la cola está llena."""
+        write, _ = self._writers[kind]
+        with self._cond:
+            if self._running:
+                deadline = time.monotonic() + self.put_timeout
+                while not self._merge_pending(kind, key, value):
+                    if self._size < self.max_pending:
+                        self._pending.setdefault(kind, {})[key] = value
+                        self._size += 1
+                        self.enqueued += 1
+                        if self._size >= self.batch_size:
+                            self._cond.notify_all()
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._running:
+                        break
+                    self._cond.notify_all() # Despierta al hilo de escritura
+                    self._cond.wait(remaining)
+                else:
+                    return
+            self.inline_writes += 1
+        write({key: value})
+
+    def flush(self) -> int:
+        """Escribe todo lo pendiente. Devuelve cuántas claves se escribieron."""
+        with self._flush_lock:
+            with self._cond:
+                pending, self._pending, self._size = self._pending, {}, 0
+                self._cond.notify_all() # Hay espacio otra vez
+            written = 0
+            for kind, items in pending.items():
+                write, _ = self._writers[kind]
+                for chunk in _chunks(items, self.batch_size):
+                    try:
+                        write(chunk)
+                    except Exception as e:
+                        self.failures += 1
+                        self.last_error = repr(e)
+                        logger.error(f"Error escribiendo {len(chunk)} '{kind}' en segundo plano: {e}")
+                        written += self._write_each(kind, chunk)
+                        continue
+                    self._written(kind, chunk)
+                    written += len(chunk)
+            return written
+
+    def _written(self, kind: str, items: Dict[Any, Any]) -> None:
+        self.written += len(items)
+        self.batches += 1
+        for key in items:
+            self._attempts.pop((kind, key), None)
+
+    def _write_each(self, kind: str, items: Dict[Any, Any]) -> int:
+        """
+        Escribe clave por clave un lote que falló, para que una clave inválida
+        no bloquee a las demás. Las que fallan vuelven a la cola hasta
+        `max_retries` pasadas; después se descartan.
+        """
+        write, _ = self._writers[kind]
+        written, failed = 0, {}
+        for key, value in items.items():
+            if len(items) > 1:
+                try:
+                    write({key: value})
+                except Exception as e:
+                    self.last_error = repr(e)
+                else:
+                    self._written(kind, {key: value})
+                    written += 1
+                    continue
+            attempts = self._attempts.get((kind, key), 0) + 1
+            if attempts >= self.max_retries:
+                self._attempts.pop((kind, key), None)
+                self.dropped += 1
+                logger.error(f"Se descarta la escritura '{kind}' de {key!r} tras {attempts} intentos: {self.last_error}")
+            else:
+                self._attempts[(kind, key)] = attempts
+                failed[key] = value
+        if failed:
+            self._requeue(kind, failed)
+        return written
+
+    def _requeue(self, kind: str, items: Dict[Any, Any]) -> None:
+        """Devuelve un lote fallido a la cola; lo encolado después tiene precedencia."""
+        merge = self._writers[kind][1]
+        with self._cond:
+            pending = self._pending.setdefault(kind, {})
+            for key, value in items.items():
+                if key in pending:
+                    pending[key] = merge(value, pending[key])
+                else:
+                    pending[key] = value
+                    self._size += 1
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            with self._cond:
+                self._cond.wait_for(lambda: self._size >= self.batch_size or self._stop.is_set(), timeout=self.flush_seconds)
+            if self._stop.is_set():
+                return
+            failures = self.failures
+            try:
+                self.flush()
+            except Exception as e:
+                self.last_error = repr(e)
+                logger.error(f"Error en la cola de escritura diferida: {e}")
+            if self.failures > failures:
+                # Los lotes fallidos volvieron a la cola: espera antes de reintentar
+                self._stop.wait(self.flush_seconds)
+
+    def start(self) -> None:
+        """Arranca el hilo de escritura (idempotente)."""
+        with self._cond:
+            self._running = True
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def stop(self, attempts: int = 3) -> int:
+        """
+        Detiene el hilo y vacía la cola (lo llama el lifespan al apagar).
+
+        Desde aquí `put` escribe en línea. Devuelve cuántas claves no se
+        pudieron escribir tras `attempts` intentos.
+        """
+        with self._cond:
+            self._running = False
+            self._stop.set()
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_seconds + 5)
+            self._thread = None
+        for _ in range(attempts):
+            self.flush()
+            if not self._size:
+                return 0
+        logger.error(f"Se perdieron {self._size} escrituras diferidas al apagar: {({kind: len(items) for kind, items in self._pending.items()})}")
+        return self._size
+
+    def stats(self) -> dict:
+        with self._cond:
+            pending = self._size
+        return {
+            "running": self._running,
+            "pending": pending,
+            "enqueued": self.enqueued,
+            "coalesced": self.coalesced,
+            "written": self.written,
+            "batches": self.batches,
+            "inline_writes": self.inline_writes,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "last_error": self.last_error,
+        }
+
+
+queue = WriteBehindQueue()
+# Última actividad de cada sesión: solo importa el valor más reciente
+queue.register("session_touch", connection.touch_sessions, max)